@@ -0,0 +1,267 @@
+"""
+Offline moderation rule backtesting.
+
+Replays a chat's stored analyzed messages against a candidate rule set and
+counts the restrictions each rule would have produced. The chat history is
+turned into columns once (per message: user, time and a messages x languages
+probability matrix; per restriction: user, time, type, chat and duration), rows
+sorted by (user, time), and every condition is evaluated for all messages at
+once with numpy: thresholds are array comparisons, rolling windows cumulative
+sums over user runs, and history and rate lookups binary searches over
+(user, time) keys.
+
+Results approximate the live engine:
+- Only analyzed messages are stored, so message_rate sees the sampled messages
+  only (all of them when analysis_frequency is 1).
+- History conditions read the recorded restriction history, not the
+  restrictions the candidate rules would have added, and use exact time
+  windows instead of hour buckets.
+- Language samples use the candidate allowed_languages for every message.
+
+numpy is an optional dependency of the backend; without it `numpy_available()`
+is False and backtests are refused.
+"""
+import time
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional
+from middlewares.database.models import ChatSettings, ConditionRelationType, ModerationRule, RuleCondition, RuleConditionType
+from settings import get_settings
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the deployment
+    np = None
+
+settings = get_settings()
+
+def numpy_available() -> bool:
+    return np is not None
+
+def _parse_timestamp(value: Any) -> float:
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+class ChatHistoryColumns:
+    """Columnar view of one chat's analyzed messages and its users' restrictions"""
+    def __init__(self, user_docs: Iterable[Dict[str, Any]], chat_id):
+        self.chat_id = str(chat_id)
+        message_users, message_times, cells_row, cells_lang, cells_prob = [], [], [], [], []
+        restriction_users, restriction_times, restriction_types, restriction_in_chat, restriction_durations = [], [], [], [], []
+        self.recorded_by_rule: Dict[int, int] = {}
+        language_index: Dict[str, int] = {}
+
+        for doc in user_docs:
+            user_id = int(doc["user_id"])
+            for message in (doc.get("chat_history") or {}).get(self.chat_id, []):
+                analysis_result = message.get("analysis_result")
+                if not analysis_result:
+                    continue
+                row = len(message_users)
+                message_users.append(user_id)
+                message_times.append(_parse_timestamp(message.get("timestamp")))
+                for lang_result in analysis_result:
+                    cells_row.append(row)
+                    cells_lang.append(language_index.setdefault(lang_result.get("lang", ""), len(language_index)))
+                    cells_prob.append(lang_result.get("prob", 0.0))
+            for record in doc.get("restriction_history") or []:
+                in_chat = str(record.get("chat_id")) == self.chat_id
+                restriction_users.append(user_id)
+                restriction_times.append(_parse_timestamp(record.get("timestamp")))
+                restriction_types.append(record.get("restriction_type", ""))
+                restriction_in_chat.append(in_chat)
+                restriction_durations.append(record.get("duration_seconds") or 0.0)
+                if in_chat and record.get("rule_index") is not None:
+                    self.recorded_by_rule[record["rule_index"]] = self.recorded_by_rule.get(record["rule_index"], 0) + 1
+
+        self.languages = list(language_index)
+        self.language_index = language_index
+
+        users = np.asarray(message_users, dtype=np.int64)
+        times = np.asarray(message_times, dtype=np.float64)
+        probs = np.zeros((len(message_users), len(language_index)), dtype=np.float32)
+        if cells_row:
+            # Highest probability per (message, language), like RuleContext.language_probs
+            np.maximum.at(probs, (np.asarray(cells_row), np.asarray(cells_lang)), np.asarray(cells_prob, dtype=np.float32))
+
+        r_users = np.asarray(restriction_users, dtype=np.int64)
+        r_times = np.asarray(restriction_times, dtype=np.float64)
+        self.origin = min(times.min(initial=np.inf), r_times.min(initial=np.inf))
+        if not np.isfinite(self.origin):
+            self.origin = 0.0
+        span = max(times.max(initial=self.origin), r_times.max(initial=self.origin)) - self.origin
+        # (user, time) keys: users get disjoint bands of the time axis
+        self.band = span + 1.0
+
+        order = np.lexsort((times, users))
+        self.users = users[order]
+        self.times = times[order] - self.origin
+        self.probs = probs[order]
+        self.unique_users, self.user_rank = np.unique(self.users, return_inverse=True)
+        self.keys = self.user_rank * self.band + self.times
+        self.band_start = self.user_rank * self.band
+        # Position of each message among its user's messages
+        run_starts = np.flatnonzero(np.r_[True, self.users[1:] != self.users[:-1]]) if len(self.users) else np.zeros(0, dtype=np.int64)
+        run_lengths = np.diff(np.r_[run_starts, len(self.users)])
+        self.run_start = np.repeat(run_starts, run_lengths)
+        self.position = np.arange(len(self.users)) - self.run_start
+
+        # Restrictions of users without analyzed messages can't affect any message
+        known = np.isin(r_users, self.unique_users)
+        self.r_rank = np.searchsorted(self.unique_users, r_users[known])
+        self.r_times = r_times[known] - self.origin
+        self.r_types = np.asarray(restriction_types, dtype=object)[known]
+        self.r_in_chat = np.asarray(restriction_in_chat, dtype=bool)[known]
+        self.r_durations = np.asarray(restriction_durations, dtype=np.float64)[known]
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def non_allowed_columns(self, allowed_languages: Iterable[str]):
+        allowed = set(allowed_languages or [])
+        return np.asarray([lang not in allowed for lang in self.languages], dtype=bool)
+
+    def restriction_keys(self, types: Optional[FrozenSet[str]], this_chat_only: bool):
+        """Sorted (user, time) keys and durations of the restrictions a history condition counts"""
+        selected = np.ones(len(self.r_rank), dtype=bool)
+        if types is not None:
+            selected &= np.isin(self.r_types, list(types))
+        if this_chat_only:
+            selected &= self.r_in_chat
+        keys = self.r_rank[selected] * self.band + self.r_times[selected]
+        order = np.argsort(keys, kind="stable")
+        return keys[order], self.r_durations[selected][order]
+
+def _none(columns: ChatHistoryColumns):
+    return np.zeros(len(columns), dtype=bool)
+
+def _restriction_types(values: Dict[str, Any]) -> Optional[FrozenSet[str]]:
+    types = values.get("restriction_type", [])
+    if isinstance(types, str):
+        types = [types]
+    if "any" in types:
+        return None
+    return frozenset(getattr(t, "value", t) for t in types)
+
+def _language_confidence(columns, condition: RuleCondition, chat_settings: ChatSettings):
+    values = condition.values or {}
+    column = columns.language_index.get(values.get("language", ""))
+    if column is None:
+        return _none(columns)
+    return columns.probs[:, column] >= values.get("threshold", 0.0)
+
+def _not_in_allowed_languages(columns, condition: RuleCondition, chat_settings: ChatSettings):
+    non_allowed = columns.non_allowed_columns(chat_settings.allowed_languages)
+    if not non_allowed.any():
+        return _none(columns)
+    return (columns.probs[:, non_allowed] >= (condition.values or {}).get("threshold", 0.0)).any(axis=1)
+
+def _language_samples(columns, chat_settings: ChatSettings):
+    non_allowed = columns.non_allowed_columns(chat_settings.allowed_languages)
+    return np.minimum(1.0, columns.probs[:, non_allowed].sum(axis=1, dtype=np.float64))
+
+def _rolling_share(columns, condition: RuleCondition, chat_settings: ChatSettings):
+    values = condition.values or {}
+    messages = int(values.get("messages", 10))
+    if messages <= 0:
+        return _none(columns)
+    # The live window holds at most LANGUAGE_WINDOW_SIZE samples
+    span = min(messages, settings.LANGUAGE_WINDOW_SIZE)
+    hits = _language_samples(columns, chat_settings) >= values.get("threshold", 0.5)
+    cumulative = np.r_[0, np.cumsum(hits)]
+    rows = np.arange(len(columns))
+    first = np.maximum(rows - span + 1, columns.run_start)
+    return (cumulative[rows + 1] - cumulative[first]) / messages >= values.get("share", 0.5)
+
+def _ewma(columns, condition: RuleCondition, chat_settings: ChatSettings):
+    values = condition.values or {}
+    alpha = values.get("alpha", 0.2)
+    samples = _language_samples(columns, chat_settings)
+    average = np.zeros(len(columns), dtype=np.float64)
+    # Closed form of the live recurrence over the window: sum of alpha * (1 - alpha)^m * x[i - m]
+    for lag in range(settings.LANGUAGE_WINDOW_SIZE):
+        weight = alpha * (1 - alpha) ** lag
+        if weight < 1e-9 or lag >= len(columns):
+            break
+        if lag == 0:
+            average += weight * samples
+        else:
+            average[lag:] += weight * samples[:-lag] * (columns.position[lag:] >= lag)
+    return average >= values.get("threshold", 0.5)
+
+def _message_rate(columns, condition: RuleCondition, chat_settings: ChatSettings):
+    values = condition.values or {}
+    since = np.maximum(columns.keys - values.get("seconds", 60.0), columns.band_start)
+    count = np.arange(len(columns)) - np.searchsorted(columns.keys, since, side="left") + 1
+    return count > int(values.get("messages", 10))
+
+def _previous_restriction_count(columns, condition: RuleCondition, chat_settings: ChatSettings):
+    values = condition.values or {}
+    keys, _ = columns.restriction_keys(_restriction_types(values), condition.this_chat_only)
+    count = np.searchsorted(keys, columns.keys, side="left") - np.searchsorted(keys, columns.band_start, side="left")
+    return count >= values.get("count", 0)
+
+def _previous_restriction_time_length(columns, condition: RuleCondition, chat_settings: ChatSettings):
+    values = condition.values or {}
+    keys, durations = columns.restriction_keys(_restriction_types(values), condition.this_chat_only)
+    cumulative = np.r_[0.0, np.cumsum(durations)]
+    since = np.maximum(columns.keys - values.get("window_hours", 24.0) * 3600, columns.band_start)
+    total = cumulative[np.searchsorted(keys, columns.keys, side="left")] - cumulative[np.searchsorted(keys, since, side="left")]
+    return total >= values.get("seconds", 0)
+
+CONDITION_EVALUATORS = {
+    RuleConditionType.SINGLE_MESSAGE_LANGUAGE_CONFIDENCE.value: _language_confidence,
+    RuleConditionType.SINGLE_MESSAGE_CONFIDENCE_NOT_IN_ALLOWED_LANGUAGES.value: _not_in_allowed_languages,
+    RuleConditionType.ROLLING_SHARE_NOT_IN_ALLOWED_LANGUAGES.value: _rolling_share,
+    RuleConditionType.EWMA_NOT_IN_ALLOWED_LANGUAGES.value: _ewma,
+    RuleConditionType.MESSAGE_RATE.value: _message_rate,
+    RuleConditionType.PREVIOUS_RESTRICTION_TYPE_COUNT.value: _previous_restriction_count,
+    RuleConditionType.PREVIOUS_RESTRICTION_TYPE_TIME_LENGTH.value: _previous_restriction_time_length,
+}
+
+def evaluate_rule(columns: ChatHistoryColumns, rule: ModerationRule, chat_settings: ChatSettings):
+    """Boolean array: which messages trigger the rule"""
+    masks = []
+    for condition in rule.conditions:
+        evaluator = CONDITION_EVALUATORS.get(getattr(condition.type, "value", condition.type))
+        masks.append(evaluator(columns, condition, chat_settings) if evaluator else _none(columns))
+    if not masks:
+        return _none(columns)
+    if rule.condition_relation == ConditionRelationType.AND:
+        return np.logical_and.reduce(masks)
+    return np.logical_or.reduce(masks)
+
+def backtest_rules(columns: ChatHistoryColumns, rules: List[ModerationRule], chat_settings: ChatSettings) -> Dict[str, Any]:
+    """Restrictions every rule would have produced over the stored history"""
+    started_at = time.perf_counter()
+    report_rules = []
+    any_rule = _none(columns)
+    for index, rule in enumerate(rules):
+        triggered = evaluate_rule(columns, rule, chat_settings)
+        any_rule |= triggered
+        report_rules.append({
+            "index": index,
+            "name": rule.name,
+            "restrictions": int(triggered.sum()),
+            "users": int(np.unique(columns.users[triggered]).size),
+            "recorded": columns.recorded_by_rule.get(index, 0),
+        })
+    return {
+        "messages": len(columns),
+        "users": int(columns.unique_users.size),
+        "messages_restricted": int(any_rule.sum()),
+        "rules": report_rules,
+        "duration_ms": (time.perf_counter() - started_at) * 1000,
+    }
+
+def backtest_chat(user_docs: Iterable[Dict[str, Any]], chat_id, rules: List[ModerationRule], chat_settings: ChatSettings) -> Dict[str, Any]:
+    """Build the columns of a chat and backtest the rules on them (CPU-bound, run it off the event loop)"""
+    started_at = time.perf_counter()
+    columns = ChatHistoryColumns(user_docs, chat_id)
+    load_ms = (time.perf_counter() - started_at) * 1000
+    report = backtest_rules(columns, rules, chat_settings)
+    report["columns_ms"] = load_ms
+    return report
@@ -0,0 +1,152 @@
+"""
+Background sweeper for expired restrictions.
+
+Every RESTRICTION_SWEEP_INTERVAL_SECONDS it reads the users whose indexed
+next_restriction_expiry has passed, RESTRICTION_SWEEP_BATCH_SIZE at a time,
+pulls their expired entries from User.restrictions in one bulk write per batch
+and stores each user's next expiry. restriction_history keeps the record of
+every restriction, so nothing is lost by removing them.
+
+Telegram lifts restrictions by itself at until_date, except when until_date is
+less than 30 seconds or more than 366 days away, which it treats as forever.
+Only those restrictions get a LIFT_RESTRICTION message to the bot.
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+from middlewares.database.db import database
+from middlewares.database.models import RestrictionType
+from middlewares.rabbitmq.queue_manager import rabbitmq_manager
+from middlewares.rabbitmq.mq_enums import TelegramQueueMessageType
+from middlewares.monitoring.metrics import registry
+from settings import get_settings
+from backend.utils.logging_config import logger
+
+settings = get_settings()
+logger = logger.getChild('expiry_sweeper')
+
+removed_counter = registry.counter("restriction_sweeper_removed_total", "Expired restrictions removed, by restriction type", ["restriction_type"])
+lift_counter = registry.counter("restriction_sweeper_lift_actions_total", "Lift actions sent to the bot for restrictions Telegram does not lift itself")
+lag_histogram = registry.histogram(
+    "restriction_sweeper_lag_seconds", "Time between a restriction expiring and the sweeper removing it",
+    buckets=(1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 900.0, 3600.0)
+)
+sweep_duration_histogram = registry.histogram("restriction_sweeper_sweep_duration_seconds", "Duration of one sweep over all expired restrictions")
+last_sweep_gauge = registry.gauge("restriction_sweeper_last_sweep_timestamp_seconds", "Unix time of the last completed sweep")
+
+# Durations Telegram applies as given; outside this range until_date means forever
+TELEGRAM_MIN_UNTIL_SECONDS = 30
+TELEGRAM_MAX_UNTIL_SECONDS = 366 * 24 * 3600
+LIFTABLE_TYPES = {RestrictionType.TIMEOUT.value, RestrictionType.TEMPORARY_BAN.value}
+
+def _as_datetime(value: Any):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+def needs_lift_action(restriction: Dict[str, Any]) -> bool:
+    """Whether Telegram treated the restriction as permanent and it has to be lifted explicitly"""
+    if restriction.get("restriction_type") not in LIFTABLE_TYPES:
+        return False
+    duration = restriction.get("duration_seconds") or 0
+    return duration < TELEGRAM_MIN_UNTIL_SECONDS or duration > TELEGRAM_MAX_UNTIL_SECONDS
+
+def plan_removal(doc: Dict[str, Any], now: datetime) -> Tuple[Dict[str, Any], List[Tuple[str, Dict[str, Any]]]]:
+    """The bulk-write removal of one user's expired restrictions, and the (chat_id, restriction) pairs it removes"""
+    chat_ids = []
+    expired = []
+    remaining = []
+    for chat_id, restrictions in (doc.get("restrictions") or {}).items():
+        chat_expired = False
+        for restriction in restrictions:
+            expires_at = _as_datetime(restriction.get("expires_at"))
+            if expires_at is None:
+                continue
+            if expires_at <= now:
+                expired.append((chat_id, restriction))
+                chat_expired = True
+            else:
+                remaining.append(expires_at)
+        if chat_expired:
+            chat_ids.append(chat_id)
+    removal = {
+        "user_id": doc["user_id"],
+        "previous_expiry": doc.get("next_restriction_expiry"),
+        "chat_ids": chat_ids,
+        "next_expiry": min(remaining, default=None),
+    }
+    return removal, expired
+
+class RestrictionExpirySweeper:
+    def __init__(self, interval_seconds: float, batch_size: int):
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+
+    async def sweep_batch(self, now: datetime) -> int:
+        """Remove the expired restrictions of up to batch_size users; returns the users read"""
+        docs = await database.get_users_with_expired_restrictions(now, self.batch_size)
+        if not docs:
+            return 0
+
+        removals = []
+        lift_messages = []
+        for doc in docs:
+            removal, expired = plan_removal(doc, now)
+            removals.append(removal)
+            for chat_id, restriction in expired:
+                removed_counter.inc(restriction_type=restriction.get("restriction_type", "unknown"))
+                lag_histogram.observe(max(0.0, (now - _as_datetime(restriction["expires_at"])).total_seconds()))
+                if needs_lift_action(restriction):
+                    lift_messages.append((
+                        settings.RABBITMQ_TELEGRAM_QUEUE,
+                        f"{chat_id}.{doc['user_id']}.lift.{now.timestamp()}",
+                        {
+                            "message_type": TelegramQueueMessageType.LIFT_RESTRICTION,
+                            "chat_id": chat_id,
+                            "user_id": doc["user_id"],
+                            "restriction_type": restriction.get("restriction_type")
+                        }
+                    ))
+
+        await database.remove_expired_restrictions(removals, now)
+        if lift_messages:
+            outcomes = await rabbitmq_manager.publish_many(lift_messages)
+            lift_counter.inc(sum(1 for outcome in outcomes if outcome.ok))
+        return len(docs)
+
+    async def sweep(self) -> int:
+        """Sweep until no user with expired restrictions is left; returns the users processed"""
+        started_at = time.perf_counter()
+        now = datetime.now()
+        processed = 0
+        while True:
+            read = await self.sweep_batch(now)
+            processed += read
+            if read < self.batch_size:
+                break
+        sweep_duration_histogram.observe(time.perf_counter() - started_at)
+        last_sweep_gauge.set(time.time())
+        if processed:
+            logger.info(f"Removed expired restrictions of {processed} users in {time.perf_counter() - started_at:.2f}s")
+        return processed
+
+    async def run(self):
+        """Sweep every interval_seconds until cancelled"""
+        try:
+            backfilled = await database.backfill_restriction_expiry(self.batch_size)
+            if backfilled:
+                logger.info(f"Indexed restriction expiry of {backfilled} existing users")
+        except Exception as e:
+            logger.error(f"Failed to backfill restriction expiry: {e}")
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Restriction expiry sweep failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+restriction_sweeper = RestrictionExpirySweeper(
+    settings.RESTRICTION_SWEEP_INTERVAL_SECONDS,
+    settings.RESTRICTION_SWEEP_BATCH_SIZE
+)
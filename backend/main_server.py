@@ -1,11 +1,19 @@
 import logging
 import asyncio
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from middlewares.database.db import database
 from settings import get_settings
+from middlewares.rabbitmq.queue_manager import rabbitmq_manager
 from backend.queue_handlers.general_queue.main_handler import consume_general_queue_messages
 from backend.queue_handlers.worker_results_queue.main_handler import consume_worker_results_queue_messages
+from backend.queue_handlers.worker_results_queue.admin_digest import admin_digest
+from backend.functions.restrictions.expiry_sweeper import restriction_sweeper
+from backend.queue_handlers.general_queue.backtest_rules_command import shutdown_backtest_executor
+from middlewares.database.chat_costs import chat_costs, heaviest_chats, COST_FIELDS
 from backend.utils.logging_config import logger
+from middlewares.monitoring.metrics import registry, PROMETHEUS_CONTENT_TYPE
+from middlewares.monitoring.loop_monitor import loop_monitor
 
 settings = get_settings()
 logger = logger.getChild('main_server')
@@ -14,9 +22,44 @@ app = FastAPI()
 
 @app.on_event("startup")
 async def startup_event():
+    if settings.LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
     await database.setup()
     asyncio.create_task(consume_general_queue_messages())
     asyncio.create_task(consume_worker_results_queue_messages())
+    asyncio.create_task(restriction_sweeper.run())
+    asyncio.create_task(chat_costs.run())
+    asyncio.create_task(rabbitmq_manager.monitor_queue_depths(
+        [
+            settings.RABBITMQ_GENERAL_QUEUE,
+            settings.RABBITMQ_COMMANDS_QUEUE,
+            settings.RABBITMQ_REPORTS_QUEUE,
+            settings.RABBITMQ_WORKER_QUEUE,
+            settings.RABBITMQ_RESULT_QUEUE
+        ],
+        settings.QUEUE_METRICS_INTERVAL_SECONDS
+    ))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await admin_digest.flush_all()
+    try:
+        await chat_costs.flush()
+    except Exception as e:
+        logger.error(f"Failed to flush chat costs: {e}")
+    shutdown_backtest_executor()
+    loop_monitor.stop()
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/chat_costs")
+async def chat_costs_report(days: int = 7, metric: str = "db_operations", limit: int = 20):
+    """Heaviest chats over the last `days` days by one of the chat cost metrics"""
+    if metric not in COST_FIELDS:
+        raise HTTPException(status_code=400, detail=f"metric must be one of {', '.join(COST_FIELDS)}")
+    return {"days": days, "metric": metric, "chats": await heaviest_chats(days, metric, min(max(limit, 1), 100))}
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,16 +1,23 @@
 import logging
 import random
+import time
 from settings import get_settings
 from backend.worker_handlers.analyze_language import analyze_language
 from middlewares.database.db import database
 from middlewares.database.models import User, Chat
+from middlewares.database.flood_tracker import flood_tracker
+from middlewares.database.chat_costs import chat_costs
+from middlewares.database.rule_engine import rule_engine, STAGE_INGESTION
+from backend.queue_handlers.worker_results_queue.text_analysis_complete import check_moderation_rules
+from middlewares.monitoring.tracing import start_span, inject
+from middlewares.monitoring.structured_logging import redacted
 
 settings = get_settings()
 
 logger = logging.getLogger(__name__)
 
 async def handle_text_to_analyze(message_data: dict):
-    logger.info(f"Handling TEXT_TO_ANALYZE message:\n{message_data}")
+    logger.info("Handling TEXT_TO_ANALYZE message: %s", redacted(message_data))
     user_id = message_data.get("user_id", 0)
     chat_id = message_data.get("chat_message", {}).get("chat_id", "")
     message_id = message_data.get("chat_message", {}).get("message_id", "")
@@ -19,6 +26,8 @@ async def handle_text_to_analyze(message_data: dict):
     name = message_data.get("name", "")
     username = message_data.get("username", "")
 
+    db_span = start_span("backend.db_ingest")
+
     # Ensure user exists in database
     user_exists = await database.user_exists(user_id)
     if not user_exists:
@@ -50,7 +59,7 @@ async def handle_text_to_analyze(message_data: dict):
         await database.add_user_to_chat(int(chat_id), int(user_id))
     
     # Get chat settings
-    chat = await database.get_chat(int(chat_id))
+    chat = await database.get_effective_chat(int(chat_id))
     chat_settings = chat.chat_settings
     
     # Get user data to check message count
@@ -59,22 +68,34 @@ async def handle_text_to_analyze(message_data: dict):
     if str(chat_id) in user.chat_history:
         user_message_count = len(user.chat_history[str(chat_id)])
     
+    db_span.end()
+
+    # Every message counts towards the message rate, sampled for analysis or not
+    flood_tracker.record(chat_id, user_id)
+    chat_costs.record(chat_id, messages_seen=1)
+    if rule_engine.has_rules(chat, STAGE_INGESTION):
+        with start_span("backend.ingestion_moderation"):
+            await check_moderation_rules(
+                user_id, chat_id, message_id, text, [], name, chat=chat, user=user, stage=STAGE_INGESTION
+            )
+
     # Check if we should analyze this message
+    sampling_span = start_span("backend.sampling")
     met_length_constraints = True
 
     # 1. Check message length constraints
     message_length = len(text)
     if (message_length < chat_settings.min_message_length_for_analysis or 
             message_length > chat_settings.max_message_length_for_analysis):
-        logger.info(f"Skipping analysis: Message length {message_length} outside allowed range "
-                   f"({chat_settings.min_message_length_for_analysis}-{chat_settings.max_message_length_for_analysis})")
+        logger.debug("Skipping analysis: Message length %d outside allowed range (%d-%d)",
+                     message_length, chat_settings.min_message_length_for_analysis, chat_settings.max_message_length_for_analysis)
         met_length_constraints = False
     
     met_random_freq_constraints = True
     # 2. Apply analysis frequency
     # If we've already determined we should skip analysis, don't bother with the random check
     if random.random() > chat_settings.analysis_frequency:
-        logger.info(f"Skipping analysis: Random sampling based on frequency {chat_settings.analysis_frequency}")
+        logger.debug("Skipping analysis: Random sampling based on frequency %s", chat_settings.analysis_frequency)
         met_random_freq_constraints = False
     
     # 3. Check if this is a new member with less than min messages
@@ -83,14 +104,22 @@ async def handle_text_to_analyze(message_data: dict):
     
     # Always send to analysis if user is a new member under the threshold to build up their profile
     if is_new_member:
-        logger.info(f"Analyzing message from new member: {user_message_count + 1}/{chat_settings.new_members_min_analyzed_messages} messages")
+        logger.debug("Analyzing message from new member: %d/%d messages", user_message_count + 1, chat_settings.new_members_min_analyzed_messages)
     
     should_analyze = met_length_constraints and (is_new_member or met_random_freq_constraints)
+    sampling_span.set_attribute("should_analyze", should_analyze)
+    sampling_span.end()
 
     # Send to analysis if all conditions are met
     if should_analyze:
-        logger.info(f"Sending message for language analysis: user_id={user_id}, chat_id={chat_id}, message_id={message_id}")
+        # New members' messages drive moderation directly, so they skip ahead of sampled ones
+        priority = settings.ANALYSIS_PRIORITY_NEW_MEMBER if is_new_member else settings.ANALYSIS_PRIORITY_SAMPLED
+        logger.debug("Sending message for language analysis: user_id=%s, chat_id=%s, message_id=%s, priority=%d", user_id, chat_id, message_id, priority)
         analyze_language.apply_async(
             args=[text, chat_id, message_id, user_id, timestamp, name, username],
-            queue=settings.RABBITMQ_WORKER_QUEUE
+            queue=settings.RABBITMQ_WORKER_QUEUE,
+            priority=priority,
+            # Lets the autoscaler measure how long messages wait in worker_queue;
+            # traced messages also carry their trace context
+            headers=inject({"enqueued_at": time.time()})
         )
\ No newline at end of file
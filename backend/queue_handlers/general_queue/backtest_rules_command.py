@@ -0,0 +1,106 @@
+import asyncio
+import html
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+from pydantic import ValidationError
+from middlewares.database.db import database
+from middlewares.database.models import ModerationRule
+from middlewares.rabbitmq.queue_manager import rabbitmq_manager
+from middlewares.rabbitmq.mq_enums import TelegramQueueMessageType
+from backend.functions.backtest.rule_backtester import backtest_chat, numpy_available
+from settings import get_settings
+from middlewares.monitoring.structured_logging import redacted
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Building the columns is pure Python and holds the GIL, so a thread would
+# still stall the event loop; backtests run in their own processes instead
+_executor: Optional[ProcessPoolExecutor] = None
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.BACKTEST_POOL_SIZE)
+    return _executor
+
+def shutdown_backtest_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+async def handle_backtest_rules_command(message_data: dict):
+    """
+    Backtest moderation rules against the chat's stored history.
+    Candidate rules can be sent in "rules" (ModerationRule dicts); the chat's
+    current rules are used otherwise.
+    """
+    logger.info("Handling BACKTEST_RULES_COMMAND_TG message: %s", redacted(message_data))
+    user_id = message_data.get("user_id", 0)
+    chat_id = message_data.get("chat_id", "")
+    message_id = message_data.get("message_id", "")
+
+    chat = await database.get_effective_chat(int(chat_id))
+    if not numpy_available():
+        report = "Rule backtesting is not available: numpy is not installed on the backend."
+    elif not chat or not chat.users:
+        report = "No users found in this chat!"
+    else:
+        candidate_rules = message_data.get("rules")
+        try:
+            if candidate_rules is not None:
+                rules = [ModerationRule(**rule) for rule in candidate_rules]
+            else:
+                rules = chat.chat_settings.moderation_rules
+        except (ValidationError, TypeError) as e:
+            report = f"The candidate rules are not valid moderation rules:\n<code>{html.escape(str(e))}</code>"
+        else:
+            if not rules:
+                report = "This chat has no moderation rules to backtest."
+            else:
+                user_docs = await database.get_backtest_documents(chat.chat_id, chat.users)
+                try:
+                    result = await asyncio.get_running_loop().run_in_executor(
+                        _get_executor(), backtest_chat, user_docs, chat.chat_id, rules, chat.chat_settings
+                    )
+                except Exception as e:
+                    # The admin still gets an answer; a broken pool is replaced on the next backtest
+                    logger.error("Backtest of chat %s failed: %r", chat_id, e)
+                    if isinstance(e, BrokenProcessPool):
+                        shutdown_backtest_executor()
+                    report = f"The backtest failed:\n<code>{html.escape(str(e) or type(e).__name__)}</code>"
+                else:
+                    logger.info(
+                        "Backtested %d rules over %d messages of chat %s in %.1f ms (+%.1f ms building columns)",
+                        len(rules), result["messages"], chat_id, result["duration_ms"], result["columns_ms"]
+                    )
+                    report = format_backtest_report(result)
+
+    response_data = {
+        "message_type": TelegramQueueMessageType.BACKTEST_RULES_COMMAND_ANSWER,
+        "chat_id": chat_id,
+        "user_id": user_id,
+        "report": report,
+        "message_id": message_id
+    }
+
+    await rabbitmq_manager.store_result(settings.RABBITMQ_TELEGRAM_QUEUE, str(chat_id) + '.' + str(message_id), response_data)
+
+def format_backtest_report(result: Dict[str, Any]) -> str:
+    """Format a backtest result into a readable HTML message"""
+    report = "<b>🧪 Rule Backtest 🧪</b>\n\n"
+    report += f"📝 <b>Analyzed messages replayed:</b> {result['messages']} from {result['users']} users\n"
+    report += f"🚫 <b>Messages that would be restricted:</b> {result['messages_restricted']}\n\n"
+
+    for rule in result["rules"]:
+        name = html.escape(rule["name"]) if rule["name"] else f"Rule {rule['index'] + 1}"
+        report += f"<b>{rule['index'] + 1}. {name}</b>\n"
+        report += f"• Would restrict: <b>{rule['restrictions']}</b> times ({rule['users']} users)\n"
+        report += f"• Recorded so far: {rule['recorded']}\n"
+
+    report += ("\n<i>Only analyzed messages are replayed, and history conditions use the "
+               "recorded restrictions.</i>")
+    return report
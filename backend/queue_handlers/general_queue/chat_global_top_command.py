@@ -7,12 +7,13 @@ from backend.functions.top.chat_global_top_generator import ChatGlobalTopGenerat
 from backend.functions.helpers.get_lang_display import get_language_display
 from backend.functions.helpers.get_chat_link import get_chat_name_with_link
 from settings import get_settings
+from middlewares.monitoring.structured_logging import redacted
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
 async def handle_chat_global_top_command(message_data: dict):
-    logger.info(f"Handling CHAT_GLOBAL_TOP_COMMAND_TG message:\n{message_data}")
+    logger.info("Handling CHAT_GLOBAL_TOP_COMMAND_TG message: %s", redacted(message_data))
     user_id = message_data.get("user_id", 0)
     message_id = message_data.get("message_id", "")
     chat_id = message_data.get("chat_id", "")
@@ -6,12 +6,13 @@ from backend.functions.top.top_generator import ChatTopGenerator
 from backend.functions.helpers.get_lang_display import get_language_display
 from typing import List, Tuple
 from settings import get_settings
+from middlewares.monitoring.structured_logging import redacted
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
 async def handle_chat_top_command(message_data: dict):
-    logger.info(f"Handling CHAT_TOP_COMMAND_TG message:\n{message_data}")
+    logger.info("Handling CHAT_TOP_COMMAND_TG message: %s", redacted(message_data))
     user_id = message_data.get("user_id", 0)
     chat_id = message_data.get("chat_id", "")
     message_id = message_data.get("message_id", "")
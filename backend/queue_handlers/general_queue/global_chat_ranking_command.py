@@ -7,12 +7,13 @@ from backend.functions.top.specific_chat_ranking import SpecificChatRankingGener
 from backend.functions.top.chat_global_top_generator import ChatGlobalTopGenerator
 from backend.functions.helpers.get_lang_display import get_language_display
 from settings import get_settings
+from middlewares.monitoring.structured_logging import redacted
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
 async def handle_global_chat_ranking_command(message_data: dict):
-    logger.info(f"Handling GLOBAL_CHAT_RANKING_COMMAND_TG message:\n{message_data}")
+    logger.info("Handling GLOBAL_CHAT_RANKING_COMMAND_TG message: %s", redacted(message_data))
     user_id = message_data.get("user_id", 0)
     chat_id = message_data.get("chat_id", "")
     message_id = message_data.get("message_id", "")
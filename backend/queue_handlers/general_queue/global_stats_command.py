@@ -7,13 +7,14 @@ from backend.functions.helpers.get_lang_display import get_language_display
 from backend.functions.helpers.get_chat_link import get_chat_name_with_link
 from typing import Dict, Any
 from settings import get_settings
+from middlewares.monitoring.structured_logging import redacted
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
 async def handle_global_stats_command(message_data: dict):
     """Handle the global stats command"""
-    logger.info(f"Handling GLOBAL_STATS_COMMAND_TG message:\n{message_data}")
+    logger.info("Handling GLOBAL_STATS_COMMAND_TG message: %s", redacted(message_data))
     user_id = message_data.get("user_id", 0)
     chat_id = message_data.get("chat_id", "")
     message_id = message_data.get("message_id", "")
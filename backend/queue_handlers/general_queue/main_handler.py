@@ -1,9 +1,12 @@
-import json
 import logging
 from aio_pika import IncomingMessage
 from settings import get_settings
 from middlewares.rabbitmq.queue_manager import rabbitmq_manager
+from middlewares.rabbitmq.codec import decode_message
 from middlewares.rabbitmq.mq_enums import GeneralBackendQueueMessageType
+from middlewares.rabbitmq.routing import WORKLOAD_QUEUES, WORKLOAD_PREFETCH
+from middlewares.rabbitmq.dispatcher import MessageDispatcher
+from middlewares.monitoring.tracing import extract, record_queue_wait, start_span
 from backend.queue_handlers.general_queue.analyze_text import handle_text_to_analyze
 from backend.queue_handlers.general_queue.my_chat_stats_command import handle_my_chat_stats_command
 from backend.queue_handlers.general_queue.my_global_stats_command import handle_my_global_stats_command
@@ -15,50 +18,44 @@ from backend.queue_handlers.general_queue.chat_stats_command import handle_chat_
 from backend.queue_handlers.general_queue.global_stats_command import handle_global_stats_command
 from backend.queue_handlers.general_queue.chat_global_top_command import handle_chat_global_top_command
 from backend.queue_handlers.general_queue.global_chat_ranking_command import handle_global_chat_ranking_command
+from backend.queue_handlers.general_queue.backtest_rules_command import handle_backtest_rules_command
+from middlewares.monitoring.structured_logging import redacted
+from middlewares.database.chat_costs import chat_costs, chat_id_of
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
 async def handle_general_queue_message(message: IncomingMessage):
+    rabbitmq_manager.record_consumed(message)
     async with message.process():
-        message_data = json.loads(message.body).get("result", {})
-        logger.info(f"Received message: {message_data}")
+        message_data = decode_message(message.body, message.content_type).get("result", {})
+        logger.info("Received message: %s", redacted(message_data))
         message_type = message_data.get("message_type", "Unknown")
         
-        match message_type:
-            case GeneralBackendQueueMessageType.TEXT_TO_ANALYZE:
-                logger.info("Handling TEXT_TO_ANALYZE message")
-                await handle_text_to_analyze(message_data)
-            case GeneralBackendQueueMessageType.MY_CHAT_STATS_COMMAND_TG:
-                logger.info("Handling MY_CHAT_STATS_COMMAND_TG message")
-                await handle_my_chat_stats_command(message_data)
-            case GeneralBackendQueueMessageType.MY_GLOBAL_STATS_COMMAND_TG:
-                logger.info("Handling MY_GLOBAL_STATS_COMMAND_TG message")
-                await handle_my_global_stats_command(message_data)
-            case GeneralBackendQueueMessageType.CHAT_TOP_COMMAND_TG:
-                logger.info("Handling CHAT_TOP_COMMAND_TG message")
-                await handle_chat_top_command(message_data)
-            case GeneralBackendQueueMessageType.GLOBAL_TOP_COMMAND_TG:
-                logger.info("Handling GLOBAL_TOP_COMMAND_TG message")
-                await handle_global_top_command(message_data)
-            case GeneralBackendQueueMessageType.MY_CHAT_RANKING_COMMAND_TG:
-                logger.info("Handling MY_CHAT_RANKING_COMMAND_TG message")
-                await handle_my_chat_ranking_command(message_data)
-            case GeneralBackendQueueMessageType.MY_GLOBAL_RANKING_COMMAND_TG:
-                logger.info("Handling MY_GLOBAL_RANKING_COMMAND_TG message")
-                await handle_my_global_ranking_command(message_data)
-            case GeneralBackendQueueMessageType.CHAT_STATS_COMMAND_TG:
-                logger.info("Handling CHAT_STATS_COMMAND_TG message")
-                await handle_chat_stats_command(message_data)
-            case GeneralBackendQueueMessageType.GLOBAL_STATS_COMMAND_TG:
-                logger.info("Handling GLOBAL_STATS_COMMAND_TG message")
-                await handle_global_stats_command(message_data)
-            case GeneralBackendQueueMessageType.CHAT_GLOBAL_TOP_COMMAND_TG:
-                await handle_chat_global_top_command(message_data)
-            case GeneralBackendQueueMessageType.GLOBAL_CHAT_RANKING_COMMAND_TG:
-                await handle_global_chat_ranking_command(message_data)
-            case _:
-                logger.warning(f"Unhandled message type: {message_type}")
+        trace = extract(message_data)
+        record_queue_wait(message.routing_key, trace)
+        try:
+            with start_span(f"backend.{message_type}", trace), chat_costs.attributed_to(chat_id_of(message_data)):
+                await general_queue_dispatcher.dispatch(message_type, message_data)
+        except Exception as e:
+            # Requests sent with rabbitmq_manager.call() get the error instead of a timeout
+            await rabbitmq_manager.reply(message, {"status": "error", "message_type": message_type, "error": str(e)})
+            raise
+        await rabbitmq_manager.reply(message, {"status": "ok", "message_type": message_type})
+
+general_queue_dispatcher = MessageDispatcher("general_queue")
+general_queue_dispatcher.add_handler(GeneralBackendQueueMessageType.TEXT_TO_ANALYZE, handle_text_to_analyze)
+general_queue_dispatcher.add_handler(GeneralBackendQueueMessageType.MY_CHAT_STATS_COMMAND_TG, handle_my_chat_stats_command)
+general_queue_dispatcher.add_handler(GeneralBackendQueueMessageType.MY_GLOBAL_STATS_COMMAND_TG, handle_my_global_stats_command)
+general_queue_dispatcher.add_handler(GeneralBackendQueueMessageType.CHAT_TOP_COMMAND_TG, handle_chat_top_command)
+general_queue_dispatcher.add_handler(GeneralBackendQueueMessageType.GLOBAL_TOP_COMMAND_TG, handle_global_top_command)
+general_queue_dispatcher.add_handler(GeneralBackendQueueMessageType.MY_CHAT_RANKING_COMMAND_TG, handle_my_chat_ranking_command)
+general_queue_dispatcher.add_handler(GeneralBackendQueueMessageType.MY_GLOBAL_RANKING_COMMAND_TG, handle_my_global_ranking_command)
+general_queue_dispatcher.add_handler(GeneralBackendQueueMessageType.CHAT_STATS_COMMAND_TG, handle_chat_stats_command)
+general_queue_dispatcher.add_handler(GeneralBackendQueueMessageType.GLOBAL_STATS_COMMAND_TG, handle_global_stats_command)
+general_queue_dispatcher.add_handler(GeneralBackendQueueMessageType.CHAT_GLOBAL_TOP_COMMAND_TG, handle_chat_global_top_command)
+general_queue_dispatcher.add_handler(GeneralBackendQueueMessageType.GLOBAL_CHAT_RANKING_COMMAND_TG, handle_global_chat_ranking_command)
+general_queue_dispatcher.add_handler(GeneralBackendQueueMessageType.BACKTEST_RULES_COMMAND_TG, handle_backtest_rules_command)
 
 async def consume_general_queue_messages():
     await rabbitmq_manager.connect()
@@ -66,5 +63,10 @@ async def consume_general_queue_messages():
     async def on_message(message: IncomingMessage):
         await handle_general_queue_message(message)
     
-    await rabbitmq_manager.backend_general_queue.consume(on_message)
-    logger.info("Started consuming messages from main_queue")
\ No newline at end of file
+    # One consumer per workload queue, each with its own channel and prefetch, so a
+    # slow global report can't hold up ingestion. Every consumer dispatches any
+    # message type, which also drains messages routed by older producers.
+    for workload, queue_name in WORKLOAD_QUEUES.items():
+        prefetch_count = WORKLOAD_PREFETCH[workload]
+        await rabbitmq_manager.consume(queue_name, on_message, prefetch_count=prefetch_count)
+        logger.info(f"Started consuming {workload.value} messages from {queue_name} (prefetch {prefetch_count})")
\ No newline at end of file
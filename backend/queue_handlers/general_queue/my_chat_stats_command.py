@@ -5,6 +5,7 @@ from middlewares.rabbitmq.mq_enums import TelegramQueueMessageType
 from backend.functions.stats.personal_stats_analyzer import PersonalStatsAnalyzer
 from settings import get_settings
 from backend.functions.helpers.get_lang_display import get_language_display
+from middlewares.monitoring.structured_logging import redacted
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
@@ -28,7 +29,7 @@ def format_stats_report(stats_data):
     return report
 
 async def handle_my_chat_stats_command(message_data: dict):
-    logger.info(f"Handling MY_CHAT_STATS_COMMAND_TG message:\n{message_data}")
+    logger.info("Handling MY_CHAT_STATS_COMMAND_TG message: %s", redacted(message_data))
     user_id = message_data.get("user_id", 0)
     chat_id = message_data.get("chat_id", "")
     message_id = message_data.get("message_id", "")
@@ -7,12 +7,13 @@ from backend.functions.top.specific_user_ranking import SpecificUserGlobalRankin
 from backend.functions.helpers.get_lang_display import get_language_display
 from settings import get_settings
 from backend.functions.top.top_generator import GlobalTopGenerator
+from middlewares.monitoring.structured_logging import redacted
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
 async def handle_my_global_ranking_command(message_data: dict):
-    logger.info(f"Handling MY_GLOBAL_RANKING_COMMAND_TG message:\n{message_data}")
+    logger.info("Handling MY_GLOBAL_RANKING_COMMAND_TG message: %s", redacted(message_data))
     user_id = message_data.get("user_id", 0)
     message_id = message_data.get("message_id", "")
     chat_id = message_data.get("chat_id", "")
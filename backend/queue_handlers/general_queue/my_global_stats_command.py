@@ -6,6 +6,7 @@ from backend.functions.stats.personal_stats_analyzer import PersonalStatsAnalyze
 from backend.functions.helpers.get_lang_display import get_language_display
 from settings import get_settings
 from backend.functions.helpers.get_chat_link import get_chat_name_with_link
+from middlewares.monitoring.structured_logging import redacted
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
@@ -43,7 +44,7 @@ async def format_global_stats_report(stats_data):
     return report
 
 async def handle_my_global_stats_command(message_data: dict):
-    logger.info(f"Handling MY_GLOBAL_STATS_COMMAND_TG message:\n{message_data}")
+    logger.info("Handling MY_GLOBAL_STATS_COMMAND_TG message: %s", redacted(message_data))
     user_id = message_data.get("user_id", 0)
     message_id = message_data.get("message_id", "")
     chat_id = message_data.get("chat_id", "")
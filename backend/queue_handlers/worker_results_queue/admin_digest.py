@@ -0,0 +1,115 @@
+"""
+Coalesced admin notifications.
+
+The first violation in a chat is reported to the admins right away and opens a
+window of ADMIN_NOTIFICATION_DIGEST_SECONDS; violations during the window are
+collected and sent as one digest message when it closes, which opens the next
+window. A quiet chat gets immediate notifications, a raid gets one message per
+window instead of one per violation. Moderation actions are not affected.
+"""
+import asyncio
+from datetime import datetime
+from typing import Dict, List
+from middlewares.rabbitmq.queue_manager import rabbitmq_manager
+from middlewares.rabbitmq.mq_enums import TelegramQueueMessageType
+from middlewares.monitoring.metrics import registry
+from middlewares.monitoring.tracing import inject
+from settings import get_settings
+from backend.utils.logging_config import logger
+
+settings = get_settings()
+logger = logger.getChild('admin_digest')
+
+notifications_counter = registry.counter("admin_notifications_total", "Admin notifications by delivery (immediate/digest)", ["delivery"])
+digests_counter = registry.counter("admin_notification_digests_total", "Digest messages sent to admins")
+
+# Telegram rejects messages longer than 4096 characters
+MAX_DIGEST_LENGTH = 4000
+
+def build_digest(texts: List[str], overflow: int, window_seconds: float) -> str:
+    """One message listing the collected notifications, cut to fit a Telegram message"""
+    total = len(texts) + overflow
+    header = f"{total} rule violations in the last {int(window_seconds)} seconds:"
+    parts = [header]
+    length = len(header)
+    for index, text in enumerate(texts):
+        if length + len(text) + 2 > MAX_DIGEST_LENGTH:
+            overflow += len(texts) - index
+            break
+        parts.append(text)
+        length += len(text) + 2
+    if overflow:
+        parts.append(f"...and {overflow} more")
+    return "\n\n".join(parts)
+
+class AdminNotificationDigest:
+    def __init__(self, window_seconds: float, max_lines: int):
+        self.window_seconds = window_seconds
+        self.max_lines = max_lines
+        self._pending: Dict[str, List[str]] = {}
+        # Notifications beyond max_lines are only counted
+        self._overflow: Dict[str, int] = {}
+        self._windows: Dict[str, asyncio.Task] = {}
+
+    async def notify(self, chat_id, text: str):
+        chat_id = str(chat_id)
+        if chat_id in self._windows:
+            notifications_counter.inc(delivery="digest")
+            pending = self._pending.setdefault(chat_id, [])
+            if len(pending) < self.max_lines:
+                pending.append(text)
+            else:
+                self._overflow[chat_id] = self._overflow.get(chat_id, 0) + 1
+            return
+
+        if self.window_seconds > 0:
+            self._windows[chat_id] = asyncio.create_task(self._run_window(chat_id))
+        notifications_counter.inc(delivery="immediate")
+        await self._publish(chat_id, inject({
+            "message_type": TelegramQueueMessageType.ADMIN_NOTIFICATION,
+            "chat_id": chat_id,
+            "text": text
+        }))
+
+    async def _run_window(self, chat_id: str):
+        try:
+            while True:
+                await asyncio.sleep(self.window_seconds)
+                if not await self._flush(chat_id):
+                    return
+        finally:
+            self._windows.pop(chat_id, None)
+
+    async def _flush(self, chat_id: str) -> bool:
+        """Send the chat's collected notifications as one digest; False if there were none"""
+        texts = self._pending.pop(chat_id, None)
+        overflow = self._overflow.pop(chat_id, 0)
+        if not texts:
+            return False
+        digests_counter.inc()
+        await self._publish(chat_id, {
+            "message_type": TelegramQueueMessageType.ADMIN_NOTIFICATION,
+            "chat_id": chat_id,
+            "text": build_digest(texts, overflow, self.window_seconds)
+        })
+        return True
+
+    async def _publish(self, chat_id: str, message_data: dict):
+        try:
+            await rabbitmq_manager.store_result(
+                settings.RABBITMQ_TELEGRAM_QUEUE, f"{chat_id}.admin.{datetime.now().timestamp()}", message_data
+            )
+        except Exception as e:
+            logger.error(f"Failed to send admin notification for chat {chat_id}: {e}")
+
+    async def flush_all(self):
+        """Close every open window and send what it collected (on shutdown)"""
+        for task in list(self._windows.values()):
+            task.cancel()
+        for chat_id in list(self._pending):
+            await self._flush(chat_id)
+
+admin_digest = AdminNotificationDigest(
+    settings.ADMIN_NOTIFICATION_DIGEST_SECONDS,
+    settings.ADMIN_NOTIFICATION_DIGEST_MAX_LINES
+)
@@ -1,25 +1,32 @@
-import json
 import logging
 from aio_pika import IncomingMessage
 from settings import get_settings
 from middlewares.rabbitmq.queue_manager import rabbitmq_manager
+from middlewares.rabbitmq.codec import decode_message
 from middlewares.rabbitmq.mq_enums import WorkerResQueueMessageType
+from middlewares.rabbitmq.dispatcher import MessageDispatcher
+from middlewares.monitoring.tracing import extract, record_queue_wait, start_span
 from backend.queue_handlers.worker_results_queue.text_analysis_complete import handle_text_analysis_compete
+from middlewares.monitoring.structured_logging import redacted
+from middlewares.database.chat_costs import chat_costs, chat_id_of
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+worker_results_dispatcher = MessageDispatcher("worker_results_queue")
+worker_results_dispatcher.add_handler(WorkerResQueueMessageType.TEXT_ANALYSIS_COMPLETED, handle_text_analysis_compete)
+
 async def handle_worker_result_queue_message(message: IncomingMessage):
+    rabbitmq_manager.record_consumed(message)
     async with message.process():
-        message_data = json.loads(message.body).get("result", {})
-        logger.info(f"Received result: {message_data}")
+        message_data = decode_message(message.body, message.content_type).get("result", {})
+        logger.info("Received result: %s", redacted(message_data))
         message_type = message_data.get("message_type", "Unknown")
         
-        if message_type == WorkerResQueueMessageType.TEXT_ANALYSIS_COMPLETED:
-            logger.info("Handling TEXT_ANALYSIS_COMPLETED result")
-            await handle_text_analysis_compete(message_data)
-        else:
-            logger.warning(f"Unhandled result type: {message_type}")
+        trace = extract(message_data)
+        record_queue_wait(message.routing_key, trace)
+        with start_span(f"backend.{message_type}", trace), chat_costs.attributed_to(chat_id_of(message_data)):
+            await worker_results_dispatcher.dispatch(message_type, message_data)
 
 async def consume_worker_results_queue_messages():
     await rabbitmq_manager.connect()
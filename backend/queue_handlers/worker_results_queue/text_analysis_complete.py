@@ -1,18 +1,28 @@
 import logging
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
 from middlewares.database.db import database
-from middlewares.database.models import ChatMessage, ModerationRule, Restriction, RestrictionRecord
+from middlewares.database.models import Chat, ChatMessage, ModerationRule, Restriction, RestrictionRecord, User
+from middlewares.database.language_windows import non_allowed_probability
+from middlewares.database.chat_costs import chat_costs
+from middlewares.database.rule_engine import RuleContext, rule_engine, STAGE_ANALYSIS
 from middlewares.rabbitmq.queue_manager import rabbitmq_manager
 from middlewares.rabbitmq.mq_enums import TelegramQueueMessageType
+from middlewares.monitoring.metrics import registry
+from middlewares.monitoring.tracing import start_span, inject
 from settings import get_settings
 from backend.utils.logging_config import logger
+from middlewares.monitoring.structured_logging import redacted
+from backend.queue_handlers.worker_results_queue.admin_digest import admin_digest
 
 settings = get_settings()
 logger = logger.getChild('text_analysis_complete')
 
+# Completed worker detections as seen by the backend (the worker processes have their own registries)
+detections_counter = registry.counter("language_detections_total", "Language detections run, by where they ran", ["source"])
+
 async def handle_text_analysis_compete(message_data: dict[str, Any]):
-    logger.info(f"Handling TEXT_ANALYSIS_COMPLETED queue message:\n{message_data}")
+    logger.info("Handling TEXT_ANALYSIS_COMPLETED queue message: %s", redacted(message_data))
     user_id = message_data.get("user_id", 0)
     name = message_data.get("name", "")
     username = message_data.get("username", "")
@@ -21,181 +31,74 @@ async def handle_text_analysis_compete(message_data: dict[str, Any]):
     text = message_data.get("text", "")
     timestamp = message_data.get("timestamp", "")
     analysis_result = message_data.get("analysis_result", [])
+    detections_counter.inc(source="worker")
+    chat_costs.record(chat_id, messages_analyzed=1, detection_cpu_seconds=message_data.get("detection_cpu_seconds", 0.0))
 
-    user_exists = await database.user_exists(user_id)
+    with start_span("backend.db_write"):
+        chat = await database.get_effective_chat(int(chat_id))
+        # Sample for the rolling language conditions, against the allowed languages at message time
+        language_sample = None
+        if chat and chat.chat_settings:
+            language_sample = non_allowed_probability(analysis_result, chat.chat_settings.allowed_languages)
 
-    if not user_exists:
-        await database.create_user({
-            "user_id": user_id,
-            "name": name,
-            "username": username,
-            "is_active": True
-        })
-    
-    # Add the message to user's chat history
-    await database.add_chat_message(
-        user_id, 
-        ChatMessage(
-            chat_id=chat_id, 
-            message_id=message_id, 
-            content=text, 
-            timestamp=timestamp, 
-            analysis_result=analysis_result
+        user_exists = await database.user_exists(user_id)
+
+        if not user_exists:
+            await database.create_user({
+                "user_id": user_id,
+                "name": name,
+                "username": username,
+                "is_active": True
+            })
+        
+        # Add the message to user's chat history
+        user = await database.add_chat_message(
+            user_id, 
+            ChatMessage(
+                chat_id=chat_id, 
+                message_id=message_id, 
+                content=text, 
+                timestamp=timestamp, 
+                analysis_result=analysis_result
+            ),
+            language_sample=language_sample
         )
-    )
     
     # Check if this message violates any moderation rules
-    await check_moderation_rules(user_id, chat_id, message_id, text, analysis_result, name)
+    with start_span("backend.moderation"):
+        await check_moderation_rules(user_id, chat_id, message_id, text, analysis_result, name, chat=chat, user=user)
 
-async def check_moderation_rules(user_id: int, chat_id: str, message_id: str, text: str, analysis_result: List, user_name: str):
-    """Check if the message violates any moderation rules and take appropriate action"""
-    logger.info(f"Checking moderation rules for user {user_id} in chat {chat_id}")
+async def check_moderation_rules(
+    user_id: int,
+    chat_id: str,
+    message_id: str,
+    text: str,
+    analysis_result: List,
+    user_name: str,
+    chat: Optional[Chat] = None,
+    user: Optional[User] = None,
+    stage: str = STAGE_ANALYSIS
+):
+    """Check if the message violates any moderation rules of the stage and take appropriate action"""
+    logger.debug("Checking moderation rules for user %s in chat %s", user_id, chat_id)
     
     # Get chat settings and moderation rules
-    chat = await database.get_chat(int(chat_id))
+    if chat is None:
+        chat = await database.get_effective_chat(int(chat_id))
     if not chat or not chat.chat_settings or not chat.chat_settings.moderation_rules:
-        logger.info("No moderation rules found for this chat")
+        logger.debug("No moderation rules found for this chat")
         return
     
-    # Get user data and restriction history
-    user = await database.get_user(user_id)
-    if not user:
-        logger.warning(f"User {user_id} not found in database")
-        return
-    
-    # Check each rule
-    for rule_index, rule in enumerate(chat.chat_settings.moderation_rules):
-        logger.info(f"Checking rule {rule_index + 1}: {rule.message}")
-        
-        # Check if the rule conditions are met
-        if await rule_conditions_met(rule, user, chat_id, text, analysis_result):
-            logger.info(f"Rule {rule_index + 1} triggered for user {user_id} in chat {chat_id}")
-            
-            await apply_restriction(rule, user_id, chat_id, message_id, text, user_name, rule_index)
-
-async def rule_conditions_met(rule: ModerationRule, user: Any, chat_id: str, text: str, analysis_result: List) -> bool:
-    """Check if all conditions for a rule are met"""
-    results = []
-    
-    for condition in rule.conditions:
-        condition_met = False
-        
-        # Check condition based on type
-        if condition.type == "single_message_language_confidence":
-            condition_met = check_language_confidence_condition(condition, analysis_result)
-        
-        elif condition.type == "single_message_confidence_not_in_allowed_languages":
-            # Get allowed languages from chat settings
-            chat = await database.get_chat(int(chat_id))
-            allowed_languages = chat.chat_settings.allowed_languages
-            condition_met = check_not_allowed_language_condition(condition, analysis_result, allowed_languages)
-        
-        elif condition.type == "previous_restriction_type_count":
-            condition_met = await check_previous_restriction_count(condition, user.user_id, chat_id)
-        
-        elif condition.type == "previous_restriction_type_time_length":
-            condition_met = await check_previous_restriction_time_length(condition, user.user_id, chat_id)
-        
-        results.append(condition_met)
-    
-    # Combine results based on the condition relation (AND/OR)
-    if rule.condition_relation == "and":
-        return all(results)
-    else:  # OR relation
-        return any(results)
-
-def check_not_allowed_language_condition(condition: Any, analysis_result: List, allowed_languages: List[str]) -> bool:
-    """Check if a message is in a non-allowed language with confidence above threshold"""
-    threshold = condition.values.get("threshold", 0.0)
-    
-    # Check if any detected language is not in allowed languages and exceeds threshold
-    for lang_result in analysis_result:
-        lang_code = lang_result.get("lang", "")
-        confidence = lang_result.get("prob", 0.0)
-        
-        if lang_code not in allowed_languages and confidence >= threshold:
-            return True
-    
-    return False
-
-def check_language_confidence_condition(condition: Any, analysis_result: List) -> bool:
-    """Check if a message's language confidence meets the threshold"""
-    threshold = condition.values.get("threshold", 0.0)
-    language = condition.values.get("language", "")
-    
-    # If no language specified, condition can't be met
-    if not language:
-        logger.warning("Language confidence condition missing language parameter")
-        return False
-    
-    # Check if the specified language in the analysis result exceeds the threshold
-    for lang_result in analysis_result:
-        if lang_result.get("lang", "") == language and lang_result.get("prob", 0.0) >= threshold:
-            return True
-    
-    return False
-
-async def check_previous_restriction_count(condition: Any, user_id: int, chat_id: str) -> bool:
-    """Check if user has received a specific number of previous restrictions"""
-    target_count = condition.values.get("count", 0)
-    restriction_types = condition.values.get("restriction_type", [])
-    
-    # If "any" is in types, we count all restriction types
-    count_all = "any" in restriction_types
-    
-    # Get user's restriction history
-    user = await database.get_user(user_id)
-    if not user or not hasattr(user, "restriction_history") or not user.restriction_history:
-        return False
-    
-    # Count matching restrictions
-    count = 0
-    for restriction in user.restriction_history:
-        # Only count restrictions for this chat if this_chat_only is True
-        if condition.this_chat_only and restriction.chat_id != chat_id:
-            continue
-            
-        # Count if restriction type matches or we're counting all types
-        if count_all or restriction.restriction_type in restriction_types:
-            count += 1
-    
-    return count >= target_count
-
-async def check_previous_restriction_time_length(condition: Any, user_id: int, chat_id: str) -> bool:
-    """Check if user has had restrictions of a specific cumulative duration"""
-    target_seconds = condition.values.get("seconds", 0)
-    window_hours = condition.values.get("window_hours", 24.0)
-    restriction_types = condition.values.get("restriction_type", [])
-    
-    # If "any" is in types, we consider all restriction types
-    consider_all = "any" in restriction_types
-    
-    # Get user's restriction history
-    user = await database.get_user(user_id)
-    if not user or not hasattr(user, "restriction_history") or not user.restriction_history:
-        return False
-    
-    # Calculate time window
-    now = datetime.now()
-    window_start = now - timedelta(hours=window_hours)
-    
-    # Sum durations of matching restrictions within time window
-    total_seconds = 0
-    for restriction in user.restriction_history:
-        # Skip if outside time window
-        restriction_time = datetime.fromisoformat(restriction.timestamp)
-        if restriction_time < window_start:
-            continue
-        
-        # Only count restrictions for this chat if this_chat_only is True
-        if condition.this_chat_only and restriction.chat_id != chat_id:
-            continue
-            
-        # Add duration if restriction type matches or we're counting all types
-        if consider_all or restriction.restriction_type in restriction_types:
-            total_seconds += restriction.duration_seconds or 0
-    
-    return total_seconds >= target_seconds
+    # Rules are evaluated against the state at message arrival: the user stored
+    # with the message is reused, otherwise it is loaded at most once, and only
+    # if a rule reaches a user-dependent condition
+    if user is not None:
+        context = RuleContext(database, user_id, chat_id, text, analysis_result, user=user)
+    else:
+        context = RuleContext(database, user_id, chat_id, text, analysis_result)
+    for rule_index, rule in await rule_engine.triggered_rules(chat, context, stage=stage):
+        logger.info("Rule %d triggered for user %s in chat %s", rule_index + 1, user_id, chat_id)
+        await apply_restriction(rule, user_id, chat_id, message_id, text, user_name, rule_index)
 
 async def apply_restriction(
     rule: ModerationRule, 
@@ -210,7 +113,7 @@ async def apply_restriction(
     restriction = rule.restriction
     restriction_type = restriction.restriction_type
     
-    logger.info(f"Applying {restriction_type} to user {user_id} in chat {chat_id}")
+    logger.info("Applying %s to user %s in chat %s", restriction_type, user_id, chat_id)
     
     # Create restriction record
     now = datetime.now().isoformat()
@@ -245,20 +148,10 @@ async def send_restriction_messages(
     if restriction.restriction_justification_message:
         admin_message += f"\nJustification: {restriction.restriction_justification_message}"
     
-    admin_notification_data = {
-        "message_type": TelegramQueueMessageType.ADMIN_NOTIFICATION,
-        "chat_id": chat_id,
-        "text": admin_message
-    }
+    now = datetime.now().timestamp()
+    messages = []
     
-    # Send admin notification
-    await rabbitmq_manager.store_result(
-        settings.RABBITMQ_TELEGRAM_QUEUE, 
-        f"{chat_id}.admin.{datetime.now().timestamp()}", 
-        admin_notification_data
-    )
-    
-    # If user should be notified, prepare and send user notification
+    # If user should be notified, prepare user notification
     if rule.notify_user:
         user_message = rule.message
         
@@ -270,13 +163,9 @@ async def send_restriction_messages(
             "text": user_message
         }
         
-        await rabbitmq_manager.store_result(
-            settings.RABBITMQ_TELEGRAM_QUEUE, 
-            f"{chat_id}.{user_id}.{datetime.now().timestamp()}", 
-            user_notification_data
-        )
+        messages.append((settings.RABBITMQ_TELEGRAM_QUEUE, f"{chat_id}.{user_id}.{now}", inject(user_notification_data)))
     
-    # Send moderation action command
+    # Moderation action command
     moderation_action_data = {
         "message_type": TelegramQueueMessageType.MODERATION_ACTION,
         "chat_id": chat_id,
@@ -286,8 +175,13 @@ async def send_restriction_messages(
         "duration_seconds": restriction.duration_seconds
     }
     
-    await rabbitmq_manager.store_result(
-        settings.RABBITMQ_TELEGRAM_QUEUE, 
-        f"{chat_id}.{user_id}.action.{datetime.now().timestamp()}", 
-        moderation_action_data
-    )
\ No newline at end of file
+    messages.append((settings.RABBITMQ_TELEGRAM_QUEUE, f"{chat_id}.{user_id}.action.{now}", inject(moderation_action_data)))
+    
+    # Send all messages as one confirmed batch
+    outcomes = await rabbitmq_manager.publish_many(messages)
+    failed = [outcome.job_id for outcome in outcomes if not outcome.ok]
+    if failed:
+        logger.error(f"Failed to send {len(failed)} restriction message(s) for user {user_id} in chat {chat_id}: {failed}")
+    
+    # Admins get the first violation right away, later ones of a raid as a digest
+    await admin_digest.notify(chat_id, admin_message)
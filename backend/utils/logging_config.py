@@ -2,6 +2,8 @@ import logging
 import sys
 import io
 from pathlib import Path
+from settings import get_settings
+from middlewares.monitoring.structured_logging import SamplingFilter, build_formatter
 
 def setup_logger():
     """
@@ -10,7 +12,9 @@ def setup_logger():
     """
     # Create logger
     logger = logging.getLogger('backend')
-    logger.setLevel(logging.INFO)
+    settings = get_settings()
+    level = logging.getLevelName(settings.LOG_LEVEL.upper())
+    logger.setLevel(level)
 
     # Check if handlers already exist to avoid duplicates
     if not logger.handlers:
@@ -24,7 +28,7 @@ def setup_logger():
             # On other platforms, regular stdout should work fine
             console_handler = logging.StreamHandler(sys.stdout)
             
-        console_handler.setLevel(logging.INFO)
+        console_handler.setLevel(level)
 
         # Create file handler with utf-8 encoding
         logs_dir = Path(__file__).parent.parent.parent / 'logs'
@@ -34,15 +38,18 @@ def setup_logger():
             logs_dir / 'backend.log',
             encoding='utf-8'
         )
-        file_handler.setLevel(logging.INFO)
+        file_handler.setLevel(level)
 
-        # Create formatter
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
+        # Create formatter: plain text or one JSON object per line (LOG_FORMAT)
+        formatter = build_formatter(settings.LOG_FORMAT)
         console_handler.setFormatter(formatter)
         file_handler.setFormatter(formatter)
 
+        # Hot-path records that log a redacted() payload are sampled per message type
+        sampling_filter = SamplingFilter(settings.LOG_SAMPLE_RATES)
+        console_handler.addFilter(sampling_filter)
+        file_handler.addFilter(sampling_filter)
+
         # Add handlers to logger
         logger.addHandler(console_handler)
         logger.addHandler(file_handler)
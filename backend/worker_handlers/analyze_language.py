@@ -1,15 +1,44 @@
+import gc
+import os
+import time
 import logging
 import asyncio
 from functools import wraps
-from langdetect import detect_langs
+from celery.signals import worker_init, worker_process_init
 from settings import get_settings
 from backend.worker_handlers.celery_config import celery_app
+from backend.worker_handlers.detection import (
+    detect_languages_timed, build_analysis_result, get_analysis_job_id, preload_detector, warmup_detector
+)
 from middlewares.rabbitmq.queue_manager import rabbitmq_manager
-from middlewares.rabbitmq.mq_enums import WorkerResQueueMessageType
+from middlewares.monitoring.metrics import registry, start_metrics_server
+from middlewares.monitoring.tracing import extract, record_queue_wait, start_span, inject
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+detector_load_gauge = registry.gauge("worker_detector_profile_load_seconds", "Time to load langdetect profiles in the worker parent")
+detector_warmup_gauge = registry.gauge("worker_detector_warmup_seconds", "Time of the warmup detection in the worker parent")
+
+@worker_init.connect
+def preload_language_detector(**kwargs):
+    """Load detector profiles in the parent so prefork children share them copy-on-write"""
+    load_seconds, warmup_seconds = preload_detector()
+    # Move everything loaded so far out of the GC's reach, so collections in the
+    # children don't touch (and copy) the shared pages
+    gc.freeze()
+    detector_load_gauge.set(load_seconds)
+    detector_warmup_gauge.set(warmup_seconds)
+    logger.info(f"Preloaded language detector in {load_seconds:.3f}s, warmup detection {warmup_seconds:.3f}s")
+    if settings.CELERY_METRICS_PORT:
+        start_metrics_server(settings.CELERY_METRICS_PORT)
+
+@worker_process_init.connect
+def warmup_language_detector(**kwargs):
+    started = time.perf_counter()
+    warmup_detector()
+    logger.info(f"Pool process {os.getpid()} warmed up in {time.perf_counter() - started:.3f}s")
+
 # Helper function to safely run async code in a sync context
 def run_async(async_func):
     @wraps(async_func)
@@ -28,47 +57,34 @@ def run_async(async_func):
 def patched_store_result_sync(queue_name, job_id, result_data):
     """Safely run the async store_result in a sync context"""
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        async def _do_store():
-            if not rabbitmq_manager.connection or rabbitmq_manager.connection.is_closed:
-                await rabbitmq_manager.connect()
-            await rabbitmq_manager.store_result(queue_name, job_id, result_data)
-        
-        # Run the async function in the loop
-        result = loop.run_until_complete(_do_store())
-        loop.close()
-        return result
+        # The middleware keeps one event loop per worker process, so the pooled
+        # connection is reused by every task this process runs
+        return rabbitmq_manager.store_result_sync(queue_name, job_id, result_data)
     except Exception as e:
         logger.error(f"Error in patched_store_result_sync: {str(e)}")
         raise
 
-@celery_app.task(name='backend.worker_handlers.analyze_language.analyze_language')
-def analyze_language(text: str, chat_id: str, message_id: str, user_id: int, timestamp: str, name: str, username: str):
-    logger.info(f"Analyzing language for message_id: {message_id}, chat_id: {chat_id}, user_id: {user_id}")
+@celery_app.task(bind=True, name='backend.worker_handlers.analyze_language.analyze_language')
+def analyze_language(self, text: str, chat_id: str, message_id: str, user_id: int, timestamp: str, name: str, username: str):
+    logger.debug("Analyzing language for message_id: %s, chat_id: %s, user_id: %s", message_id, chat_id, user_id)
+    # Custom task headers (the trace context) are exposed as request attributes
+    trace = extract({"trace": self.request.get("trace")})
+    record_queue_wait(settings.RABBITMQ_WORKER_QUEUE, trace)
     try:
-        result = detect_langs(text)
-        analysis_result = [{"lang": lang.lang, "prob": lang.prob} for lang in result]
-        logger.info(f"Detected languages for message_id {message_id}: {analysis_result}")
-        
-        result_data = {
-            "message_type": WorkerResQueueMessageType.TEXT_ANALYSIS_COMPLETED,
-            "text": text,
-            "message_id": message_id,
-            "chat_id": chat_id,
-            "user_id": user_id,
-            "timestamp": timestamp,
-            "analysis_result": analysis_result,
-            "name": name,
-            "username": username
-        }
-        
-        try:
-            patched_store_result_sync(settings.RABBITMQ_RESULT_QUEUE, chat_id + message_id, result_data)
-            logger.info(f"Successfully sent analysis result for message_id {message_id}")
-        except Exception as store_error:
-            logger.error(f"Failed to store result: {str(store_error)}")
+        with start_span("worker.analyze_language", trace):
+            with start_span("worker.detection"):
+                analysis_result, detection_cpu_seconds = detect_languages_timed(text)
+            logger.debug("Detected languages for message_id %s: %s", message_id, analysis_result)
+            
+            result_data = inject(build_analysis_result(
+                text, chat_id, message_id, user_id, timestamp, name, username, analysis_result, detection_cpu_seconds
+            ))
+            
+            try:
+                patched_store_result_sync(settings.RABBITMQ_RESULT_QUEUE, get_analysis_job_id(chat_id, message_id), result_data)
+                logger.debug("Successfully sent analysis result for message_id %s", message_id)
+            except Exception as store_error:
+                logger.error(f"Failed to store result: {str(store_error)}")
         
         return analysis_result
         
@@ -0,0 +1,170 @@
+"""
+Asyncio-native language detection worker, an alternative to the Celery prefork worker.
+
+It consumes the Celery task messages published to worker_queue by the ingestion
+handler, runs detection on a ProcessPoolExecutor and publishes the same
+TEXT_ANALYSIS_COMPLETED messages to result_queue, so the two runtimes can be
+swapped or run side by side for benchmarking.
+
+Usage:
+    python -m backend.worker_handlers.async_worker [--concurrency N] [--prefetch N]
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+from aio_pika import IncomingMessage
+from settings import get_settings
+from middlewares.rabbitmq.queue_manager import rabbitmq_manager
+from middlewares.monitoring.tracing import extract, record_queue_wait, start_span, inject
+from backend.worker_handlers.detection import (
+    detect_languages_timed, build_analysis_result, get_analysis_job_id, preload_detector, warmup_detector
+)
+from backend.utils.logging_config import logger
+
+settings = get_settings()
+logger = logger.getChild('async_worker')
+
+ANALYZE_LANGUAGE_TASK = 'backend.worker_handlers.analyze_language.analyze_language'
+
+def parse_celery_task(message: IncomingMessage) -> Tuple[Optional[str], list, dict]:
+    """
+    Extract (task name, args, kwargs) from a Celery task message.
+    Supports task protocol 2 (task name in headers) and the legacy protocol 1 body.
+    """
+    headers = message.headers or {}
+    body = json.loads(message.body)
+
+    if "task" in headers:
+        args, kwargs, _embed = body
+        return headers["task"], args, kwargs
+
+    return body.get("task"), body.get("args", []), body.get("kwargs", {})
+
+class AsyncDetectionWorker:
+    def __init__(self, concurrency: int, prefetch: int):
+        self.concurrency = concurrency
+        self.prefetch = prefetch
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.consume_channel = None
+        self.processed = 0
+        self.failed = 0
+        self._in_flight = set()
+        self._stopping = asyncio.Event()
+
+    async def start(self):
+        # Load profiles before the pool forks so the children share them copy-on-write
+        load_seconds, warmup_seconds = preload_detector()
+        gc.freeze()
+        logger.info(f"Preloaded language detector in {load_seconds:.3f}s, warmup detection {warmup_seconds:.3f}s")
+        self.executor = ProcessPoolExecutor(max_workers=self.concurrency, initializer=warmup_detector)
+        # Consume on a dedicated channel of the shared connection; results are
+        # published through the middleware's channel pool on the same connection
+        await rabbitmq_manager.connect()
+        self.consume_channel = await rabbitmq_manager.connection.channel()
+        await self.consume_channel.set_qos(prefetch_count=self.prefetch)
+        queue = await self.consume_channel.declare_queue(
+            settings.RABBITMQ_WORKER_QUEUE,
+            durable=True,
+            arguments={"x-max-priority": settings.RABBITMQ_WORKER_QUEUE_MAX_PRIORITY}
+        )
+        self._consumer_tag = await queue.consume(self.on_message)
+        self._queue = queue
+        logger.info(f"Consuming {settings.RABBITMQ_WORKER_QUEUE} with {self.concurrency} processes, prefetch {self.prefetch}")
+
+    async def on_message(self, message: IncomingMessage):
+        task = asyncio.current_task()
+        self._in_flight.add(task)
+        try:
+            await self.process(message)
+        finally:
+            self._in_flight.discard(task)
+
+    async def process(self, message: IncomingMessage):
+        try:
+            task_name, args, kwargs = parse_celery_task(message)
+        except (ValueError, TypeError) as e:
+            logger.error(f"Dropping malformed task message: {e}")
+            await message.reject(requeue=False)
+            return
+
+        if task_name != ANALYZE_LANGUAGE_TASK:
+            logger.warning(f"Dropping unknown task {task_name}")
+            await message.reject(requeue=False)
+            return
+
+        trace = extract(message.headers)
+        record_queue_wait(settings.RABBITMQ_WORKER_QUEUE, trace)
+        try:
+            with start_span("worker.analyze_language", trace):
+                await self.analyze(*args, **kwargs)
+            self.processed += 1
+        except Exception as e:
+            # Same policy as the Celery task: log and drop, the message is not retried
+            self.failed += 1
+            logger.error(f"Error analyzing task {message.headers.get('id') if message.headers else ''}: {e}")
+        await message.ack()
+
+    async def analyze(self, text: str, chat_id: str, message_id: str, user_id: int, timestamp: str, name: str, username: str):
+        loop = asyncio.get_running_loop()
+        with start_span("worker.detection"):
+            analysis_result, detection_cpu_seconds = await loop.run_in_executor(self.executor, detect_languages_timed, text)
+
+        result_data = inject(build_analysis_result(
+            text, chat_id, message_id, user_id, timestamp, name, username, analysis_result, detection_cpu_seconds
+        ))
+        await self.publish_result(get_analysis_job_id(chat_id, message_id), result_data)
+
+    async def publish_result(self, job_id: str, result: Dict[str, Any]):
+        await rabbitmq_manager.store_result(settings.RABBITMQ_RESULT_QUEUE, job_id, result)
+
+    def request_stop(self):
+        self._stopping.set()
+
+    async def run_until_stopped(self):
+        await self.start()
+        started_at = time.monotonic()
+        await self._stopping.wait()
+
+        logger.info("Stopping: cancelling consumer and draining in-flight tasks")
+        await self._queue.cancel(self._consumer_tag)
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+        await rabbitmq_manager.connection.close()
+        self.executor.shutdown(wait=True)
+
+        elapsed = time.monotonic() - started_at
+        logger.info(f"Processed {self.processed} tasks ({self.failed} failed) in {elapsed:.1f}s")
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Asyncio-native language detection worker")
+    parser.add_argument(
+        "--concurrency", type=int, default=os.cpu_count() or 1,
+        help="number of detection processes (default: number of CPU cores)"
+    )
+    parser.add_argument(
+        "--prefetch", type=int, default=None,
+        help="unacked messages to hold per worker (default: 2 x concurrency)"
+    )
+    return parser.parse_args(argv)
+
+async def run_worker(concurrency: int, prefetch: int):
+    worker = AsyncDetectionWorker(concurrency, prefetch)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.request_stop)
+    await worker.run_until_stopped()
+
+def main(argv=None):
+    args = parse_args(argv)
+    prefetch = args.prefetch or args.concurrency * 2
+    asyncio.run(run_worker(args.concurrency, prefetch))
+
+if __name__ == "__main__":
+    main()
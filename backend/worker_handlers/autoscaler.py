@@ -0,0 +1,192 @@
+"""
+Celery autoscaler driven by worker_queue depth and message age.
+
+Celery's built-in autoscaler only looks at the tasks already reserved by the
+worker. This one probes the broker for the queue depth (a passive declare, so
+no message is touched), measures how long the messages it receives waited in
+the queue from their enqueued_at header, estimates how long a new message would
+wait, and grows or shrinks the pool within the `--autoscale` bounds to keep
+that estimate under AUTOSCALER_LATENCY_SLO_SECONDS.
+
+Enabled through `worker_autoscaler` in celery_config; start the worker with
+`--autoscale=max,min` to activate the autoscaler bootstep.
+"""
+import math
+import time
+from typing import Optional
+from celery.signals import task_received
+from celery.utils.log import get_logger
+from celery.worker import state
+from celery.worker.autoscale import Autoscaler
+from settings import get_settings
+from middlewares.monitoring.metrics import registry, start_metrics_server
+
+settings = get_settings()
+logger = get_logger(__name__)
+
+queue_depth_gauge = registry.gauge("autoscaler_queue_depth", "Messages waiting in worker_queue")
+head_age_gauge = registry.gauge("autoscaler_queue_head_age_seconds", "Longest wait in worker_queue of the messages received since the last probe")
+drain_rate_gauge = registry.gauge("autoscaler_drain_rate_per_second", "Tasks completed per second by this worker")
+estimated_wait_gauge = registry.gauge("autoscaler_estimated_wait_seconds", "Estimated wait of a newly queued message")
+processes_gauge = registry.gauge("autoscaler_processes", "Current number of pool processes")
+target_processes_gauge = registry.gauge("autoscaler_target_processes", "Pool size chosen by the last decision")
+decisions_counter = registry.counter("autoscaler_decisions_total", "Scaling decisions by direction", ["direction"])
+probe_errors_counter = registry.counter("autoscaler_probe_errors_total", "Failed broker probes")
+
+def estimate_wait(depth: int, head_age: float, drain_rate: float) -> float:
+    """Estimated wait for a new message: the head's age or depth / throughput, whichever is worse"""
+    if depth <= 0:
+        return 0.0
+    if drain_rate <= 0:
+        return head_age
+    return max(head_age, depth / drain_rate)
+
+def compute_target_processes(
+    current: int,
+    depth: int,
+    estimated_wait: float,
+    slo: float,
+    min_processes: int,
+    max_processes: int,
+    scale_down_ratio: float
+) -> int:
+    """Pick the pool size for the next interval, clamped to [min_processes, max_processes]"""
+    target = current
+    if depth > 0 and estimated_wait > slo:
+        # Grow proportionally to how far over the SLO we are, at least one process
+        target = current + max(1, math.ceil(current * (estimated_wait / slo - 1)))
+    elif estimated_wait < slo * scale_down_ratio and depth < current:
+        # Shrink gently, one process per decision
+        target = current - 1
+    return max(min_processes, min(max_processes, target))
+
+class QueueDepthAutoscaler(Autoscaler):
+    def __init__(self, pool, max_concurrency, min_concurrency=0, worker=None, **kwargs):
+        super().__init__(pool, max_concurrency, min_concurrency, worker=worker, **kwargs)
+        self._connection = None
+        self._last_probe = 0.0
+        self._last_completed = None
+        self._target = None
+        self._head_age = 0.0
+        # Longest queue wait of the messages received since the last probe
+        self._max_wait: Optional[float] = None
+        task_received.connect(self._on_task_received, weak=False)
+        if settings.CELERY_METRICS_PORT:
+            start_metrics_server(settings.CELERY_METRICS_PORT)
+
+    def _on_task_received(self, sender=None, request=None, **kwargs):
+        """Record how long a message waited in the queue, from its enqueued_at header"""
+        enqueued_at = request.request_dict.get("enqueued_at") if request is not None else None
+        if enqueued_at:
+            wait = max(0.0, time.time() - float(enqueued_at))
+            if self._max_wait is None or wait > self._max_wait:
+                self._max_wait = wait
+
+    def _get_channel(self):
+        if self._connection is None:
+            self._connection = self.worker.app.connection_for_read()
+        return self._connection.default_channel
+
+    def _reset_connection(self):
+        if self._connection is not None:
+            try:
+                self._connection.release()
+            except Exception:
+                pass
+        self._connection = None
+
+    def probe_queue(self) -> int:
+        """Return the number of messages waiting in worker_queue"""
+        _, depth, _ = self._get_channel().queue_declare(queue=settings.RABBITMQ_WORKER_QUEUE, passive=True)
+        return depth
+
+    def _measure_head_age(self, depth: int, elapsed: float) -> float:
+        """
+        Age of the oldest waiting message, as seen by the consumer: the longest
+        wait received since the last probe. With nothing received while messages
+        wait, the previous head is still waiting and only got older.
+        """
+        max_wait, self._max_wait = self._max_wait, None
+        if not depth:
+            self._head_age = 0.0
+        elif max_wait is not None:
+            self._head_age = max_wait
+        else:
+            self._head_age += elapsed
+        return self._head_age
+
+    def _measure_drain_rate(self, elapsed: float) -> float:
+        completed = state.all_total_count[0]
+        rate = 0.0
+        if self._last_completed is not None and elapsed > 0:
+            rate = (completed - self._last_completed) / elapsed
+        self._last_completed = completed
+        return rate
+
+    def _decide(self) -> Optional[int]:
+        now = time.monotonic()
+        if now - self._last_probe < settings.AUTOSCALER_PROBE_INTERVAL_SECONDS:
+            return self._target
+        elapsed = now - self._last_probe if self._last_probe else 0.0
+        self._last_probe = now
+
+        try:
+            depth = self.probe_queue()
+        except Exception as exc:
+            probe_errors_counter.inc()
+            logger.warning("Autoscaler: broker probe failed: %r", exc)
+            self._reset_connection()
+            return None
+
+        head_age = self._measure_head_age(depth, elapsed)
+        drain_rate = self._measure_drain_rate(elapsed)
+        wait = estimate_wait(depth, head_age, drain_rate)
+        current = self.processes
+        target = compute_target_processes(
+            current, depth, wait,
+            settings.AUTOSCALER_LATENCY_SLO_SECONDS,
+            self.min_concurrency, self.max_concurrency,
+            settings.AUTOSCALER_SCALE_DOWN_RATIO
+        )
+
+        queue_depth_gauge.set(depth)
+        head_age_gauge.set(head_age)
+        drain_rate_gauge.set(drain_rate)
+        estimated_wait_gauge.set(wait)
+        processes_gauge.set(current)
+        target_processes_gauge.set(target)
+        if target != current:
+            logger.info(
+                "Autoscaler: depth=%s head_age=%.1fs drain=%.2f/s wait=%.1fs -> %s processes (was %s)",
+                depth, head_age, drain_rate, wait, target, current
+            )
+
+        self._target = target
+        return target
+
+    def _maybe_scale(self, req=None):
+        target = self._decide()
+        if target is None:
+            # No broker data: fall back to Celery's reserved-requests heuristic
+            return super()._maybe_scale(req)
+
+        procs = self.processes
+        if target > procs:
+            decisions_counter.inc(direction="up")
+            self.scale_up(target - procs)
+            return True
+        if target < procs:
+            decisions_counter.inc(direction="down")
+            self.scale_down(procs - target)
+            return True
+        return False
+
+    def scale_down(self, n):
+        # Celery only shrinks after a scale-up; a pool that started large must be able to shrink too
+        if self._last_scale_up is None or time.monotonic() - self._last_scale_up > self.keepalive:
+            return self._shrink(n)
+
+    def info(self):
+        info = super().info()
+        info["target"] = self._target
+        return info
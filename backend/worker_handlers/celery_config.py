@@ -1,4 +1,5 @@
 from celery import Celery
+from kombu import Exchange, Queue
 from settings import get_settings
 
 settings = get_settings()
@@ -10,6 +11,17 @@ celery_app = Celery(
     include=['backend.worker_handlers.analyze_language']
 )
 
+# worker_queue is a priority queue: moderation-critical analyses (new members)
+# are published with a higher priority than randomly sampled background messages.
+# The arguments must match the declaration in RabbitMQMiddleware.declare_queues.
+worker_queue = Queue(
+    settings.RABBITMQ_WORKER_QUEUE,
+    Exchange(settings.RABBITMQ_WORKER_QUEUE),
+    routing_key=settings.RABBITMQ_WORKER_QUEUE,
+    durable=True,
+    queue_arguments={"x-max-priority": settings.RABBITMQ_WORKER_QUEUE_MAX_PRIORITY}
+)
+
 celery_app.conf.update(
     broker_url=settings.CELERY_BROKER_URL,
     result_backend=settings.CELERY_RESULT_BACKEND,
@@ -18,10 +30,19 @@ celery_app.conf.update(
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
+    # Prefetching a single message and acking late keeps the backlog in the broker,
+    # where RabbitMQ can reorder it by priority, instead of in the worker's buffer.
     worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    task_queues=(worker_queue,),
+    task_default_queue=settings.RABBITMQ_WORKER_QUEUE,
+    task_queue_max_priority=settings.RABBITMQ_WORKER_QUEUE_MAX_PRIORITY,
+    task_default_priority=settings.ANALYSIS_PRIORITY_SAMPLED,
+    # Scale on worker_queue depth/age instead of reserved requests (needs `--autoscale`)
+    worker_autoscaler='backend.worker_handlers.autoscaler:QueueDepthAutoscaler',
     task_routes={
-        'backend.worker_handlers_analyze_language.analyze_language': {
+        'backend.worker_handlers.analyze_language.analyze_language': {
             'queue': settings.RABBITMQ_WORKER_QUEUE
         }
     }
-)
\ No newline at end of file
+)
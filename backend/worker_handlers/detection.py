@@ -0,0 +1,63 @@
+import time
+from typing import Any, Dict, List, Tuple
+from langdetect import detect_langs
+from langdetect.detector_factory import init_factory
+from middlewares.rabbitmq.mq_enums import WorkerResQueueMessageType
+
+WARMUP_TEXT = "Language Police warmup: detecting the language of a short sentence."
+
+def preload_detector() -> Tuple[float, float]:
+    """
+    Load all langdetect profiles and run one warmup detection.
+
+    Called in the parent process before the detection pool forks, so the profiles
+    are shared copy-on-write instead of being loaded lazily by every child.
+    Returns (profile load seconds, warmup detection seconds).
+    """
+    started = time.perf_counter()
+    init_factory()
+    loaded = time.perf_counter()
+    warmup_detector()
+    return loaded - started, time.perf_counter() - loaded
+
+def warmup_detector():
+    """Run a throwaway detection so the first real message doesn't pay for first-call setup"""
+    detect_langs(WARMUP_TEXT)
+
+def detect_languages(text: str) -> List[Dict[str, Any]]:
+    """Detect the languages of a text; shared by the Celery and asyncio worker runtimes"""
+    return [{"lang": lang.lang, "prob": lang.prob} for lang in detect_langs(text)]
+
+def detect_languages_timed(text: str) -> Tuple[List[Dict[str, Any]], float]:
+    """detect_languages and the CPU seconds it took in the calling process, for per-chat cost accounting"""
+    started = time.process_time()
+    analysis_result = detect_languages(text)
+    return analysis_result, time.process_time() - started
+
+def build_analysis_result(
+    text: str,
+    chat_id: str,
+    message_id: str,
+    user_id: int,
+    timestamp: str,
+    name: str,
+    username: str,
+    analysis_result: List[Dict[str, Any]],
+    detection_cpu_seconds: float = 0.0
+) -> Dict[str, Any]:
+    """Build the TEXT_ANALYSIS_COMPLETED message published to result_queue"""
+    return {
+        "message_type": WorkerResQueueMessageType.TEXT_ANALYSIS_COMPLETED,
+        "text": text,
+        "message_id": message_id,
+        "chat_id": chat_id,
+        "user_id": user_id,
+        "timestamp": timestamp,
+        "analysis_result": analysis_result,
+        "name": name,
+        "username": username,
+        "detection_cpu_seconds": detection_cpu_seconds
+    }
+
+def get_analysis_job_id(chat_id: str, message_id: str) -> str:
+    return chat_id + message_id
@@ -5,11 +5,13 @@ from aiogram.enums import ParseMode
 from .command_routers import main_command_router
 from .event_routers import main_event_router
 from settings import get_settings
+from .utils.telegram_metrics import TelegramMetricsMiddleware
 import logging
 
 settings = get_settings()
 
 bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
+bot.session.middleware(TelegramMetricsMiddleware())
 
 storage = MemoryStorage()
 dp = Dispatcher(bot=bot, storage=storage, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
@@ -3,7 +3,12 @@ from aiogram.filters.command import Command
 from aiogram.types import ChatMemberAdministrator, ChatMemberOwner
 from middlewares.database.db import database
 from middlewares.database.models import Chat
+from middlewares.rabbitmq.queue_manager import rabbitmq_manager
+from middlewares.rabbitmq.mq_enums import GeneralBackendQueueMessageType
+from bot_telegram.command_routers.settings import is_user_admin
+import json
 import logging
+import uuid
 
 logger = logging.getLogger(__name__)
 
@@ -148,4 +153,121 @@ async def refresh_chat_name_command(message: types.Message):
     await database.update_chat(chat_id, {"last_known_name": new_name})
     
     await message.reply(f"Chat name updated successfully!\n\nOld name: {old_name}\nNew name: {new_name}")
-    logger.info(f"Chat {chat_id} name updated from '{old_name}' to '{new_name}'")
\ No newline at end of file
+    logger.info(f"Chat {chat_id} name updated from '{old_name}' to '{new_name}'")
+
+@admin_router.message(Command("sync_settings"))
+async def sync_settings_command(message: types.Message):
+    """
+    Command to make this chat follow another chat's settings.
+    Format: /sync_settings [leader_chat_id|off]; without arguments shows the current sync.
+    """
+    logger.info(f"Processing sync_settings command from user {message.from_user.id} in chat {message.chat.id}")
+
+    if message.chat.type == "private":
+        await message.reply("This command can only be used in a group chat.")
+        return
+
+    chat_id = message.chat.id
+    if not await is_user_admin(chat_id, message.from_user.id):
+        await message.reply("You need to be an admin to change settings synchronization.")
+        logger.warning(f"User {message.from_user.id} attempted to use sync_settings without admin rights")
+        return
+
+    chat = await database.get_chat(chat_id)
+    if not chat:
+        await message.reply("Chat not found in database. Please try again later.")
+        return
+
+    command_parts = message.text.split(maxsplit=1)
+    if len(command_parts) == 1:
+        followers = await database.get_settings_followers(chat_id)
+        if chat.chat_settings.sync_settings_with:
+            text = f"This chat follows the settings of chat {chat.chat_settings.sync_settings_with}."
+        elif followers:
+            text = "Chats following this chat's settings:\n" + "\n".join(
+                f"• {follower.get('last_known_name') or follower['chat_id']} ({follower['chat_id']})" for follower in followers
+            )
+        else:
+            text = "This chat's settings are not synchronized with any chat."
+        await message.reply(text + "\n\nUse /sync_settings <chat_id> to follow another chat's settings, or /sync_settings off to stop.")
+        return
+
+    argument = command_parts[1].strip()
+    if argument.lower() == "off":
+        leader_id = None
+    else:
+        try:
+            leader_id = int(argument)
+        except ValueError:
+            await message.reply("Please provide the id of the chat to follow, or 'off'.")
+            return
+        if leader_id == chat_id:
+            await message.reply("A chat can't follow its own settings.")
+            return
+        leader = await database.get_chat(leader_id)
+        if not leader:
+            await message.reply(f"Chat {leader_id} not found. The bot must be a member of the chat to follow.")
+            return
+        if not await is_user_admin(leader_id, message.from_user.id):
+            await message.reply("You need to be an admin of the chat to follow as well.")
+            return
+        # Only one level of synchronization is followed
+        if leader.chat_settings.sync_settings_with:
+            await message.reply(f"Chat {leader_id} follows chat {leader.chat_settings.sync_settings_with} itself. Follow that chat instead.")
+            return
+        if await database.get_settings_followers(chat_id):
+            await message.reply("Other chats follow this chat's settings, so it can't follow another chat.")
+            return
+
+    chat.chat_settings.sync_settings_with = leader_id
+    await database.update_chat(chat_id, {"chat_settings": chat.chat_settings.dict()})
+    if leader_id is None:
+        await message.reply("This chat now uses its own settings again.")
+    else:
+        await message.reply(f"This chat now follows the settings of {leader.last_known_name} ({leader_id}).")
+    logger.info(f"Chat {chat_id} settings sync set to {leader_id}")
+
+@admin_router.message(Command("backtest_rules"))
+async def backtest_rules_command(message: types.Message):
+    """
+    Command to replay the chat's stored analyzed messages against its moderation
+    rules and report how many restrictions each rule would have produced.
+    Candidate rules can be given as JSON instead, one moderation rule or a list:
+    /backtest_rules {"name": "...", "message": "...", "conditions": [...]}
+    """
+    logger.info(f"Processing backtest_rules command from user {message.from_user.id} in chat {message.chat.id}")
+
+    if message.chat.type == "private":
+        await message.reply("This command can only be used in a group chat.")
+        return
+
+    if not await is_user_admin(message.chat.id, message.from_user.id):
+        await message.reply("You need to be an admin to backtest moderation rules.")
+        logger.warning(f"User {message.from_user.id} attempted to backtest rules without admin rights")
+        return
+
+    message_data = {
+        "message_type": GeneralBackendQueueMessageType.BACKTEST_RULES_COMMAND_TG,
+        "user_id": message.from_user.id,
+        "chat_id": message.chat.id,
+        "message_id": message.message_id,
+    }
+
+    command_parts = message.text.split(maxsplit=1)
+    if len(command_parts) > 1:
+        try:
+            candidate_rules = json.loads(command_parts[1])
+        except ValueError:
+            candidate_rules = None
+        if isinstance(candidate_rules, dict):
+            candidate_rules = [candidate_rules]
+        if not isinstance(candidate_rules, list) or not all(isinstance(rule, dict) for rule in candidate_rules):
+            await message.reply("Please provide the candidate rules as JSON: one moderation rule object or a list of them.")
+            return
+        # Validated by the backend, which reports what is wrong with them
+        message_data["rules"] = candidate_rules
+
+    guid = str(uuid.uuid4())
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
+
+    await message.reply("Backtesting moderation rules against this chat's history...")
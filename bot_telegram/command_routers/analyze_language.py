@@ -1,7 +1,8 @@
+import asyncio
 from aiogram import Router, types
 from aiogram.filters import Command
-from langdetect import detect_langs
 from backend.functions.helpers.get_lang_display import get_language_display
+from bot_telegram.utils.language_detection import language_detector, analyze_language_rate_limiter
 
 analyze_language_router = Router()
 
@@ -32,9 +33,14 @@ async def cmd_analyze_language(message: types.Message):
         await message.reply("❌ Text is too short for reliable language detection (minimum 3 characters)")
         return
     
+    retry_after = analyze_language_rate_limiter.retry_after(message.from_user.id)
+    if retry_after > 0:
+        await message.reply(f"⏳ Too many analysis requests. Please try again in {int(retry_after) + 1} seconds.")
+        return
+    
     try:
-        # Detect languages with confidence scores
-        detected_languages = detect_langs(text_to_analyze)
+        # Detect languages with confidence scores (in the detection pool, not on the event loop)
+        detected_languages = await language_detector.detect(text_to_analyze)
         
         if not detected_languages:
             await message.reply("❌ Could not detect any language in the provided text")
@@ -48,14 +54,14 @@ async def cmd_analyze_language(message: types.Message):
         response_text += "🌐 **Detected Languages:**\n"
         
         # Sort by confidence (highest first)
-        sorted_languages = sorted(detected_languages, key=lambda x: x.prob, reverse=True)
+        sorted_languages = sorted(detected_languages, key=lambda x: x[1], reverse=True)
         
         # Build the detailed response
-        for i, lang in enumerate(sorted_languages):
-            confidence_percent = round(lang.prob * 100, 1)
+        for i, (lang_code, prob) in enumerate(sorted_languages):
+            confidence_percent = round(prob * 100, 1)
             
             # Get emoji and name for this language
-            lang_display = get_language_display(lang.lang)
+            lang_display = get_language_display(lang_code)
             
             if i == 0:  # Most likely language
                 response_text += f"🥇 **{lang_display}** - {confidence_percent}%\n"
@@ -64,6 +70,8 @@ async def cmd_analyze_language(message: types.Message):
         
         await message.reply(response_text, parse_mode="Markdown")
         
+    except asyncio.TimeoutError:
+        await message.reply("❌ Language detection took too long, please try a shorter text")
     except Exception as e:
         await message.reply(f"❌ Language detection failed: {str(e)}")
     except Exception as e:
@@ -21,6 +21,8 @@ async def start_command(message: types.Message):
                         "/chat_settings - Configure chat settings (admin only)\n" \
                         "/add_admins - Sync chat administrators with bot (admin only)\n" \
                         "/restrictions - View and manage user restrictions (admin only)\n" \
+                        "/sync_settings - Follow another chat's settings, or see which chats follow this one (admin only)\n" \
+                        "/backtest_rules [rules JSON] - See how many restrictions the chat's rules, or candidate rules, would have produced (admin only)\n" \
                         "/my_data - Download all your data as a .json file\n"
                         "/help - See the list of commands (see this message again)\n" \
 )
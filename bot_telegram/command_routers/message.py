@@ -2,6 +2,7 @@ from aiogram import types, Router
 from middlewares.database.models import ChatMessage
 from middlewares.rabbitmq.queue_manager import rabbitmq_manager
 from middlewares.rabbitmq.mq_enums import GeneralBackendQueueMessageType
+from middlewares.monitoring.tracing import new_trace, start_span, inject
 from settings import get_settings
 import logging
 import uuid
@@ -31,4 +32,6 @@ async def handle_message(message: types.Message):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
\ No newline at end of file
+    with start_span("bot.publish", new_trace(), chat_id=chat_message.chat_id, message_id=chat_message.message_id):
+        inject(message_data)
+        await rabbitmq_manager.publish_to_backend(guid, message_data)
\ No newline at end of file
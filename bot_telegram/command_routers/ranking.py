@@ -22,7 +22,7 @@ async def my_chat_ranking(message: types.Message):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
 
     await message.reply("Finding your ranking in chat statistics...")
 
@@ -37,7 +37,7 @@ async def my_global_ranking(message: types.Message):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
 
     await message.reply("Finding your ranking in global statistics...")
 
@@ -52,7 +52,7 @@ async def chat_ranking(message: types.Message):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
 
     await message.reply("Finding this chat's ranking among all chats...")
 
@@ -70,7 +70,7 @@ async def cb_my_chat_ranking_language(callback: types.CallbackQuery):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
     
     await callback.answer(f"Getting your ranking for {get_language_display(language)} messages...")
 
@@ -88,7 +88,7 @@ async def cb_my_global_ranking_language(callback: types.CallbackQuery):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
     
     await callback.answer(f"Getting your global ranking for {get_language_display(language)} messages...")
 
@@ -106,7 +106,7 @@ async def cb_chat_ranking_language(callback: types.CallbackQuery):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
     
     await callback.answer(f"Getting chat ranking for {get_language_display(language)} messages...")
 
@@ -122,7 +122,7 @@ async def cb_my_chat_ranking_all_langs(callback: types.CallbackQuery):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
     
     await callback.answer("Getting your ranking for all languages...")
 
@@ -138,7 +138,7 @@ async def cb_my_global_ranking_all_langs(callback: types.CallbackQuery):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
     
     await callback.answer("Getting your global ranking for all languages...")
 
@@ -154,6 +154,6 @@ async def cb_chat_ranking_all_langs(callback: types.CallbackQuery):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
     
     await callback.answer("Getting chat ranking for all languages...")
\ No newline at end of file
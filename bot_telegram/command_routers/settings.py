@@ -9,8 +9,10 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from middlewares.database.db import database
 from middlewares.database.models import Chat, ChatSettings, ModerationRule, RuleCondition, Restriction, RestrictionType, RuleConditionType, ConditionRelationType
 from backend.functions.helpers.get_lang_display import get_language_display
+from settings import get_settings
 
 settings_router = Router(name='settings_router')
+settings = get_settings()
 logger = logging.getLogger()
 
 class SettingsStates(StatesGroup):
@@ -159,6 +161,78 @@ class ConditionInputHelper:
             description=("This condition checks if a user has had a cumulative duration of "
                          "restrictions of specific types within a time window. You can specify multiple types "
                          "separated by commas or use 'any' to match all restriction types.")
+        ),
+        RuleConditionType.ROLLING_SHARE_NOT_IN_ALLOWED_LANGUAGES.value: ConditionTypeConfig(
+            fields=[
+                ConditionField(
+                    "messages", 
+                    f"Enter how many of the user's last messages to look at (1-{settings.LANGUAGE_WINDOW_SIZE}):", 
+                    int, 
+                    min_value=1, 
+                    max_value=settings.LANGUAGE_WINDOW_SIZE
+                ),
+                ConditionField(
+                    "threshold", 
+                    "Enter the threshold for counting a message as a non-allowed language (0.0-1.0):", 
+                    float, 
+                    min_value=0.0, 
+                    max_value=1.0
+                ),
+                ConditionField(
+                    "share", 
+                    "Enter the share of those messages that must be in non-allowed languages (0.0-1.0):", 
+                    float, 
+                    min_value=0.0, 
+                    max_value=1.0
+                )
+            ],
+            description=("This condition triggers when enough of the user's last messages in this chat were "
+                         "detected as languages not in the allowed list. For example, 10 messages with share 0.6 "
+                         "means at least 6 of the last 10 messages. Users with fewer messages count as allowed "
+                         "for the missing ones, so a single misdetected message does not trigger it.")
+        ),
+        RuleConditionType.EWMA_NOT_IN_ALLOWED_LANGUAGES.value: ConditionTypeConfig(
+            fields=[
+                ConditionField(
+                    "alpha", 
+                    "Enter the weight of the newest message (0.01-1.0, lower values react more slowly):", 
+                    float, 
+                    min_value=0.01, 
+                    max_value=1.0
+                ),
+                ConditionField(
+                    "threshold", 
+                    "Enter the average non-allowed language probability that triggers the rule (0.0-1.0):", 
+                    float, 
+                    min_value=0.0, 
+                    max_value=1.0
+                )
+            ],
+            description=("This condition keeps an exponentially weighted average of how likely the user's "
+                         "recent messages in this chat are in non-allowed languages, and triggers when the "
+                         "average exceeds the threshold.")
+        ),
+        RuleConditionType.MESSAGE_RATE.value: ConditionTypeConfig(
+            fields=[
+                ConditionField(
+                    "messages", 
+                    f"Enter the number of messages the user may send within the time window (1-{settings.FLOOD_TRACKER_MAX_EVENTS - 1}):", 
+                    int, 
+                    min_value=1, 
+                    max_value=settings.FLOOD_TRACKER_MAX_EVENTS - 1
+                ),
+                ConditionField(
+                    "seconds", 
+                    f"Enter the time window in seconds (1-{int(settings.FLOOD_TRACKER_IDLE_SECONDS)}):", 
+                    float, 
+                    min_value=1, 
+                    max_value=settings.FLOOD_TRACKER_IDLE_SECONDS
+                )
+            ],
+            description=("This condition triggers when a user sends more than the given number of messages "
+                         "in this chat within the time window. Every message is counted, not only analyzed ones. "
+                         "Rules using only this and previous restriction conditions are checked as soon as a "
+                         "message arrives.")
         )
     }
     
@@ -354,6 +428,15 @@ async def select_chat_callback(callback: types.CallbackQuery, state: FSMContext)
         await state.clear()
         return
     
+    if chat.chat_settings.sync_settings_with:
+        # Edits here would be shadowed by the leader's settings
+        await callback.message.edit_text(
+            f"The settings of {chat.last_known_name} follow chat {chat.chat_settings.sync_settings_with}.\n"
+            f"Edit them in that chat, or run /sync_settings off in this chat to manage them here."
+        )
+        await state.clear()
+        return
+    
     await show_settings_menu(callback.message, state, chat)
 
 async def show_settings_menu(message: types.Message, state: FSMContext, chat: Chat):
@@ -1139,6 +1222,18 @@ async def cb_notify_user(callback: types.CallbackQuery, state: FSMContext):
                 conditions_summary.append(f"   • Cumulative duration: {cond.values.get('seconds', 'N/A')} seconds")
                 conditions_summary.append(f"   • Within time window: {cond.values.get('window_hours', 'N/A')} hours")
             
+            elif cond.type == RuleConditionType.ROLLING_SHARE_NOT_IN_ALLOWED_LANGUAGES:
+                conditions_summary.append(f"   • Last messages: {cond.values.get('messages', 'N/A')}")
+                conditions_summary.append(f"   • Confidence threshold: {cond.values.get('threshold', 'N/A')}")
+                conditions_summary.append(f"   • Share: {cond.values.get('share', 'N/A')}")
+            
+            elif cond.type == RuleConditionType.EWMA_NOT_IN_ALLOWED_LANGUAGES:
+                conditions_summary.append(f"   • Alpha: {cond.values.get('alpha', 'N/A')}")
+                conditions_summary.append(f"   • Average threshold: {cond.values.get('threshold', 'N/A')}")
+            
+            elif cond.type == RuleConditionType.MESSAGE_RATE:
+                conditions_summary.append(f"   • More than {cond.values.get('messages', 'N/A')} messages in {cond.values.get('seconds', 'N/A')} seconds")
+            
             else:
                 # Generic fallback for unknown condition types
                 for key, val in cond.values.items():
@@ -1478,6 +1573,18 @@ async def cb_edit_rule(callback: types.CallbackQuery, state: FSMContext):
                 conditions_text.append(f"  • Cumulative duration: {cond.values.get('seconds', 'N/A')} seconds")
                 conditions_text.append(f"  • Within time window: {cond.values.get('window_hours', 'N/A')} hours")
             
+            elif cond.type == RuleConditionType.ROLLING_SHARE_NOT_IN_ALLOWED_LANGUAGES:
+                conditions_text.append(f"  • Last messages: {cond.values.get('messages', 'N/A')}")
+                conditions_text.append(f"  • Confidence threshold: {cond.values.get('threshold', 'N/A')}")
+                conditions_text.append(f"  • Share: {cond.values.get('share', 'N/A')}")
+            
+            elif cond.type == RuleConditionType.EWMA_NOT_IN_ALLOWED_LANGUAGES:
+                conditions_text.append(f"  • Alpha: {cond.values.get('alpha', 'N/A')}")
+                conditions_text.append(f"  • Average threshold: {cond.values.get('threshold', 'N/A')}")
+            
+            elif cond.type == RuleConditionType.MESSAGE_RATE:
+                conditions_text.append(f"  • More than {cond.values.get('messages', 'N/A')} messages in {cond.values.get('seconds', 'N/A')} seconds")
+            
             else:
                 # Generic fallback for unknown condition types
                 for key, val in cond.values.items():
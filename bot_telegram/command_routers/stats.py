@@ -38,7 +38,7 @@ async def my_chat_stats(message: types.Message):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
 
     await message.reply("Your chat stats request is being processed!")
 
@@ -54,7 +54,7 @@ async def my_global_stats(message: types.Message):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
 
     await message.reply("Your global stats request is being processed!")
 
@@ -70,7 +70,7 @@ async def chat_stats(message: types.Message):
     }
     
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
     
     await message.reply("Processing chat statistics...")
 
@@ -86,6 +86,6 @@ async def global_stats(message: types.Message):
     }
     
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
     
     await message.reply("Processing global statistics...")
\ No newline at end of file
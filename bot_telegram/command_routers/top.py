@@ -23,7 +23,7 @@ async def chat_top(message: types.Message):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
 
     await message.reply("Processing chat top statistics...")
 
@@ -38,7 +38,7 @@ async def global_top(message: types.Message):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
 
     await message.reply("Processing global top statistics...")
 
@@ -56,7 +56,7 @@ async def cb_chat_top_language(callback: types.CallbackQuery):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
     
     await callback.answer(f"Getting stats for {get_language_display(language)} messages...")
 
@@ -74,7 +74,7 @@ async def cb_global_top_language(callback: types.CallbackQuery):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
     
     await callback.answer(f"Getting global stats for {get_language_display(language)} messages...")
 
@@ -90,7 +90,7 @@ async def cb_chat_top_all_langs(callback: types.CallbackQuery):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
     
     await callback.answer("Getting stats for all languages...")
 
@@ -106,7 +106,7 @@ async def cb_global_top_all_langs(callback: types.CallbackQuery):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
     
     await callback.answer("Getting global stats for all languages...")
 
@@ -122,7 +122,7 @@ async def chat_global_top(message: types.Message):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
 
     await message.reply("Processing global chat top statistics...")
 
@@ -140,7 +140,7 @@ async def cb_chat_global_top_language(callback: types.CallbackQuery):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
     
     await callback.answer(f"Getting chat rankings for {get_language_display(language)} messages...")
 
@@ -156,6 +156,6 @@ async def cb_chat_global_top_all_langs(callback: types.CallbackQuery):
     }
 
     guid = str(uuid.uuid4())
-    await rabbitmq_manager.store_result(settings.RABBITMQ_GENERAL_QUEUE, guid, message_data)
+    await rabbitmq_manager.publish_to_backend(guid, message_data)
     
     await callback.answer("Getting chat rankings for all languages...")
\ No newline at end of file
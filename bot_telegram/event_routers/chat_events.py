@@ -1,8 +1,10 @@
 import logging
 from aiogram import Router, types, F, Bot
-from aiogram.filters import ChatMemberUpdatedFilter, IS_NOT_MEMBER, IS_MEMBER, MEMBER, ADMINISTRATOR, CREATOR
-from aiogram.types import ChatMemberUpdated, ChatMemberOwner, ChatMemberAdministrator
+from aiogram.enums import ChatMemberStatus
+from aiogram.filters import ChatMemberUpdatedFilter, IS_NOT_MEMBER, IS_MEMBER, MEMBER, RESTRICTED, ADMINISTRATOR, CREATOR
+from aiogram.types import ChatMemberUpdated, ChatMemberOwner, ChatMemberAdministrator, ChatJoinRequest
 from middlewares.database.db import database
+from middlewares.database.join_screening import join_screening
 
 logger = logging.getLogger(__name__)
 
@@ -87,7 +89,41 @@ async def on_chat_migration(message: types.Message):
         logger.error(f"Failed to send migration notification to {target_chat_id}: {e}")
         
 
-@chat_events_router.chat_member()
+ADMIN_STATUSES = {ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR}
+
+@chat_events_router.chat_join_request()
+async def on_chat_join_request(request: ChatJoinRequest):
+    """Decline join requests of users blocked or banned in this chat or the chats it syncs its blocklist with"""
+    result, source_chat_id = join_screening.check(request.chat.id, request.from_user.id)
+    if result == "allowed":
+        # Left to the chat's admins
+        return
+    logger.info(f"Declining join request of user {request.from_user.id} in chat {request.chat.id}: {result} in chat {source_chat_id}")
+    try:
+        await request.decline()
+    except Exception as e:
+        logger.error(f"Failed to decline join request of user {request.from_user.id} in chat {request.chat.id}: {e}")
+
+# Users joining as admins are left to on_admin_status_changed: aiogram runs only
+# the first matching handler, and JOIN_TRANSITION would catch them here
+@chat_events_router.chat_member(ChatMemberUpdatedFilter(IS_NOT_MEMBER >> (MEMBER | +RESTRICTED)))
+async def on_user_joined(event: ChatMemberUpdated):
+    """Remove joining users blocked or banned in this chat or the chats it syncs its blocklist with"""
+    user_id = event.new_chat_member.user.id
+    result, source_chat_id = join_screening.check(event.chat.id, user_id)
+    if result == "allowed":
+        return
+    # A ban carried over from a synced chat ends when it does there
+    until_date = join_screening.ban_expiry(source_chat_id, user_id) if result == "banned" else None
+    logger.info(f"Removing user {user_id} who joined chat {event.chat.id}: {result} in chat {source_chat_id}")
+    try:
+        await event.bot.ban_chat_member(chat_id=event.chat.id, user_id=user_id, until_date=until_date)
+    except Exception as e:
+        logger.error(f"Failed to remove user {user_id} from chat {event.chat.id}: {e}")
+
+@chat_events_router.chat_member(
+    F.old_chat_member.status.in_(ADMIN_STATUSES) | F.new_chat_member.status.in_(ADMIN_STATUSES)
+)
 async def on_admin_status_changed(event: ChatMemberUpdated):
     """Handles chat member admin status changes and updates the database."""
     logger.info(
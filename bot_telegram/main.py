@@ -1,5 +1,6 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from aiogram.types import Update, BotCommand
 import uvicorn
 import logging
@@ -9,6 +10,12 @@ from .bot_setup import dp, bot
 from middlewares.database.db import database
 from settings import get_settings
 from bot_telegram.queue_handlers.main_handler import consume_telegram_queue_messages
+from middlewares.rabbitmq.queue_manager import rabbitmq_manager
+from bot_telegram.utils.language_detection import language_detector
+from middlewares.monitoring.metrics import registry, PROMETHEUS_CONTENT_TYPE
+from middlewares.monitoring.loop_monitor import loop_monitor
+from middlewares.database.join_screening import join_screening
+from middlewares.database.chat_costs import chat_costs
 
 settings = get_settings()
 
@@ -61,15 +68,28 @@ async def lifespan(app: FastAPI):
                             ]
         )
     
+    if settings.LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    asyncio.create_task(join_screening.run())
+    asyncio.create_task(chat_costs.run())
     asyncio.create_task(consume_telegram_queue_messages(bot))
+    asyncio.create_task(rabbitmq_manager.monitor_queue_depths(
+        [settings.RABBITMQ_TELEGRAM_QUEUE], settings.QUEUE_METRICS_INTERVAL_SECONDS
+    ))
     await set_bot_commands()
     
     yield
     
     # Shutdown
     logging.info("Shutting down...")
+    try:
+        await chat_costs.flush()
+    except Exception as e:
+        logging.error(f"Failed to flush chat costs: {e}")
     await bot.delete_webhook()
     await bot.session.close()
+    language_detector.shutdown()
+    loop_monitor.stop()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -80,6 +100,10 @@ async def handle_webhook(request: Request):
     await dp.feed_webhook_update(bot=bot, update=update)
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 if __name__ == "__main__":
     logging.basicConfig(
         level=logging.INFO,
@@ -1,4 +1,3 @@
-import json
 import logging
 import re
 from aiogram import Bot
@@ -7,454 +6,476 @@ from datetime import datetime, timedelta
 from aio_pika import IncomingMessage
 from settings import get_settings
 from middlewares.rabbitmq.queue_manager import rabbitmq_manager
+from middlewares.rabbitmq.codec import decode_message
 from middlewares.rabbitmq.mq_enums import TelegramQueueMessageType
+from middlewares.rabbitmq.dispatcher import MessageDispatcher
+from middlewares.monitoring.tracing import extract, record_queue_wait, start_span
+from middlewares.database.join_screening import join_screening
 from bot_telegram.utils.logging_config import logger
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from middlewares.monitoring.structured_logging import redacted
 
 settings = get_settings()
 logger = logger.getChild('main_handler')
 
-async def handle_queue_message(bot: Bot, message: IncomingMessage):
-    async with message.process():
-        message_data = json.loads(message.body).get("result", {})
-        logger.info(f"Received message: {message_data}")
-        message_type = message_data.get("message_type", "Unknown")
-        
-        if message_type == TelegramQueueMessageType.MY_CHAT_STATS_COMMAND_ANSWER:
-            logger.info("Handling MY_CHAT_STATS_COMMAND_TG message")
-            chat_id = message_data.get("chat_id", "")
-            stats = message_data.get("stats", "")
-            await bot.send_message(chat_id, stats, parse_mode="HTML", disable_web_page_preview=True)
+telegram_queue_dispatcher = MessageDispatcher("telegram_queue")
 
-        elif message_type == TelegramQueueMessageType.MY_GLOBAL_STATS_COMMAND_ANSWER:
-            logger.info("Handling MY_GLOBAL_STATS_COMMAND_ANSWER message")
-            chat_id = message_data.get("chat_id", "")
-            stats = message_data.get("stats", "")
-            await bot.send_message(chat_id, stats, parse_mode="HTML", disable_web_page_preview=True)
-            
-        elif message_type == TelegramQueueMessageType.CHAT_TOP_COMMAND_ANSWER:
-            logger.info("Handling CHAT_TOP_COMMAND_ANSWER message")
-            chat_id = message_data.get("chat_id", "")
-            top_stats = message_data.get("top_stats", "")
-            message_id = message_data.get("message_id", "")
-            top_languages = message_data.get("top_languages", [])
-            
-            # Create language filter buttons
-            builder = InlineKeyboardBuilder()
-            builder.button(text="All Languages", callback_data="chat_top_all_langs")
-            
-            # Add buttons for top languages
-            for lang_code, count, lang_display in top_languages:
-                builder.button(
-                    text=f"{lang_display} ({count})", 
-                    callback_data=f"chat_top_lang_{lang_code}"
-                )
-            
-            builder.adjust(2)  # Two buttons per row
-            
-            try:
-                if message_id:
-                    await bot.edit_message_text(
-                        chat_id = str(chat_id), 
-                        message_id = int(message_id), 
-                        text = top_stats, 
-                        parse_mode="HTML",
-                        reply_markup=builder.as_markup()
-                    )
-                else:
-                    await bot.send_message(
-                        chat_id, 
-                        top_stats, 
-                        parse_mode="HTML",
-                        reply_markup=builder.as_markup()
-                    )
-            except Exception as e:
-                logger.error(f"Failed to send message: {e}")
-            
-        elif message_type == TelegramQueueMessageType.GLOBAL_TOP_COMMAND_ANSWER:
-            logger.info("Handling GLOBAL_TOP_COMMAND_ANSWER message")
-            message_id = message_data.get("message_id", "")
-            chat_id = message_data.get("chat_id", "")
-            top_stats = message_data.get("top_stats", "")
-            top_languages = message_data.get("top_languages", [])
-            
-            # Create language filter buttons
-            builder = InlineKeyboardBuilder()
-            builder.button(text="All Languages", callback_data="global_top_all_langs")
-            
-            # Add buttons for top languages
-            for lang_code, count, lang_display in top_languages:
-                builder.button(
-                    text=f"{lang_display} ({count})", 
-                    callback_data=f"global_top_lang_{lang_code}"
-                )
-            
-            builder.adjust(2)  # Two buttons per row
-            
-            try:
-                if message_id:
-                    await bot.edit_message_text(
-                        chat_id = str(chat_id), 
-                        message_id = int(message_id), 
-                        text = top_stats, 
-                        parse_mode="HTML",
-                        reply_markup=builder.as_markup()
-                    )
-                else:
-                    await bot.send_message(
-                        chat_id, 
-                        top_stats, 
-                        parse_mode="HTML",
-                        reply_markup=builder.as_markup()
-                    )
-            except Exception as e:
-                logger.error(f"Failed to send message: {e}")
-            
-        elif message_type == TelegramQueueMessageType.MY_CHAT_RANKING_COMMAND_ANSWER:
-            logger.info("Handling MY_CHAT_RANKING_COMMAND_ANSWER message")
-            chat_id = message_data.get("chat_id", "")
-            message_id = message_data.get("message_id", "")
-            ranking_stats = message_data.get("ranking_stats", "")
-            top_languages = message_data.get("top_languages", [])
-            
-            # Create language filter buttons
-            builder = InlineKeyboardBuilder()
-            builder.button(text="All Languages", callback_data="my_chat_ranking_all_langs")
-            
-            # Add buttons for top languages
-            for lang_code, count, lang_display in top_languages:
-                builder.button(
-                    text=f"{lang_display} ({count})", 
-                    callback_data=f"my_chat_ranking_lang_{lang_code}"
-                )
-            
-            builder.adjust(2)  # Two buttons per row
-            
-            try:
-                if message_id:
-                    await bot.edit_message_text(
-                        chat_id = str(chat_id), 
-                        message_id = int(message_id), 
-                        text = ranking_stats, 
-                        parse_mode="HTML",
-                        reply_markup=builder.as_markup()
-                    )
-                else:
-                    await bot.send_message(
-                        chat_id, 
-                        ranking_stats, 
-                        parse_mode="HTML",
-                        reply_markup=builder.as_markup()
-                    )
-            except Exception as e:
-                logger.error(f"Failed to send message: {e}")
+# Message ids of sent answers, kept for later edits: {chat_id: {answer_kind: message_id}}
+previous_messages = {}
 
-        elif message_type == TelegramQueueMessageType.MY_GLOBAL_RANKING_COMMAND_ANSWER:
-            logger.info("Handling MY_GLOBAL_RANKING_COMMAND_ANSWER message")
-            chat_id = message_data.get("chat_id", "")
-            message_id = message_data.get("message_id", "")
-            ranking_stats = message_data.get("ranking_stats", "")
-            top_languages = message_data.get("top_languages", [])
-            
-            # Create language filter buttons
-            builder = InlineKeyboardBuilder()
-            builder.button(text="All Languages", callback_data="my_global_ranking_all_langs")
-            
-            # Add buttons for top languages
-            for lang_code, count, lang_display in top_languages:
-                builder.button(
-                    text=f"{lang_display} ({count})", 
-                    callback_data=f"my_global_ranking_lang_{lang_code}"
-                )
-            
-            builder.adjust(2)  # Two buttons per row
-            
-            try:
-                if message_id:
-                    await bot.edit_message_text(
-                        chat_id = str(chat_id), 
-                        message_id = int(message_id), 
-                        text = ranking_stats, 
-                        parse_mode="HTML",
-                        reply_markup=builder.as_markup()
-                    )
-                else:
-                    await bot.send_message(
-                        chat_id, 
-                        ranking_stats, 
-                        parse_mode="HTML",
-                        reply_markup=builder.as_markup()
-                    )
-            except Exception as e:
-                logger.error(f"Failed to send message: {e}")
-        
-        elif message_type == TelegramQueueMessageType.GLOBAL_CHAT_RANKING_COMMAND_ANSWER:
-            logger.info("Handling GLOBAL_CHAT_RANKING_COMMAND_ANSWER message")
-            chat_id = message_data.get("chat_id", "")
-            ranking_stats = message_data.get("ranking_stats", "")
-            message_id = message_data.get("message_id", "")
-            top_languages = message_data.get("top_languages", [])
-            
-            # Create language filter buttons
-            builder = InlineKeyboardBuilder()
-            builder.button(text="All Languages", callback_data="global_chat_ranking_all_langs")
-            
-            # Add buttons for top languages
-            for lang_code, count, lang_display in top_languages:
-                if count > 0:  # Only show languages with messages
-                    builder.button(
-                        text=f"{lang_display} ({count})", 
-                        callback_data=f"global_chat_ranking_lang_{lang_code}"
-                    )
-            
-            builder.adjust(2)  # Two buttons per row
-            
-            try:
-                if message_id:
-                    await bot.edit_message_text(
-                        chat_id = str(chat_id), 
-                        message_id = int(message_id), 
-                        text = ranking_stats, 
-                        parse_mode="HTML",
-                        reply_markup=builder.as_markup()
-                    )
-                else:
-                    await bot.send_message(
-                        chat_id, 
-                        ranking_stats, 
-                        parse_mode="HTML",
-                        reply_markup=builder.as_markup()
-                    )
-            except Exception as e:
-                logger.error(f"Failed to send message: {e}")
-                
-        
-        elif message_type == TelegramQueueMessageType.CHAT_STATS_COMMAND_ANSWER:
-            logger.info("Handling CHAT_STATS_COMMAND_ANSWER message")
-            chat_id = message_data.get("chat_id", "")
-            stats = message_data.get("stats", "")
-            message_id = message_data.get("message_id", "")
-            
-            # Get actual member count from Telegram API
-            try:
-                member_count = await bot.get_chat_member_count(chat_id)
+@telegram_queue_dispatcher.register(TelegramQueueMessageType.MY_CHAT_STATS_COMMAND_ANSWER)
+async def handle_my_chat_stats_command_answer(bot: Bot, message_data: dict):
+    logger.info("Handling MY_CHAT_STATS_COMMAND_TG message")
+    chat_id = message_data.get("chat_id", "")
+    stats = message_data.get("stats", "")
+    await bot.send_message(chat_id, stats, parse_mode="HTML", disable_web_page_preview=True)
 
-                analyzed_members_match = re.search(r"💬 <b>Members with Analyzed Messages:</b> (\d+)", stats)
-                if analyzed_members_match and member_count > 0:
-                    analyzed_members = int(analyzed_members_match.group(1))
-                    
-                    # Calculate the actual percentage based on Telegram's member count
-                    percentage = (analyzed_members / member_count) * 100
-                    
-                    # Update both the total members count and the percentage
-                    stats = re.sub(r"(👥 <b>Total Members:</b>) \d+", r"\1 {}".format(member_count), stats)
-                    stats = re.sub(
-                        r"(💬 <b>Members with Analyzed Messages:</b> \d+) \(\d+\.\d+%\)",
-                        r"\1 ({:.1f}%)".format(percentage),
-                        stats
-                    )
+@telegram_queue_dispatcher.register(TelegramQueueMessageType.MY_GLOBAL_STATS_COMMAND_ANSWER)
+async def handle_my_global_stats_command_answer(bot: Bot, message_data: dict):
+    logger.info("Handling MY_GLOBAL_STATS_COMMAND_ANSWER message")
+    chat_id = message_data.get("chat_id", "")
+    stats = message_data.get("stats", "")
+    await bot.send_message(chat_id, stats, parse_mode="HTML", disable_web_page_preview=True)
 
-                # Replace the member count in the stats text
-                else:
-                    stats = re.sub(r"(👥 <b>Total Members:</b>) \d+", r"\1 {}".format(member_count), stats)
-                
-            except Exception as e:
-                logger.error(f"Failed to get chat member count: {e}")
-            
-            # Send the message with updated stats
+@telegram_queue_dispatcher.register(TelegramQueueMessageType.CHAT_TOP_COMMAND_ANSWER)
+async def handle_chat_top_command_answer(bot: Bot, message_data: dict):
+    logger.info("Handling CHAT_TOP_COMMAND_ANSWER message")
+    chat_id = message_data.get("chat_id", "")
+    top_stats = message_data.get("top_stats", "")
+    message_id = message_data.get("message_id", "")
+    top_languages = message_data.get("top_languages", [])
+    
+    # Create language filter buttons
+    builder = InlineKeyboardBuilder()
+    builder.button(text="All Languages", callback_data="chat_top_all_langs")
+    
+    # Add buttons for top languages
+    for lang_code, count, lang_display in top_languages:
+        builder.button(
+            text=f"{lang_display} ({count})", 
+            callback_data=f"chat_top_lang_{lang_code}"
+        )
+    
+    builder.adjust(2)  # Two buttons per row
+    
+    try:
+        if message_id:
+            await bot.edit_message_text(
+                chat_id = str(chat_id), 
+                message_id = int(message_id), 
+                text = top_stats, 
+                parse_mode="HTML",
+                reply_markup=builder.as_markup()
+            )
+        else:
             await bot.send_message(
-                chat_id,
-                stats,
-                parse_mode="HTML"
+                chat_id, 
+                top_stats, 
+                parse_mode="HTML",
+                reply_markup=builder.as_markup()
             )
-        
-        elif message_type == TelegramQueueMessageType.CHAT_STATS_COMMAND_ANSWER:
-            logger.info("Handling CHAT_STATS_COMMAND_ANSWER message")
-            chat_id = message_data.get("chat_id", "")
-            stats = message_data.get("stats", "")
-            message_id = message_data.get("message_id", "")
-            
-            # Get actual member count from Telegram API
-            try:
-                member_count = await bot.get_chat_member_count(chat_id)
+    except Exception as e:
+        logger.error(f"Failed to send message: {e}")
 
-                analyzed_members_match = re.search(r"💬 <b>Members with Analyzed Messages:</b> (\d+)", stats)
-                if analyzed_members_match and member_count > 0:
-                    analyzed_members = int(analyzed_members_match.group(1))
-                    
-                    # Calculate the actual percentage based on Telegram's member count
-                    percentage = (analyzed_members / member_count) * 100
-                    
-                    # Update both the total members count and the percentage
-                    stats = re.sub(r"(👥 <b>Total Members:</b>) \d+", r"\1 {}".format(member_count), stats)
-                    stats = re.sub(
-                        r"(💬 <b>Members with Analyzed Messages:</b> \d+) \(\d+\.\d+%\)",
-                        r"\1 ({:.1f}%)".format(percentage),
-                        stats
-                    )
+@telegram_queue_dispatcher.register(TelegramQueueMessageType.GLOBAL_TOP_COMMAND_ANSWER)
+async def handle_global_top_command_answer(bot: Bot, message_data: dict):
+    logger.info("Handling GLOBAL_TOP_COMMAND_ANSWER message")
+    message_id = message_data.get("message_id", "")
+    chat_id = message_data.get("chat_id", "")
+    top_stats = message_data.get("top_stats", "")
+    top_languages = message_data.get("top_languages", [])
+    
+    # Create language filter buttons
+    builder = InlineKeyboardBuilder()
+    builder.button(text="All Languages", callback_data="global_top_all_langs")
+    
+    # Add buttons for top languages
+    for lang_code, count, lang_display in top_languages:
+        builder.button(
+            text=f"{lang_display} ({count})", 
+            callback_data=f"global_top_lang_{lang_code}"
+        )
+    
+    builder.adjust(2)  # Two buttons per row
+    
+    try:
+        if message_id:
+            await bot.edit_message_text(
+                chat_id = str(chat_id), 
+                message_id = int(message_id), 
+                text = top_stats, 
+                parse_mode="HTML",
+                reply_markup=builder.as_markup()
+            )
+        else:
+            await bot.send_message(
+                chat_id, 
+                top_stats, 
+                parse_mode="HTML",
+                reply_markup=builder.as_markup()
+            )
+    except Exception as e:
+        logger.error(f"Failed to send message: {e}")
 
-                # Replace the member count in the stats text
-                else:
-                    stats = re.sub(r"(👥 <b>Total Members:</b>) \d+", r"\1 {}".format(member_count), stats)
-                
-            except Exception as e:
-                logger.error(f"Failed to get chat member count: {e}")
-            
-            # Send the message with updated stats
+@telegram_queue_dispatcher.register(TelegramQueueMessageType.MY_CHAT_RANKING_COMMAND_ANSWER)
+async def handle_my_chat_ranking_command_answer(bot: Bot, message_data: dict):
+    logger.info("Handling MY_CHAT_RANKING_COMMAND_ANSWER message")
+    chat_id = message_data.get("chat_id", "")
+    message_id = message_data.get("message_id", "")
+    ranking_stats = message_data.get("ranking_stats", "")
+    top_languages = message_data.get("top_languages", [])
+    
+    # Create language filter buttons
+    builder = InlineKeyboardBuilder()
+    builder.button(text="All Languages", callback_data="my_chat_ranking_all_langs")
+    
+    # Add buttons for top languages
+    for lang_code, count, lang_display in top_languages:
+        builder.button(
+            text=f"{lang_display} ({count})", 
+            callback_data=f"my_chat_ranking_lang_{lang_code}"
+        )
+    
+    builder.adjust(2)  # Two buttons per row
+    
+    try:
+        if message_id:
+            await bot.edit_message_text(
+                chat_id = str(chat_id), 
+                message_id = int(message_id), 
+                text = ranking_stats, 
+                parse_mode="HTML",
+                reply_markup=builder.as_markup()
+            )
+        else:
             await bot.send_message(
-                chat_id,
-                stats,
-                parse_mode="HTML"
+                chat_id, 
+                ranking_stats, 
+                parse_mode="HTML",
+                reply_markup=builder.as_markup()
             )
-            
-        elif message_type == TelegramQueueMessageType.GLOBAL_STATS_COMMAND_ANSWER:
-            logger.info("Handling GLOBAL_STATS_COMMAND_ANSWER message")
-            chat_id = message_data.get("chat_id", "")
-            stats = message_data.get("stats", "")
-            message_id = message_data.get("message_id", "")
-            
+    except Exception as e:
+        logger.error(f"Failed to send message: {e}")
+
+@telegram_queue_dispatcher.register(TelegramQueueMessageType.MY_GLOBAL_RANKING_COMMAND_ANSWER)
+async def handle_my_global_ranking_command_answer(bot: Bot, message_data: dict):
+    logger.info("Handling MY_GLOBAL_RANKING_COMMAND_ANSWER message")
+    chat_id = message_data.get("chat_id", "")
+    message_id = message_data.get("message_id", "")
+    ranking_stats = message_data.get("ranking_stats", "")
+    top_languages = message_data.get("top_languages", [])
+    
+    # Create language filter buttons
+    builder = InlineKeyboardBuilder()
+    builder.button(text="All Languages", callback_data="my_global_ranking_all_langs")
+    
+    # Add buttons for top languages
+    for lang_code, count, lang_display in top_languages:
+        builder.button(
+            text=f"{lang_display} ({count})", 
+            callback_data=f"my_global_ranking_lang_{lang_code}"
+        )
+    
+    builder.adjust(2)  # Two buttons per row
+    
+    try:
+        if message_id:
+            await bot.edit_message_text(
+                chat_id = str(chat_id), 
+                message_id = int(message_id), 
+                text = ranking_stats, 
+                parse_mode="HTML",
+                reply_markup=builder.as_markup()
+            )
+        else:
             await bot.send_message(
-                chat_id,
-                stats,
+                chat_id, 
+                ranking_stats, 
                 parse_mode="HTML",
-                disable_web_page_preview=True
+                reply_markup=builder.as_markup()
             )
+    except Exception as e:
+        logger.error(f"Failed to send message: {e}")
+
+@telegram_queue_dispatcher.register(TelegramQueueMessageType.GLOBAL_CHAT_RANKING_COMMAND_ANSWER)
+async def handle_global_chat_ranking_command_answer(bot: Bot, message_data: dict):
+    logger.info("Handling GLOBAL_CHAT_RANKING_COMMAND_ANSWER message")
+    chat_id = message_data.get("chat_id", "")
+    ranking_stats = message_data.get("ranking_stats", "")
+    message_id = message_data.get("message_id", "")
+    top_languages = message_data.get("top_languages", [])
+    
+    # Create language filter buttons
+    builder = InlineKeyboardBuilder()
+    builder.button(text="All Languages", callback_data="global_chat_ranking_all_langs")
+    
+    # Add buttons for top languages
+    for lang_code, count, lang_display in top_languages:
+        if count > 0:  # Only show languages with messages
+            builder.button(
+                text=f"{lang_display} ({count})", 
+                callback_data=f"global_chat_ranking_lang_{lang_code}"
+            )
+    
+    builder.adjust(2)  # Two buttons per row
+    
+    try:
+        if message_id:
+            await bot.edit_message_text(
+                chat_id = str(chat_id), 
+                message_id = int(message_id), 
+                text = ranking_stats, 
+                parse_mode="HTML",
+                reply_markup=builder.as_markup()
+            )
+        else:
+            await bot.send_message(
+                chat_id, 
+                ranking_stats, 
+                parse_mode="HTML",
+                reply_markup=builder.as_markup()
+            )
+    except Exception as e:
+        logger.error(f"Failed to send message: {e}")
+
+@telegram_queue_dispatcher.register(TelegramQueueMessageType.CHAT_STATS_COMMAND_ANSWER)
+async def handle_chat_stats_command_answer(bot: Bot, message_data: dict):
+    logger.info("Handling CHAT_STATS_COMMAND_ANSWER message")
+    chat_id = message_data.get("chat_id", "")
+    stats = message_data.get("stats", "")
+    message_id = message_data.get("message_id", "")
+    
+    # Get actual member count from Telegram API
+    try:
+        member_count = await bot.get_chat_member_count(chat_id)
+
+        analyzed_members_match = re.search(r"💬 <b>Members with Analyzed Messages:</b> (\d+)", stats)
+        if analyzed_members_match and member_count > 0:
+            analyzed_members = int(analyzed_members_match.group(1))
+            
+            # Calculate the actual percentage based on Telegram's member count
+            percentage = (analyzed_members / member_count) * 100
+            
+            # Update both the total members count and the percentage
+            stats = re.sub(r"(👥 <b>Total Members:</b>) \d+", r"\1 {}".format(member_count), stats)
+            stats = re.sub(
+                r"(💬 <b>Members with Analyzed Messages:</b> \d+) \(\d+\.\d+%\)",
+                r"\1 ({:.1f}%)".format(percentage),
+                stats
+            )
+
+        # Replace the member count in the stats text
+        else:
+            stats = re.sub(r"(👥 <b>Total Members:</b>) \d+", r"\1 {}".format(member_count), stats)
         
-        elif message_type == TelegramQueueMessageType.CHAT_GLOBAL_TOP_COMMAND_ANSWER:
-            logger.info("Handling CHAT_GLOBAL_TOP_COMMAND_ANSWER message")
-            chat_id = message_data.get("chat_id", "")
-            top_stats = message_data.get("top_stats", "")
-            message_id = message_data.get("message_id", "")
-            top_languages = message_data.get("top_languages", [])
+    except Exception as e:
+        logger.error(f"Failed to get chat member count: {e}")
+    
+    # Send the message with updated stats
+    await bot.send_message(
+        chat_id,
+        stats,
+        parse_mode="HTML"
+    )
+
+@telegram_queue_dispatcher.register(TelegramQueueMessageType.GLOBAL_STATS_COMMAND_ANSWER)
+async def handle_global_stats_command_answer(bot: Bot, message_data: dict):
+    logger.info("Handling GLOBAL_STATS_COMMAND_ANSWER message")
+    chat_id = message_data.get("chat_id", "")
+    stats = message_data.get("stats", "")
+    message_id = message_data.get("message_id", "")
+    
+    await bot.send_message(
+        chat_id,
+        stats,
+        parse_mode="HTML",
+        disable_web_page_preview=True
+    )
+
+@telegram_queue_dispatcher.register(TelegramQueueMessageType.CHAT_GLOBAL_TOP_COMMAND_ANSWER)
+async def handle_chat_global_top_command_answer(bot: Bot, message_data: dict):
+    logger.info("Handling CHAT_GLOBAL_TOP_COMMAND_ANSWER message")
+    chat_id = message_data.get("chat_id", "")
+    top_stats = message_data.get("top_stats", "")
+    message_id = message_data.get("message_id", "")
+    top_languages = message_data.get("top_languages", [])
+    
+    # Create language filter buttons
+    builder = InlineKeyboardBuilder()
+    builder.button(text="All Languages", callback_data="chat_global_top_all_langs")
+    
+    # Add buttons for top languages
+    for lang_code, count, lang_display in top_languages:
+        if count > 0:  # Only show languages with messages
+            builder.button(
+                text=f"{lang_display} ({count})", 
+                callback_data=f"chat_global_top_lang_{lang_code}"
+            )
+    
+    builder.adjust(2)  # Two buttons per row
+                
+    try:
+        if message_id:
+            # Try to edit existing message
+            await bot.edit_message_text(
+                chat_id = chat_id, 
+                message_id = int(message_id), 
+                text = top_stats, 
+                parse_mode="HTML",
+                reply_markup=builder.as_markup(),
+                disable_web_page_preview=True
+            )
+        else:
+            # Send new message
+            sent_message = await bot.send_message(
+                chat_id, 
+                top_stats, 
+                parse_mode="HTML",
+                reply_markup=builder.as_markup(),
+                disable_web_page_preview=True
+            )
+            
+            # Store the message ID for future edits
+            # The message cache can be shared with the function below if it exists
+            if chat_id not in previous_messages:
+                previous_messages[chat_id] = {}
+            previous_messages[chat_id]['chat_global_top'] = sent_message.message_id
+    except Exception as e:
+        logger.error(f"Failed to send chat global top message: {e}")
+
+@telegram_queue_dispatcher.register(TelegramQueueMessageType.BACKTEST_RULES_COMMAND_ANSWER)
+async def handle_backtest_rules_command_answer(bot: Bot, message_data: dict):
+    logger.info("Handling BACKTEST_RULES_COMMAND_ANSWER message")
+    chat_id = message_data.get("chat_id", "")
+    report = message_data.get("report", "")
+
+    try:
+        await bot.send_message(chat_id, report, parse_mode="HTML", disable_web_page_preview=True)
+    except Exception as e:
+        logger.error(f"Failed to send backtest report: {e}")
+
+@telegram_queue_dispatcher.register(TelegramQueueMessageType.ADMIN_NOTIFICATION)
+async def handle_admin_notification(bot: Bot, message_data: dict):
+    logger.info("Handling ADMIN_NOTIFICATION message")
+    chat_id = message_data.get("chat_id", "")
+    text = message_data.get("text", "")
+    await bot.send_message(chat_id, text)
+
+@telegram_queue_dispatcher.register(TelegramQueueMessageType.USER_NOTIFICATION)
+async def handle_user_notification(bot: Bot, message_data: dict):
+    logger.info("Handling USER_NOTIFICATION message")
+    chat_id = message_data.get("chat_id", "")
+    user_id = message_data.get("user_id", "")
+    message_id = message_data.get("message_id", "")
+    text = message_data.get("text", "")
+    
+    # Reply to the user's message with the notification
+    try:
+        await bot.send_message(chat_id, text, reply_to_message_id=message_id)
+    except Exception as e:
+        logger.error(f"Failed to send user notification: {e}")
+        # Try without reply if it fails
+        await bot.send_message(chat_id, text)
+
+@telegram_queue_dispatcher.register(TelegramQueueMessageType.MODERATION_ACTION)
+async def handle_moderation_action(bot: Bot, message_data: dict):
+    logger.info("Handling MODERATION_ACTION message")
+    chat_id = message_data.get("chat_id", "")
+    user_id = message_data.get("user_id", "")
+    action_type = message_data.get("action_type", "")
+    duration_seconds = message_data.get("duration_seconds", 0)
+    
+    try:
+        if action_type == "warning":
+            # Warning is just a notification, no action needed
+            logger.info(f"Warning issued to user {user_id} in chat {chat_id}")
+            
+        elif action_type == "timeout":
+            # Calculate until_date for restriction
+            until_date = datetime.now() + timedelta(seconds=duration_seconds)
+            logger.info(f"Timing out user {user_id} in chat {chat_id} until {until_date}")
+            
+            # Restrict user permissions
+            permissions = ChatPermissions(
+                can_send_messages=False,
+                can_send_media_messages=False,
+                can_send_polls=False,
+                can_send_other_messages=False,
+                can_add_web_page_previews=False,
+                can_change_info=False,
+                can_invite_users=False,
+                can_pin_messages=False
+            )
             
-            # Create language filter buttons
-            builder = InlineKeyboardBuilder()
-            builder.button(text="All Languages", callback_data="chat_global_top_all_langs")
+            await bot.restrict_chat_member(
+                chat_id=chat_id,
+                user_id=user_id,
+                permissions=permissions,
+                until_date=until_date
+            )
             
-            # Add buttons for top languages
-            for lang_code, count, lang_display in top_languages:
-                if count > 0:  # Only show languages with messages
-                    builder.button(
-                        text=f"{lang_display} ({count})", 
-                        callback_data=f"chat_global_top_lang_{lang_code}"
-                    )
+        elif action_type == "temporary_ban":
+            # Ban user with until_date
+            until_date = datetime.now() + timedelta(seconds=duration_seconds)
+            logger.info(f"Temporary banning user {user_id} in chat {chat_id} until {until_date}")
             
-            builder.adjust(2)  # Two buttons per row
-                        
-            try:
-                if message_id:
-                    # Try to edit existing message
-                    await bot.edit_message_text(
-                        chat_id = chat_id, 
-                        message_id = int(message_id), 
-                        text = top_stats, 
-                        parse_mode="HTML",
-                        reply_markup=builder.as_markup(),
-                        disable_web_page_preview=True
-                    )
-                else:
-                    # Send new message
-                    sent_message = await bot.send_message(
-                        chat_id, 
-                        top_stats, 
-                        parse_mode="HTML",
-                        reply_markup=builder.as_markup(),
-                        disable_web_page_preview=True
-                    )
-                    
-                    # Store the message ID for future edits
-                    # The message cache can be shared with the function below if it exists
-                    if not hasattr(handle_queue_message, 'previous_messages'):
-                        handle_queue_message.previous_messages = {}
-                    if chat_id not in handle_queue_message.previous_messages:
-                        handle_queue_message.previous_messages[chat_id] = {}
-                    handle_queue_message.previous_messages[chat_id]['chat_global_top'] = sent_message.message_id
-            except Exception as e:
-                logger.error(f"Failed to send chat global top message: {e}")
-        
-        
-        elif message_type == TelegramQueueMessageType.ADMIN_NOTIFICATION:
-            logger.info("Handling ADMIN_NOTIFICATION message")
-            chat_id = message_data.get("chat_id", "")
-            text = message_data.get("text", "")
-            await bot.send_message(chat_id, text)
+            await bot.ban_chat_member(
+                chat_id=chat_id,
+                user_id=user_id,
+                until_date=until_date
+            )
+            join_screening.note_ban(chat_id, user_id, until_date)
             
-        elif message_type == TelegramQueueMessageType.USER_NOTIFICATION:
-            logger.info("Handling USER_NOTIFICATION message")
-            chat_id = message_data.get("chat_id", "")
-            user_id = message_data.get("user_id", "")
-            message_id = message_data.get("message_id", "")
-            text = message_data.get("text", "")
+        elif action_type == "permanent_ban":
+            # Permanent ban
+            logger.info(f"Permanently banning user {user_id} in chat {chat_id}")
             
-            # Reply to the user's message with the notification
-            try:
-                await bot.send_message(chat_id, text, reply_to_message_id=message_id)
-            except Exception as e:
-                logger.error(f"Failed to send user notification: {e}")
-                # Try without reply if it fails
-                await bot.send_message(chat_id, text)
+            await bot.ban_chat_member(
+                chat_id=chat_id,
+                user_id=user_id
+            )
+            join_screening.note_ban(chat_id, user_id)
             
-        elif message_type == TelegramQueueMessageType.MODERATION_ACTION:
-            logger.info("Handling MODERATION_ACTION message")
-            chat_id = message_data.get("chat_id", "")
-            user_id = message_data.get("user_id", "")
-            action_type = message_data.get("action_type", "")
-            duration_seconds = message_data.get("duration_seconds", 0)
+    except Exception as e:
+        logger.error(f"Failed to apply moderation action: {e}")
+
+@telegram_queue_dispatcher.register(TelegramQueueMessageType.LIFT_RESTRICTION)
+async def handle_lift_restriction(bot: Bot, message_data: dict):
+    logger.info("Handling LIFT_RESTRICTION message")
+    chat_id = message_data.get("chat_id", "")
+    user_id = message_data.get("user_id", "")
+    restriction_type = message_data.get("restriction_type", "")
+    
+    try:
+        if restriction_type == "timeout":
+            # Give the member the chat's default permissions back
+            chat = await bot.get_chat(chat_id)
+            logger.info(f"Lifting expired timeout of user {user_id} in chat {chat_id}")
+            await bot.restrict_chat_member(
+                chat_id=chat_id,
+                user_id=user_id,
+                permissions=chat.permissions or ChatPermissions(can_send_messages=True)
+            )
             
-            try:
-                if action_type == "warning":
-                    # Warning is just a notification, no action needed
-                    logger.info(f"Warning issued to user {user_id} in chat {chat_id}")
-                    
-                elif action_type == "timeout":
-                    # Calculate until_date for restriction
-                    until_date = datetime.now() + timedelta(seconds=duration_seconds)
-                    logger.info(f"Timing out user {user_id} in chat {chat_id} until {until_date}")
-                    
-                    # Restrict user permissions
-                    permissions = ChatPermissions(
-                        can_send_messages=False,
-                        can_send_media_messages=False,
-                        can_send_polls=False,
-                        can_send_other_messages=False,
-                        can_add_web_page_previews=False,
-                        can_change_info=False,
-                        can_invite_users=False,
-                        can_pin_messages=False
-                    )
-                    
-                    await bot.restrict_chat_member(
-                        chat_id=chat_id,
-                        user_id=user_id,
-                        permissions=permissions,
-                        until_date=until_date
-                    )
-                    
-                elif action_type == "temporary_ban":
-                    # Ban user with until_date
-                    until_date = datetime.now() + timedelta(seconds=duration_seconds)
-                    logger.info(f"Temporary banning user {user_id} in chat {chat_id} until {until_date}")
-                    
-                    await bot.ban_chat_member(
-                        chat_id=chat_id,
-                        user_id=user_id,
-                        until_date=until_date
-                    )
-                    
-                elif action_type == "permanent_ban":
-                    # Permanent ban
-                    logger.info(f"Permanently banning user {user_id} in chat {chat_id}")
-                    
-                    await bot.ban_chat_member(
-                        chat_id=chat_id,
-                        user_id=user_id
-                    )
-                    
-            except Exception as e:
-                logger.error(f"Failed to apply moderation action: {e}")
+        elif restriction_type == "temporary_ban":
+            logger.info(f"Lifting expired ban of user {user_id} in chat {chat_id}")
+            await bot.unban_chat_member(chat_id=chat_id, user_id=user_id, only_if_banned=True)
+            join_screening.note_unban(chat_id, user_id)
             
-        else:
-            logger.warning(f"Unhandled message type: {message_type}")
+    except Exception as e:
+        logger.error(f"Failed to lift restriction: {e}")
+
+async def handle_queue_message(bot: Bot, message: IncomingMessage):
+    rabbitmq_manager.record_consumed(message)
+    async with message.process():
+        message_data = decode_message(message.body, message.content_type).get("result", {})
+        logger.info("Received message: %s", redacted(message_data))
+        message_type = message_data.get("message_type", "Unknown")
+        
+        trace = extract(message_data)
+        record_queue_wait(message.routing_key, trace)
+        with start_span(f"bot.{message_type}", trace):
+            await telegram_queue_dispatcher.dispatch(message_type, bot, message_data)
 
 async def consume_telegram_queue_messages(bot: Bot):
     await rabbitmq_manager.connect()
@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from langdetect import detect_langs
+from settings import get_settings
+from middlewares.monitoring.metrics import registry
+
+settings = get_settings()
+
+cache_lookups_counter = registry.counter("cache_lookups_total", "Cache lookups by cache and result (hit/miss)", ["cache", "result"])
+detections_counter = registry.counter("language_detections_total", "Language detections run, by where they ran", ["source"])
+detection_duration_histogram = registry.histogram("language_detection_duration_seconds", "Detection latency including pool wait", ["source"])
+
+def _detect_languages(text: str) -> List[Tuple[str, float]]:
+    """Runs in a pool process; returns plain tuples so the result pickles cheaply"""
+    return [(lang.lang, lang.prob) for lang in detect_langs(text)]
+
+class DetectionCache:
+    """Small LRU cache of detection results keyed by a hash of the text"""
+    def __init__(self, max_size: int, name: str = "detection"):
+        self.max_size = max_size
+        self.name = name
+        self._items: "OrderedDict[str, List[Tuple[str, float]]]" = OrderedDict()
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> Optional[List[Tuple[str, float]]]:
+        key = self.key(text)
+        result = self._items.get(key)
+        if result is not None:
+            self._items.move_to_end(key)
+        cache_lookups_counter.inc(cache=self.name, result="miss" if result is None else "hit")
+        return result
+
+    def put(self, text: str, result: List[Tuple[str, float]]):
+        key = self.key(text)
+        self._items[key] = result
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+class SlidingWindowRateLimiter:
+    """Allows at most `limit` calls per `window_seconds` for each key"""
+    def __init__(self, limit: int, window_seconds: float):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self._calls: Dict[int, deque] = {}
+
+    def retry_after(self, key: int, now: Optional[float] = None) -> float:
+        """Register a call and return 0, or return the seconds to wait if the key is over the limit"""
+        now = time.monotonic() if now is None else now
+        calls = self._calls.setdefault(key, deque())
+        while calls and calls[0] <= now - self.window_seconds:
+            calls.popleft()
+
+        if len(calls) >= self.limit:
+            return calls[0] + self.window_seconds - now
+
+        calls.append(now)
+        # Drop idle keys so the table doesn't grow with every user who ever ran the command
+        if len(self._calls) > 10_000:
+            for stale_key in [k for k, v in self._calls.items() if not v or v[-1] <= now - self.window_seconds]:
+                del self._calls[stale_key]
+        return 0.0
+
+class LanguageDetector:
+    """
+    Runs langdetect in a bounded process pool so long texts don't block the
+    bot's event loop (and with it webhook processing for every chat).
+    """
+    def __init__(self, pool_size: int, cache_size: int, timeout: float):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.cache = DetectionCache(cache_size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Bounds the number of texts waiting for the pool, not just the ones being processed
+        self._slots = asyncio.Semaphore(pool_size * 2)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.pool_size)
+        return self._executor
+
+    async def detect(self, text: str) -> List[Tuple[str, float]]:
+        cached = self.cache.get(text)
+        if cached is not None:
+            return cached
+
+        started = time.perf_counter()
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            result = await asyncio.wait_for(
+                loop.run_in_executor(self._get_executor(), _detect_languages, text),
+                timeout=self.timeout
+            )
+        detection_duration_histogram.observe(time.perf_counter() - started, source="bot")
+        detections_counter.inc(source="bot")
+
+        self.cache.put(text, result)
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+language_detector = LanguageDetector(
+    pool_size=settings.BOT_DETECTION_POOL_SIZE,
+    cache_size=settings.BOT_DETECTION_CACHE_SIZE,
+    timeout=settings.BOT_DETECTION_TIMEOUT_SECONDS
+)
+
+analyze_language_rate_limiter = SlidingWindowRateLimiter(
+    limit=settings.ANALYZE_LANGUAGE_RATE_LIMIT,
+    window_seconds=settings.ANALYZE_LANGUAGE_RATE_WINDOW_SECONDS
+)
@@ -0,0 +1,41 @@
+import time
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter, TelegramAPIError
+from middlewares.monitoring.metrics import registry
+from middlewares.database.chat_costs import chat_costs, parse_chat_id
+
+requests_counter = registry.counter(
+    "telegram_api_requests_total", "Bot API calls by method and outcome", ["method", "status"]
+)
+request_duration_histogram = registry.histogram(
+    "telegram_api_request_duration_seconds", "Bot API call latency", ["method"]
+)
+retry_after_counter = registry.counter(
+    "telegram_api_retry_after_total", "Bot API calls rejected with 429 Too Many Requests", ["method"]
+)
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Session middleware recording latency and outcome of every Bot API call"""
+    async def __call__(self, make_request, bot, method):
+        method_name = type(method).__name__
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            status = "retry_after"
+            retry_after_counter.inc(method=method_name)
+            raise
+        except TelegramAPIError:
+            status = "api_error"
+            raise
+        except Exception:
+            status = "network_error"
+            raise
+        finally:
+            request_duration_histogram.observe(time.perf_counter() - started, method=method_name)
+            requests_counter.inc(method=method_name, status=status)
+            # Queue-driven calls pass chat_id as a string
+            chat_id = parse_chat_id(getattr(method, "chat_id", None))
+            if chat_id is not None:
+                chat_costs.record(chat_id, telegram_calls=1)
@@ -0,0 +1,118 @@
+"""
+Per-chat cost accounting.
+
+Each process adds up what every chat costs in memory: messages seen at
+ingestion, messages analyzed, worker CPU time spent on detection, Mongo
+commands sent while handling the chat's queue messages and Bot API calls
+made for it. Every CHAT_COST_FLUSH_SECONDS the totals are written to the
+chat_costs collection in one bulk write, as $inc upserts on one document per
+chat and day, so the backend and the bot add to the same documents.
+
+Mongo commands are attributed through current_cost_chat, which the queue
+handlers set for the chat of the message they handle (see attributed_to).
+"""
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from middlewares.database.db import database
+from middlewares.monitoring.mongo import current_cost_chat, chat_round_trips
+from middlewares.monitoring.metrics import registry
+from settings import get_settings
+from bot_telegram.utils.logging_config import logger
+
+settings = get_settings()
+logger = logger.getChild('chat_costs')
+
+flushes_counter = registry.counter("chat_cost_flushes_total", "Chat cost flushes, by outcome (ok/error)", ["outcome"])
+pending_chats_gauge = registry.gauge("chat_cost_pending_chats", "Chats with costs not flushed yet")
+
+COST_FIELDS = ("messages_seen", "messages_analyzed", "detection_cpu_seconds", "db_operations", "telegram_calls")
+
+def parse_chat_id(chat_id) -> Optional[int]:
+    """Numeric chat id from an int or a string like "-100123"; None for @usernames and missing ids"""
+    if chat_id in (None, ""):
+        return None
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        return None
+
+def chat_id_of(message_data: dict) -> Optional[int]:
+    """Chat a queue message is about: chat_id, or the chat of an ingested chat_message"""
+    return parse_chat_id(message_data.get("chat_id") or (message_data.get("chat_message") or {}).get("chat_id"))
+
+def add_costs(pending: Dict[int, Dict[str, float]], chat_id: int, amounts: Dict[str, float]):
+    costs = pending.get(chat_id)
+    if costs is None:
+        costs = pending[chat_id] = dict.fromkeys(COST_FIELDS, 0)
+    for field, amount in amounts.items():
+        costs[field] += amount
+
+class ChatCostAccounting:
+    def __init__(self, flush_seconds: float):
+        self.flush_seconds = flush_seconds
+        self._pending: Dict[int, Dict[str, float]] = {}
+
+    def record(self, chat_id, **amounts: float):
+        """Add to a chat's costs, e.g. record(chat_id, messages_seen=1)"""
+        chat_id = parse_chat_id(chat_id)
+        if chat_id is None:
+            return
+        add_costs(self._pending, chat_id, amounts)
+
+    @contextmanager
+    def attributed_to(self, chat_id: Optional[int]):
+        """Count the Mongo commands sent inside the block as the chat's"""
+        token = current_cost_chat.set(chat_id)
+        try:
+            yield
+        finally:
+            current_cost_chat.reset(token)
+
+    def drain(self) -> Dict[int, Dict[str, float]]:
+        """Take the costs recorded since the last drain"""
+        pending, self._pending = self._pending, {}
+        # The command listener runs in Motor's executor threads; counts added
+        # between the copy and the subtraction are left for the next drain
+        round_trips = chat_round_trips.copy()
+        chat_round_trips.subtract(round_trips)
+        for chat_id, count in round_trips.items():
+            if count:
+                add_costs(pending, chat_id, {"db_operations": count})
+        return pending
+
+    async def flush(self) -> int:
+        """Write the pending costs in one bulk write; returns the chats written"""
+        pending = self.drain()
+        if not pending:
+            return 0
+        try:
+            await database.add_chat_costs(pending, datetime.now().strftime("%Y-%m-%d"))
+        except Exception:
+            flushes_counter.inc(outcome="error")
+            # Keep the costs for the next flush
+            for chat_id, costs in pending.items():
+                self.record(chat_id, **costs)
+            raise
+        flushes_counter.inc(outcome="ok")
+        return len(pending)
+
+    async def run(self):
+        """Flush every flush_seconds until cancelled"""
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            pending_chats_gauge.set(len(self._pending))
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush chat costs: {e}")
+
+async def heaviest_chats(days: int, metric: str, limit: int) -> List[Dict]:
+    """Chats with the highest summed metric over the last `days` days, with all their cost fields"""
+    if metric not in COST_FIELDS:
+        raise ValueError(f"Unknown cost metric {metric}, expected one of {', '.join(COST_FIELDS)}")
+    since = (datetime.now() - timedelta(days=max(days, 1) - 1)).strftime("%Y-%m-%d")
+    return await database.get_heaviest_chats(since, metric, limit)
+
+chat_costs = ChatCostAccounting(settings.CHAT_COST_FLUSH_SECONDS)
@@ -1,16 +1,23 @@
 from datetime import datetime, timedelta
 from typing import Optional, Dict, List
-from beanie import init_beanie
+from beanie import UpdateResponse, init_beanie
 from motor.motor_asyncio import AsyncIOMotorClient
-from .models import User, ChatMessage, Chat, ChatSettings, RestrictionType, ModerationRule, ConditionRelationType, RuleCondition, RuleConditionType, RestrictionRecord
+from pymongo import UpdateOne
+from .models import User, ChatMessage, Chat, ChatSettings, RestrictionType, ModerationRule, RuleCondition, RestrictionRecord
 from aiogram import BaseMiddleware
 from settings import get_settings
+from middlewares.monitoring.mongo import MongoCommandMetrics, instrument_db_methods
+from .rule_engine import RuleContext, compile_condition, rule_engine
+from .restriction_aggregates import ALL_CHATS, aggregate_increments, build_restriction_aggregates
+from .language_windows import push_sample
+from .settings_cache import settings_cache
 
 from bot_telegram.utils.logging_config import logger
 logger = logger.getChild("database_middleware")
 
 settings = get_settings()
 
+@instrument_db_methods
 class DatabaseMiddleware(BaseMiddleware):
     def __init__(self):
         mongodb_uri = settings.MONGODB_CONNECTION_URI
@@ -19,13 +26,16 @@ class DatabaseMiddleware(BaseMiddleware):
         if not mongodb_uri or not mongodb_db:
             raise ValueError("Missing required environment variables: MONGODB_CONNECTION_URI or MONGODB_DATABASE")
             
-        self.client = AsyncIOMotorClient(mongodb_uri)
+        self.client = AsyncIOMotorClient(mongodb_uri, event_listeners=[MongoCommandMetrics()])
         self.db = self.client[mongodb_db]
         super().__init__()
 
     async def setup(self):
         """Initialize Beanie with the User and Chat models."""
         await init_beanie(database=self.db, document_models=[User, Chat])
+        # One chat_costs document per chat and day, see database/chat_costs.py
+        await self.db["chat_costs"].create_index([("chat_id", 1), ("day", 1)], unique=True)
+        await self.db["chat_costs"].create_index("day")
 
     async def get_user(self, user_id: int) -> Optional[User]:
         """Fetch a user by user_id."""
@@ -50,14 +60,17 @@ class DatabaseMiddleware(BaseMiddleware):
             return user
         return None
 
-    async def add_chat_message(self, user_id: int, message: ChatMessage) -> Optional[User]:
-        """Add a chat message to a user's chat history."""
+    async def add_chat_message(self, user_id: int, message: ChatMessage, language_sample: Optional[float] = None) -> Optional[User]:
+        """Add a chat message to a user's chat history, and its language sample to the chat's language window."""
         user = await self.get_user(user_id)
         if user:
             if message.chat_id not in user.chat_history:
                 user.chat_history[message.chat_id] = []
             
             user.chat_history[message.chat_id].append(message)
+            if language_sample is not None:
+                window = user.language_windows.setdefault(message.chat_id, [])
+                push_sample(window, language_sample, settings.LANGUAGE_WINDOW_SIZE)
             await user.save()
             return user
         return None
@@ -87,16 +100,36 @@ class DatabaseMiddleware(BaseMiddleware):
 
     async def update_chat(self, chat_id: int, update_data: Dict) -> Optional[Chat]:
         """Update chat data."""
-        chat = await self.get_chat(chat_id)
-        if chat:
-            # Beanie's set method directly updates the document fields
-            await chat.set(update_data)
-            # No need to call save() separately if using set() on a retrieved document,
-            # as Beanie's .set() followed by an operation that saves (like another .save() or if it's part of a larger transaction)
-            # or if the document is saved later. However, explicit save is clearer.
-            await chat.save() # Explicitly save changes
-            return chat
-        return None
+        # Only the given fields are written, so a concurrent update of other
+        # fields (or of settings_version) is never overwritten by a stale copy
+        # chat_id identifies the document; settings_version only moves through $inc
+        # (a full chat dict, e.g. on migration, carries both)
+        fields = {key: value for key, value in update_data.items() if key not in ("chat_id", "settings_version")}
+        update = {"$set": fields}
+        if "chat_settings" in update_data:
+            # Invalidates compiled moderation rules cached by the rule engine
+            update["$inc"] = {"settings_version": 1}
+        chat = await Chat.find_one(Chat.chat_id == chat_id).update(update, response_type=UpdateResponse.NEW_DOCUMENT)
+        if chat and "chat_settings" in update_data:
+            # Followers resolve their settings from this chat; bumping their
+            # versions in one write makes every cache recompute them
+            await self.db["chats"].update_many(
+                {"chat_settings.sync_settings_with": chat.chat_id},
+                {"$inc": {"settings_version": 1}}
+            )
+        return chat
+
+    async def get_effective_chat(self, chat_id: int) -> Optional[Chat]:
+        """Fetch a chat with its effective settings: its leader's if it follows another chat (read-only)"""
+        return await settings_cache.resolve(await self.get_chat(chat_id), self.get_chat)
+
+    async def get_settings_followers(self, chat_id: int) -> List[Dict]:
+        """chat_id and last_known_name of the chats following this chat's settings"""
+        cursor = self.db["chats"].find(
+            {"chat_settings.sync_settings_with": int(chat_id)},
+            {"_id": 0, "chat_id": 1, "last_known_name": 1}
+        )
+        return await cursor.to_list(length=None)
 
     async def migrate_user_chat_histories(self, source_chat_id: int, target_chat_id: int) -> int:
         """
@@ -139,18 +172,14 @@ class DatabaseMiddleware(BaseMiddleware):
         return False
 
     async def add_user_to_chat(self, chat_id: int, user_id: int):
-        chat = await self.get_chat(chat_id)
-        if chat and user_id not in chat.users:
-            chat.users.append(user_id)
-            await chat.save()
-        return chat
+        return await Chat.find_one(Chat.chat_id == chat_id).update(
+            {"$addToSet": {"users": user_id}}, response_type=UpdateResponse.NEW_DOCUMENT
+        )
 
     async def remove_user_from_chat(self, chat_id: int, user_id: int):
-        chat = await self.get_chat(chat_id)
-        if chat and user_id in chat.users:
-            chat.users.remove(user_id)
-            await chat.save()
-        return chat
+        return await Chat.find_one(Chat.chat_id == chat_id).update(
+            {"$pull": {"users": user_id}}, response_type=UpdateResponse.NEW_DOCUMENT
+        )
 
     async def is_user_in_chat(self, chat_id: int, user_id: int) -> bool:
         chat = await self.get_chat(chat_id)
@@ -165,15 +194,27 @@ class DatabaseMiddleware(BaseMiddleware):
         if hasattr(restriction_record, "dict"):
             restriction_record = restriction_record.dict()
         
-        # Add record to user's restriction history
-        await self.db["users"].update_one(
-            {"user_id": int(user_id)}, 
-            {"$push": {"restriction_history": restriction_record}}
+        restriction_type = restriction_record.get("restriction_type")
+        chat_id = restriction_record.get("chat_id")
+        
+        # Add record to user's restriction history and to the aggregates the rule
+        # conditions read. Users whose aggregates were never built are matched by
+        # the fallback below, which rebuilds them from the full history.
+        result = await self.db["users"].update_one(
+            {"user_id": int(user_id), f"restriction_aggregates.{ALL_CHATS}": {"$exists": True}},
+            {
+                "$push": {"restriction_history": restriction_record},
+                "$inc": aggregate_increments(chat_id, restriction_type, restriction_record.get("duration_seconds"))
+            }
         )
+        if result.matched_count == 0:
+            await self.db["users"].update_one(
+                {"user_id": int(user_id)}, 
+                {"$push": {"restriction_history": restriction_record}}
+            )
+            await self.rebuild_restriction_aggregates(user_id)
         
         # For timeouts and bans, also add to active restrictions
-        restriction_type = restriction_record.get("restriction_type")
-        chat_id = restriction_record.get("chat_id")
         
         if restriction_type in [RestrictionType.TIMEOUT.value, RestrictionType.TEMPORARY_BAN.value, RestrictionType.PERMANENT_BAN.value]:
             # Create restriction object
@@ -184,11 +225,12 @@ class DatabaseMiddleware(BaseMiddleware):
                 "duration_seconds": restriction_record.get("duration_seconds")
             }
             
-            # Calculate expiration if there's a duration
+            # Calculate expiration if there's a duration. Stored as a date, so the
+            # expiry sweeper can range-query it
+            expires_at = None
             if restriction_record.get("duration_seconds"):
-                restriction["expires_at"] = (
-                    datetime.now() + timedelta(seconds=restriction_record.get("duration_seconds"))
-                ).isoformat()
+                expires_at = datetime.now() + timedelta(seconds=restriction_record.get("duration_seconds"))
+                restriction["expires_at"] = expires_at
             
             # Add to user's active restrictions for this chat
             await self.db["users"].update_one(
@@ -197,9 +239,215 @@ class DatabaseMiddleware(BaseMiddleware):
                     "$push": {f"restrictions.{chat_id}": restriction}
                 }
             )
+            if expires_at is not None:
+                # Keep the user's earliest expiry in the indexed next_restriction_expiry
+                await self.db["users"].update_one(
+                    {
+                        "user_id": int(user_id),
+                        "$or": [{"next_restriction_expiry": None}, {"next_restriction_expiry": {"$gt": expires_at}}]
+                    },
+                    {"$set": {"next_restriction_expiry": expires_at}}
+                )
         
         return True
 
+    async def get_users_with_expired_restrictions(self, now: datetime, limit: int) -> List[Dict]:
+        """Users whose earliest restriction expiry has passed, through the next_restriction_expiry index"""
+        cursor = self.db["users"].find(
+            {"next_restriction_expiry": {"$lte": now}},
+            {"_id": 0, "user_id": 1, "restrictions": 1, "next_restriction_expiry": 1}
+        ).sort("next_restriction_expiry", 1).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def remove_expired_restrictions(self, removals: List[Dict], now: datetime) -> int:
+        """
+        Pull expired restrictions and store the next expiry for a batch of users in one bulk write.
+        Each removal is {"user_id", "previous_expiry", "chat_ids", "next_expiry"}; a user whose
+        next_restriction_expiry changed since it was read is skipped and picked up by the next sweep.
+        """
+        if not removals:
+            return 0
+        operations = [
+            UpdateOne(
+                {"user_id": removal["user_id"], "next_restriction_expiry": removal["previous_expiry"]},
+                {
+                    "$pull": {f"restrictions.{chat_id}": {"expires_at": {"$lte": now}} for chat_id in removal["chat_ids"]},
+                    "$set": {"next_restriction_expiry": removal["next_expiry"]}
+                }
+            )
+            for removal in removals
+        ]
+        result = await self.db["users"].bulk_write(operations, ordered=False)
+        return result.modified_count
+
+    async def backfill_restriction_expiry(self, batch_size: int) -> int:
+        """
+        Set next_restriction_expiry on users stored before it existed, converting
+        their ISO string expires_at values to dates. Returns the users updated.
+        """
+        updated = 0
+        while True:
+            docs = await self.db["users"].find(
+                {"next_restriction_expiry": {"$exists": False}},
+                {"_id": 0, "user_id": 1, "restrictions": 1}
+            ).limit(batch_size).to_list(length=batch_size)
+            if not docs:
+                return updated
+            operations = []
+            for doc in docs:
+                restrictions = doc.get("restrictions") or {}
+                expiries = []
+                for chat_restrictions in restrictions.values():
+                    for restriction in chat_restrictions:
+                        if isinstance(restriction.get("expires_at"), str):
+                            restriction["expires_at"] = datetime.fromisoformat(restriction["expires_at"])
+                        if restriction.get("expires_at") is not None:
+                            expiries.append(restriction["expires_at"])
+                operations.append(UpdateOne(
+                    {"user_id": doc["user_id"], "next_restriction_expiry": {"$exists": False}},
+                    {"$set": {"restrictions": restrictions, "next_restriction_expiry": min(expiries, default=None)}}
+                ))
+            await self.db["users"].bulk_write(operations, ordered=False)
+            updated += len(operations)
+
+    async def rebuild_restriction_aggregates(self, user_id: int, user: Optional[User] = None) -> Dict:
+        """Recompute a user's restriction aggregates from restriction_history and store them"""
+        user = user or await self.get_user(user_id)
+        if not user:
+            return {}
+        aggregates = build_restriction_aggregates(user.restriction_history or [])
+        await self.db["users"].update_one(
+            {"user_id": int(user_id)},
+            {"$set": {"restriction_aggregates": {
+                scope: {restriction_type: aggregate.dict() for restriction_type, aggregate in by_type.items()}
+                for scope, by_type in aggregates.items()
+            }}}
+        )
+        user.restriction_aggregates = aggregates
+        return aggregates
+
+    async def get_backtest_documents(self, chat_id: int, user_ids: List[int]) -> List[Dict]:
+        """
+        Raw user documents with only what a rule backtest reads: the chat's message
+        timestamps and analysis results, and the restriction history
+        """
+        chat_key = f"chat_history.{chat_id}"
+        cursor = self.db["users"].find(
+            {"user_id": {"$in": [int(user_id) for user_id in user_ids]}},
+            {
+                "_id": 0,
+                "user_id": 1,
+                f"{chat_key}.timestamp": 1,
+                f"{chat_key}.analysis_result": 1,
+                "restriction_history.chat_id": 1,
+                "restriction_history.restriction_type": 1,
+                "restriction_history.rule_index": 1,
+                "restriction_history.timestamp": 1,
+                "restriction_history.duration_seconds": 1
+            }
+        )
+        return await cursor.to_list(length=None)
+
+    async def get_chat_blocklists(self) -> List[Dict]:
+        """chat_id, blocked_users and sync_blocklist_with of every chat, for the join screening index"""
+        cursor = self.db["chats"].find(
+            {},
+            {"_id": 0, "chat_id": 1, "blocked_users": 1, "chat_settings.sync_blocklist_with": 1}
+        )
+        return await cursor.to_list(length=None)
+
+    async def get_active_ban_documents(self) -> List[Dict]:
+        """user_id and active restrictions of every user that has any, for the join screening index"""
+        cursor = self.db["users"].find(
+            {"restrictions": {"$exists": True, "$nin": [{}, None]}},
+            {"_id": 0, "user_id": 1, "restrictions": 1}
+        )
+        return await cursor.to_list(length=None)
+
+    def watch_chat_blocklists(self):
+        """Change stream of chat inserts and updates, with the fields the join screening index reads"""
+        return self.db["chats"].watch(
+            [
+                {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
+                {"$project": {
+                    "fullDocument.chat_id": 1,
+                    "fullDocument.blocked_users": 1,
+                    "fullDocument.chat_settings.sync_blocklist_with": 1
+                }}
+            ],
+            full_document="updateLookup"
+        )
+
+    def watch_user_bans(self):
+        """
+        Change stream of user writes that touch User.restrictions. Message writes,
+        by far the most frequent, don't change restrictions and are filtered out
+        on the server.
+        """
+        touches_restrictions = {
+            "$anyElementTrue": [{"$map": {
+                "input": {"$concatArrays": [
+                    {"$map": {"input": {"$objectToArray": {"$ifNull": ["$updateDescription.updatedFields", {}]}}, "in": "$$this.k"}},
+                    {"$ifNull": ["$updateDescription.removedFields", []]}
+                ]},
+                "in": {"$eq": [{"$substrCP": ["$$this", 0, 12]}, "restrictions"]}
+            }}]
+        }
+        return self.db["users"].watch(
+            [
+                {"$match": {"$or": [
+                    {"operationType": {"$in": ["insert", "replace"]}},
+                    {"operationType": "update", "$expr": touches_restrictions}
+                ]}},
+                {"$project": {"fullDocument.user_id": 1, "fullDocument.restrictions": 1}}
+            ],
+            full_document="updateLookup"
+        )
+
+    async def add_chat_costs(self, costs: Dict[int, Dict[str, float]], day: str) -> int:
+        """Add per-chat cost totals to the chats' documents for the day in one bulk write"""
+        if not costs:
+            return 0
+        now = datetime.now()
+        operations = [
+            UpdateOne(
+                {"chat_id": chat_id, "day": day},
+                {"$inc": chat_costs, "$set": {"updated_at": now}},
+                upsert=True
+            )
+            for chat_id, chat_costs in costs.items()
+        ]
+        result = await self.db["chat_costs"].bulk_write(operations, ordered=False)
+        return result.upserted_count + result.modified_count
+
+    async def get_heaviest_chats(self, since_day: str, metric: str, limit: int) -> List[Dict]:
+        """Chats by their summed costs since since_day (YYYY-MM-DD), highest metric first, with their names"""
+        cursor = self.db["chat_costs"].aggregate([
+            {"$match": {"day": {"$gte": since_day}}},
+            {"$group": {
+                "_id": "$chat_id",
+                "messages_seen": {"$sum": "$messages_seen"},
+                "messages_analyzed": {"$sum": "$messages_analyzed"},
+                "detection_cpu_seconds": {"$sum": "$detection_cpu_seconds"},
+                "db_operations": {"$sum": "$db_operations"},
+                "telegram_calls": {"$sum": "$telegram_calls"}
+            }},
+            {"$sort": {metric: -1}},
+            {"$limit": limit},
+            {"$lookup": {"from": "chats", "localField": "_id", "foreignField": "chat_id", "as": "chat"}},
+            {"$project": {
+                "_id": 0,
+                "chat_id": "$_id",
+                "last_known_name": {"$first": "$chat.last_known_name"},
+                "messages_seen": 1,
+                "messages_analyzed": 1,
+                "detection_cpu_seconds": 1,
+                "db_operations": 1,
+                "telegram_calls": 1
+            }}
+        ])
+        return await cursor.to_list(length=limit)
+
     async def get_user_restriction_history(self, user_id: int, chat_id: str = None, time_window: timedelta = None):
         """
         Get a user's restriction history, optionally filtered by chat and time window
@@ -246,82 +494,11 @@ class DatabaseMiddleware(BaseMiddleware):
         Returns:
             bool: True if condition is met, False otherwise
         """
-        # Language confidence check
-        if condition.type == RuleConditionType.SINGLE_MESSAGE_LANGUAGE_CONFIDENCE:
-            threshold = condition.values.get("threshold", 0.0)
-            # Check if any language in the analysis result exceeds the threshold
-            for lang_result in analysis_result:
-                if lang_result.get("prob", 0.0) >= threshold:
-                    return True
-            return False
-        
-        # Not allowed language check
-        elif condition.type == RuleConditionType.SINGLE_MESSAGE_CONFIDENCE_NOT_IN_ALLOWED_LANGUAGES:
-            threshold = condition.values.get("threshold", 0.0)
-            # Get allowed languages from chat settings
-            chat = await self.get_chat(int(chat_id))
-            allowed_languages = chat.chat_settings.allowed_languages
-            
-            # Check if any detected language is not in allowed languages and exceeds threshold
-            for lang_result in analysis_result:
-                lang_code = lang_result.get("lang", "")
-                confidence = lang_result.get("prob", 0.0)
-                
-                if lang_code not in allowed_languages and confidence >= threshold:
-                    return True
+        chat = await self.get_effective_chat(int(chat_id))
+        if not chat:
             return False
-        
-        # Previous restriction count check
-        elif condition.type == RuleConditionType.PREVIOUS_RESTRICTION_TYPE_COUNT:
-            target_count = condition.values.get("count", 0)
-            restriction_types = condition.values.get("restriction_type", [])
-            
-            # If "any" is in types, we count all restriction types
-            count_all = "any" in restriction_types
-            
-            # Get user's restriction history
-            restriction_history = await self.get_user_restriction_history(
-                user_id, 
-                chat_id if condition.this_chat_only else None
-            )
-            
-            # Count matching restrictions
-            count = 0
-            for restriction in restriction_history:
-                # Count if restriction type matches or we're counting all types
-                if count_all or restriction.restriction_type in restriction_types:
-                    count += 1
-            
-            return count >= target_count
-        
-        # Previous restriction time length check
-        elif condition.type == RuleConditionType.PREVIOUS_RESTRICTION_TYPE_TIME_LENGTH:
-            target_seconds = condition.values.get("seconds", 0)
-            window_hours = condition.values.get("window_hours", 24.0)
-            restriction_types = condition.values.get("restriction_type", [])
-            
-            # If "any" is in types, we consider all restriction types
-            consider_all = "any" in restriction_types
-            
-            # Get user's restriction history within the time window
-            time_window = timedelta(hours=window_hours)
-            restriction_history = await self.get_user_restriction_history(
-                user_id, 
-                chat_id if condition.this_chat_only else None,
-                time_window
-            )
-            
-            # Sum durations of matching restrictions
-            total_seconds = 0
-            for restriction in restriction_history:
-                # Add duration if restriction type matches or we're counting all types
-                if consider_all or restriction.restriction_type in restriction_types:
-                    total_seconds += restriction.duration_seconds or 0
-            
-            return total_seconds >= target_seconds
-        
-        # Unknown condition type
-        return False
+        compiled = compile_condition(condition, chat.chat_settings)
+        return await compiled.evaluate(RuleContext(self, user_id, chat_id, text, analysis_result))
 
     async def check_moderation_rules(self, user_id: int, chat_id: str, message_id: str, text: str, analysis_result: List):
         """
@@ -337,31 +514,15 @@ class DatabaseMiddleware(BaseMiddleware):
         Returns:
             tuple: (triggered_rule, rule_index) or (None, None) if no rule was triggered
         """
-        # Get chat settings and moderation rules
-        chat = await self.get_chat(int(chat_id))
+        chat = await self.get_effective_chat(int(chat_id))
         if not chat or not chat.chat_settings or not chat.chat_settings.moderation_rules:
             return None, None
         
-        # Check each rule
-        for rule_index, rule in enumerate(chat.chat_settings.moderation_rules):
-            # Check conditions based on condition relation type
-            condition_results = []
-            
-            for condition in rule.conditions:
-                condition_met = await self.check_rule_condition(
-                    condition, user_id, chat_id, text, analysis_result
-                )
-                condition_results.append(condition_met)
-            
-            # Determine if rule is triggered based on condition relation
-            rule_triggered = False
-            if rule.condition_relation == ConditionRelationType.AND:
-                rule_triggered = all(condition_results)
-            else:  # OR relation
-                rule_triggered = any(condition_results)
-            
-            if rule_triggered:
-                return rule, rule_index
+        context = RuleContext(self, user_id, chat_id, text, analysis_result)
+        triggered = await rule_engine.triggered_rules(chat, context, first_only=True)
+        if triggered:
+            rule_index, rule = triggered[0]
+            return rule, rule_index
         
         return None, None
 
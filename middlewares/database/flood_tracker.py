@@ -0,0 +1,86 @@
+"""
+In-memory message rate tracking for the message_rate rule condition.
+
+Every ingested message is recorded, sampled for analysis or not, as a timestamp
+in a per-(chat, user) deque capped at FLOOD_TRACKER_MAX_EVENTS. Entries live in
+shards keyed by user id, each an LRU ordered by last message, so eviction of
+idle users only ever looks at the oldest entries of one shard. Counts are per
+backend process: with several backends consuming general_queue each sees its
+share of a chat's messages.
+"""
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Optional, Tuple
+from middlewares.monitoring.metrics import registry
+from settings import get_settings
+
+settings = get_settings()
+
+tracked_users_gauge = registry.gauge("flood_tracker_tracked_users", "(chat, user) pairs with recent messages in the flood tracker")
+evictions_counter = registry.counter("flood_tracker_evictions_total", "Flood tracker entries dropped, by reason (idle/capacity)", ["reason"])
+
+Key = Tuple[str, int]
+
+class FloodTracker:
+    def __init__(self, shards: int, max_events: int, max_users: int, idle_seconds: float):
+        self.max_events = max_events
+        self.idle_seconds = idle_seconds
+        self.max_users_per_shard = max(1, max_users // shards)
+        self._shards = [OrderedDict() for _ in range(shards)]
+        self._tracked = 0
+
+    def _shard(self, user_id: int) -> "OrderedDict[Key, Deque[float]]":
+        return self._shards[int(user_id) % len(self._shards)]
+
+    def record(self, chat_id, user_id: int, now: Optional[float] = None):
+        """Record one message of the user in the chat"""
+        now = time.monotonic() if now is None else now
+        shard = self._shard(user_id)
+        key = (str(chat_id), int(user_id))
+        events = shard.get(key)
+        if events is None:
+            events = shard[key] = deque(maxlen=self.max_events)
+            self._tracked += 1
+        else:
+            shard.move_to_end(key)
+        events.append(now)
+        self._evict(shard, now)
+        tracked_users_gauge.set(self._tracked)
+
+    def _evict(self, shard: "OrderedDict[Key, Deque[float]]", now: float):
+        # The shard is ordered by last message, so idle entries are at the front
+        while shard:
+            events = next(iter(shard.values()))
+            if now - events[-1] > self.idle_seconds:
+                reason = "idle"
+            elif len(shard) > self.max_users_per_shard:
+                reason = "capacity"
+            else:
+                break
+            shard.popitem(last=False)
+            self._tracked -= 1
+            evictions_counter.inc(reason=reason)
+
+    def count(self, chat_id, user_id: int, window_seconds: float, now: Optional[float] = None) -> int:
+        """Messages of the user in the chat within the last window_seconds (at most max_events)"""
+        now = time.monotonic() if now is None else now
+        events = self._shard(user_id).get((str(chat_id), int(user_id)))
+        if not events:
+            return 0
+        since = now - window_seconds
+        count = 0
+        for timestamp in reversed(events):
+            if timestamp < since:
+                break
+            count += 1
+        return count
+
+    def __len__(self) -> int:
+        return self._tracked
+
+flood_tracker = FloodTracker(
+    settings.FLOOD_TRACKER_SHARDS,
+    settings.FLOOD_TRACKER_MAX_EVENTS,
+    settings.FLOOD_TRACKER_MAX_USERS,
+    settings.FLOOD_TRACKER_IDLE_SECONDS
+)
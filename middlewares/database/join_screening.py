@@ -0,0 +1,185 @@
+"""
+In-memory index for screening users when they join a chat.
+
+A joining user is refused if they are in the blocked_users of the chat or of a
+chat it syncs its blocklist with (ChatSettings.sync_blocklist_with), or hold an
+active ban in any of those chats. The index keeps each chat's blocklist and sync
+list, and each user's active bans by chat, so a join is answered from memory.
+
+It is loaded at startup and kept current by change streams on chats and users.
+Change streams need a replica set; on a standalone server the index falls back
+to a full reload every JOIN_SCREENING_REFRESH_SECONDS, which also runs with
+change streams to pick up deletions and anything missed while reconnecting.
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, Iterable, Optional, Tuple
+from pymongo.errors import OperationFailure
+from middlewares.database.db import database
+from middlewares.database.models import RestrictionType
+from middlewares.monitoring.metrics import registry
+from settings import get_settings
+from bot_telegram.utils.logging_config import logger
+
+settings = get_settings()
+logger = logger.getChild('join_screening')
+
+screenings_counter = registry.counter("join_screenings_total", "Chat joins screened, by result (allowed/blocked/banned)", ["result"])
+indexed_gauge = registry.gauge("join_screening_indexed_entries", "Entries in the join screening index, by kind (blocked/banned)", ["kind"])
+change_events_counter = registry.counter("join_screening_change_events_total", "Change events applied to the join screening index, by collection", ["collection"])
+
+BAN_TYPES = {RestrictionType.TEMPORARY_BAN.value, RestrictionType.PERMANENT_BAN.value}
+# Seconds before retrying a change stream that failed for another reason than a standalone server
+WATCH_RETRY_SECONDS = 5.0
+
+def _expiry_timestamp(value: Any) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+def active_bans(restrictions: Dict[str, Iterable[Dict[str, Any]]]) -> Dict[int, Optional[float]]:
+    """chat_id -> expiry timestamp (None if permanent) of the bans in a user's restrictions"""
+    bans: Dict[int, Optional[float]] = {}
+    for chat_id, chat_restrictions in (restrictions or {}).items():
+        for restriction in chat_restrictions or []:
+            if restriction.get("restriction_type") not in BAN_TYPES:
+                continue
+            expires_at = _expiry_timestamp(restriction.get("expires_at"))
+            chat_id = int(chat_id)
+            if chat_id in bans and (bans[chat_id] is None or (expires_at is not None and expires_at <= bans[chat_id])):
+                continue
+            bans[chat_id] = expires_at
+    return bans
+
+class JoinScreeningIndex:
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self._blocklists: Dict[int, FrozenSet[int]] = {}
+        self._synced: Dict[int, Tuple[int, ...]] = {}
+        # user_id -> chat_id -> ban expiry timestamp (None if permanent)
+        self._bans: Dict[int, Dict[int, Optional[float]]] = {}
+
+    def screen(self, chat_id: int, user_id: int, now: Optional[float] = None) -> Tuple[str, Optional[int]]:
+        """
+        ("allowed", None), or ("blocked"/"banned", chat_id) with the chat whose
+        blocklist or active ban refuses the user
+        """
+        now = time.time() if now is None else now
+        chat_id = int(chat_id)
+        user_id = int(user_id)
+        scope = (chat_id,) + self._synced.get(chat_id, ())
+        for source in scope:
+            if user_id in self._blocklists.get(source, ()):
+                return "blocked", source
+        bans = self._bans.get(user_id)
+        if bans:
+            for source in scope:
+                if source in bans and (bans[source] is None or bans[source] > now):
+                    return "banned", source
+        return "allowed", None
+
+    def ban_expiry(self, chat_id: int, user_id: int) -> Optional[datetime]:
+        """When the user's ban in the chat ends, None if permanent or not banned"""
+        expires_at = self._bans.get(int(user_id), {}).get(int(chat_id))
+        return datetime.fromtimestamp(expires_at) if expires_at is not None else None
+
+    def check(self, chat_id: int, user_id: int) -> Tuple[str, Optional[int]]:
+        """screen() and count the result"""
+        result, source = self.screen(chat_id, user_id)
+        screenings_counter.inc(result=result)
+        return result, source
+
+    def apply_chat(self, doc: Dict[str, Any]):
+        """Store one chat's blocklist and sync list from its document"""
+        chat_id = int(doc["chat_id"])
+        blocked = doc.get("blocked_users") or []
+        synced = (doc.get("chat_settings") or {}).get("sync_blocklist_with") or []
+        if blocked:
+            self._blocklists[chat_id] = frozenset(int(user_id) for user_id in blocked)
+        else:
+            self._blocklists.pop(chat_id, None)
+        synced = tuple(int(synced_id) for synced_id in synced if int(synced_id) != chat_id)
+        if synced:
+            self._synced[chat_id] = synced
+        else:
+            self._synced.pop(chat_id, None)
+
+    def apply_user(self, doc: Dict[str, Any]):
+        """Store one user's active bans from their document"""
+        bans = active_bans(doc.get("restrictions"))
+        if bans:
+            self._bans[int(doc["user_id"])] = bans
+        else:
+            self._bans.pop(int(doc["user_id"]), None)
+
+    def note_ban(self, chat_id: int, user_id: int, expires_at: Optional[datetime] = None):
+        """Add a ban the bot has just applied, ahead of the change event or reload that brings it"""
+        bans = self._bans.setdefault(int(user_id), {})
+        bans[int(chat_id)] = expires_at.timestamp() if expires_at else None
+
+    def note_unban(self, chat_id: int, user_id: int):
+        bans = self._bans.get(int(user_id))
+        if bans:
+            bans.pop(int(chat_id), None)
+            if not bans:
+                del self._bans[int(user_id)]
+
+    def load(self, chat_docs: Iterable[Dict[str, Any]], user_docs: Iterable[Dict[str, Any]]):
+        """Replace the whole index"""
+        index = JoinScreeningIndex(self.refresh_seconds)
+        for doc in chat_docs:
+            index.apply_chat(doc)
+        for doc in user_docs:
+            index.apply_user(doc)
+        self._blocklists, self._synced, self._bans = index._blocklists, index._synced, index._bans
+        self._update_gauges()
+
+    def _update_gauges(self):
+        indexed_gauge.set(sum(len(blocked) for blocked in self._blocklists.values()), kind="blocked")
+        indexed_gauge.set(len(self._bans), kind="banned")
+
+    async def refresh(self):
+        started_at = time.perf_counter()
+        self.load(await database.get_chat_blocklists(), await database.get_active_ban_documents())
+        logger.info(
+            f"Loaded join screening index: {len(self._blocklists)} blocklists, "
+            f"{len(self._bans)} banned users in {time.perf_counter() - started_at:.2f}s"
+        )
+
+    async def _watch(self, collection: str, open_stream, apply):
+        while True:
+            try:
+                async with open_stream() as stream:
+                    async for event in stream:
+                        doc = event.get("fullDocument")
+                        if doc:
+                            apply(doc)
+                            change_events_counter.inc(collection=collection)
+            except OperationFailure as e:
+                logger.warning(f"Change streams unavailable on {collection} ({e}), join screening relies on periodic reloads")
+                return
+            except Exception as e:
+                logger.error(f"Join screening change stream on {collection} failed: {e}")
+                await asyncio.sleep(WATCH_RETRY_SECONDS)
+
+    async def run(self):
+        """Load the index, follow change streams and reload every refresh_seconds until cancelled"""
+        watchers = [
+            asyncio.create_task(self._watch("chats", database.watch_chat_blocklists, self.apply_chat)),
+            asyncio.create_task(self._watch("users", database.watch_user_bans, self.apply_user))
+        ]
+        try:
+            while True:
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    logger.error(f"Failed to load join screening index: {e}")
+                await asyncio.sleep(self.refresh_seconds)
+        finally:
+            for watcher in watchers:
+                watcher.cancel()
+
+join_screening = JoinScreeningIndex(settings.JOIN_SCREENING_REFRESH_SECONDS)
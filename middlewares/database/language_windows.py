@@ -0,0 +1,46 @@
+"""
+Per-user language windows used by the rolling language rule conditions.
+
+User.language_windows[chat_id] is a ring buffer of the user's last
+LANGUAGE_WINDOW_SIZE analyzed messages in that chat, one float per message: the
+probability the detector gave to languages outside the chat's allowed languages.
+It is appended to when the message is stored, so conditions read a few floats
+instead of re-reading chat_history. Samples are computed against the allowed
+languages at message time; changing allowed_languages affects new messages only.
+"""
+from typing import Any, Dict, Iterable, List, Sequence
+
+def non_allowed_probability(analysis_result: Iterable[Dict[str, Any]], allowed_languages: Iterable[str]) -> float:
+    """Summed probability of the languages not in allowed_languages (each language counted once)"""
+    allowed = set(allowed_languages or [])
+    probs: Dict[str, float] = {}
+    for lang_result in analysis_result or []:
+        lang = lang_result.get("lang", "")
+        if lang not in allowed:
+            probs[lang] = max(probs.get(lang, 0.0), lang_result.get("prob", 0.0))
+    return min(1.0, sum(probs.values()))
+
+def push_sample(window: List[float], sample: float, size: int) -> List[float]:
+    """Append a sample, dropping the oldest ones beyond `size`"""
+    window.append(round(sample, 4))
+    if len(window) > size:
+        del window[:len(window) - size]
+    return window
+
+def rolling_share(window: Sequence[float], messages: int, threshold: float) -> float:
+    """
+    Share of the last `messages` messages with a non-allowed probability of at
+    least `threshold`. Missing messages count as allowed, so a user with fewer
+    messages than the window can't reach a high share with one misdetection.
+    """
+    if messages <= 0:
+        return 0.0
+    recent = window[-messages:]
+    return sum(1 for sample in recent if sample >= threshold) / messages
+
+def ewma(window: Sequence[float], alpha: float) -> float:
+    """Exponentially weighted moving average of the window, oldest first, starting from 0"""
+    average = 0.0
+    for sample in window:
+        average = alpha * sample + (1 - alpha) * average
+    return average
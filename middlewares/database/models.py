@@ -29,6 +29,12 @@ class RestrictionRecord(BaseModel):
     timestamp: str
     duration_seconds: Optional[float] = None
 
+class RestrictionAggregate(BaseModel):
+    """Running totals of one restriction type, see database/restriction_aggregates.py"""
+    count: int = 0
+    # Hour bucket (unix time // 3600, as a string key) -> summed restriction duration
+    duration_buckets: Dict[str, float] = Field(default_factory=dict)
+
 class Restriction(BaseModel):
     restriction_type: RestrictionType
     restriction_justification_message: Optional[str] = None
@@ -45,16 +51,25 @@ class User(Document):
     # we store it in a dict to easily check for specific chat's restrictions on chat join for example
     restrictions: Optional[Dict[str, List[Restriction]]] = Field(default_factory=dict)
     restriction_history: List[RestrictionRecord] = Field(default_factory=list)
+    # {chat_id or "all": {restriction_type: RestrictionAggregate}}, maintained by add_restriction_to_user
+    restriction_aggregates: Dict[str, Dict[str, RestrictionAggregate]] = Field(default_factory=dict)
+    # {chat_id: non-allowed language probability of the last messages}, see database/language_windows.py
+    language_windows: Dict[str, List[float]] = Field(default_factory=dict)
+    # Earliest expires_at of the active restrictions, queried by the expiry sweeper
+    next_restriction_expiry: Optional[datetime] = None
 
     class Settings:
         name = "users"
-        indexes = ["user_id"]
+        indexes = ["user_id", "next_restriction_expiry"]
 
 class RuleConditionType(str, Enum):
     SINGLE_MESSAGE_CONFIDENCE_NOT_IN_ALLOWED_LANGUAGES = "single_message_confidence_not_in_allowed_languages"
     SINGLE_MESSAGE_LANGUAGE_CONFIDENCE = "single_message_language_confidence"
     PREVIOUS_RESTRICTION_TYPE_TIME_LENGTH = "previous_restriction_type_time_length"
     PREVIOUS_RESTRICTION_TYPE_COUNT = "previous_restriction_type_count"
+    ROLLING_SHARE_NOT_IN_ALLOWED_LANGUAGES = "rolling_share_not_in_allowed_languages"
+    EWMA_NOT_IN_ALLOWED_LANGUAGES = "ewma_not_in_allowed_languages"
+    MESSAGE_RATE = "message_rate"
 
 # TODO: ЯК ЗАДАТИ КОНКРЕТНІ ПОЛЯ ЗАМІСТЬ ПРОСТО СЛОВНИКА (VALUES)
 class RuleCondition(BaseModel):
@@ -101,7 +116,9 @@ class Chat(Document):
     blocked_users: List[int] = [] # ids only 
     admins: Dict[int, List[str]] = {} # admins and their permissions in this chat
     chat_settings: ChatSettings = ChatSettings()
+    # Bumped on every chat_settings update; caches derived from the settings key on it
+    settings_version: int = 0
 
     class Settings:
         name = "chats"
-        indexes = ["chat_id"]
\ No newline at end of file
+        indexes = ["chat_id", "chat_settings.sync_settings_with"]
\ No newline at end of file
@@ -0,0 +1,61 @@
+"""
+Per-user restriction aggregates used by the history rule conditions.
+
+User.restriction_aggregates[scope][restriction_type] keeps a restriction count
+and the restriction durations summed per hour bucket, where scope is a chat id
+or ALL_CHATS for the user's restrictions in every chat. They are updated with
+$inc whenever a restriction is added, so conditions read them without scanning
+restriction_history. Sliding windows are resolved to whole hours: a window
+starting mid-hour includes the whole first bucket.
+"""
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional, FrozenSet
+from .models import RestrictionAggregate, RestrictionRecord
+
+ALL_CHATS = "all"
+BUCKET_SECONDS = 3600
+
+def bucket_of(timestamp: float) -> int:
+    return int(timestamp // BUCKET_SECONDS)
+
+def aggregate_increments(chat_id: str, restriction_type: str, duration_seconds: Optional[float], timestamp: Optional[float] = None) -> Dict[str, float]:
+    """$inc document adding one restriction to the chat and ALL_CHATS aggregates"""
+    bucket = bucket_of(time.time() if timestamp is None else timestamp)
+    increments = {}
+    for scope in (str(chat_id), ALL_CHATS):
+        prefix = f"restriction_aggregates.{scope}.{restriction_type}"
+        increments[f"{prefix}.count"] = 1
+        increments[f"{prefix}.duration_buckets.{bucket}"] = duration_seconds or 0
+    return increments
+
+def build_restriction_aggregates(history: Iterable[RestrictionRecord]) -> Dict[str, Dict[str, RestrictionAggregate]]:
+    """Rebuild the aggregates from a full restriction history (users created before aggregates existed)"""
+    aggregates: Dict[str, Dict[str, RestrictionAggregate]] = {}
+    for record in history:
+        bucket = str(bucket_of(datetime.fromisoformat(record.timestamp).timestamp()))
+        for scope in (str(record.chat_id), ALL_CHATS):
+            aggregate = aggregates.setdefault(scope, {}).setdefault(record.restriction_type, RestrictionAggregate())
+            aggregate.count += 1
+            aggregate.duration_buckets[bucket] = aggregate.duration_buckets.get(bucket, 0) + (record.duration_seconds or 0)
+    return aggregates
+
+def _selected(aggregates: Dict[str, Dict[str, RestrictionAggregate]], scope: str, types: Optional[FrozenSet[str]]):
+    by_type = aggregates.get(scope, {})
+    if types is None:
+        return by_type.values()
+    return [by_type[t] for t in types if t in by_type]
+
+def count_restrictions(aggregates, scope: str, types: Optional[FrozenSet[str]]) -> int:
+    """Restrictions of the given types (None = any) in a scope"""
+    return sum(aggregate.count for aggregate in _selected(aggregates, scope, types))
+
+def restriction_seconds_since(aggregates, scope: str, types: Optional[FrozenSet[str]], since: float) -> float:
+    """Summed restriction durations of the given types from the bucket containing `since`"""
+    first_bucket = bucket_of(since)
+    total = 0.0
+    for aggregate in _selected(aggregates, scope, types):
+        for bucket, seconds in aggregate.duration_buckets.items():
+            if int(bucket) >= first_bucket:
+                total += seconds
+    return total
@@ -0,0 +1,320 @@
+"""
+Moderation rule engine.
+
+Each chat's moderation_rules are compiled once into evaluator closures, with
+their parameters (thresholds, language sets, restriction types) precomputed, and
+cached per chat until its settings_version changes. Conditions are ordered so
+that the ones answered from the message alone run before the ones that need the
+user document, AND/OR short-circuit, and the user is loaded at most once per
+message through RuleContext.
+
+Rules made of message_rate and history conditions only don't need language
+detection; they are evaluated at ingestion (STAGE_INGESTION) for every message,
+the others once the message has been analyzed (STAGE_ANALYSIS).
+
+A rule with message_rate conditions fires at most once per user and chat within
+its longest message_rate window: the messages of one burst stay in the window
+after it fires and would otherwise trigger it again, once per message.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+from .models import Chat, ChatSettings, ConditionRelationType, ModerationRule, RuleCondition, RuleConditionType
+from .restriction_aggregates import ALL_CHATS, count_restrictions, restriction_seconds_since
+from .language_windows import ewma, rolling_share
+from .flood_tracker import flood_tracker
+from middlewares.monitoring.metrics import registry
+from settings import get_settings
+
+from bot_telegram.utils.logging_config import logger
+logger = logger.getChild("rule_engine")
+
+settings = get_settings()
+
+cache_lookups_counter = registry.counter("cache_lookups_total", "Cache lookups by cache and result (hit/miss)", ["cache", "result"])
+
+_UNSET = object()
+
+class RuleContext:
+    """Everything the conditions of one message may need, loaded lazily and at most once"""
+    def __init__(self, db, user_id: int, chat_id: str, text: str, analysis_result: List[Dict[str, Any]], user: Any = _UNSET):
+        self.db = db
+        self.user_id = int(user_id)
+        self.chat_id = str(chat_id)
+        self.text = text
+        self.analysis_result = analysis_result or []
+        self._user = user
+        self._restriction_aggregates = None
+        # Highest probability reported for each language
+        self.language_probs: Dict[str, float] = {}
+        for lang_result in self.analysis_result:
+            lang = lang_result.get("lang", "")
+            prob = lang_result.get("prob", 0.0)
+            if prob > self.language_probs.get(lang, -1.0):
+                self.language_probs[lang] = prob
+
+    async def get_user(self):
+        if self._user is _UNSET:
+            self._user = await self.db.get_user(self.user_id)
+        return self._user
+
+    async def get_language_window(self) -> List[float]:
+        """Language samples of the user's last messages in this chat, oldest first"""
+        user = await self.get_user()
+        if not user:
+            return []
+        return user.language_windows.get(self.chat_id, [])
+
+    async def get_restriction_aggregates(self) -> Dict:
+        if self._restriction_aggregates is None:
+            user = await self.get_user()
+            aggregates = user.restriction_aggregates if user else {}
+            if user and ALL_CHATS not in aggregates and user.restriction_history:
+                # Restrictions recorded before aggregates existed
+                aggregates = await self.db.rebuild_restriction_aggregates(self.user_id, user)
+            self._restriction_aggregates = aggregates
+        return self._restriction_aggregates
+
+Evaluator = Callable[[RuleContext], Awaitable[bool]]
+
+# Cost classes: conditions answered from the message run before the ones that need the user document
+COST_MESSAGE = 0
+COST_USER = 1
+
+STAGE_INGESTION = "ingestion"
+STAGE_ANALYSIS = "analysis"
+
+# Conditions that read the language detection result
+ANALYSIS_CONDITION_TYPES = frozenset({
+    RuleConditionType.SINGLE_MESSAGE_LANGUAGE_CONFIDENCE.value,
+    RuleConditionType.SINGLE_MESSAGE_CONFIDENCE_NOT_IN_ALLOWED_LANGUAGES.value,
+    RuleConditionType.ROLLING_SHARE_NOT_IN_ALLOWED_LANGUAGES.value,
+    RuleConditionType.EWMA_NOT_IN_ALLOWED_LANGUAGES.value,
+})
+
+class CompiledCondition(NamedTuple):
+    type: str
+    cost: int
+    evaluate: Evaluator
+
+class CompiledRule(NamedTuple):
+    index: int
+    rule: ModerationRule
+    require_all: bool
+    conditions: Tuple[CompiledCondition, ...]
+    stage: str
+    # Seconds the rule stays quiet for a user after firing (0: no cooldown)
+    cooldown_seconds: float = 0.0
+
+    async def matches(self, context: RuleContext) -> bool:
+        if self.require_all:
+            for condition in self.conditions:
+                if not await condition.evaluate(context):
+                    return False
+            return True
+        for condition in self.conditions:
+            if await condition.evaluate(context):
+                return True
+        return False
+
+def _restriction_types(values: Dict[str, Any]) -> Optional[FrozenSet[str]]:
+    """Restriction types a history condition counts; None means any type"""
+    types = values.get("restriction_type", [])
+    if isinstance(types, str):
+        types = [types]
+    if "any" in types:
+        return None
+    return frozenset(getattr(t, "value", t) for t in types)
+
+async def _never(context: RuleContext) -> bool:
+    return False
+
+def _compile_language_confidence(condition: RuleCondition, chat_settings: ChatSettings) -> Tuple[int, Evaluator]:
+    values = condition.values or {}
+    threshold = values.get("threshold", 0.0)
+    language = values.get("language", "")
+    if not language:
+        logger.warning("Language confidence condition missing language parameter")
+        return COST_MESSAGE, _never
+
+    async def evaluate(context: RuleContext) -> bool:
+        return context.language_probs.get(language, -1.0) >= threshold
+    return COST_MESSAGE, evaluate
+
+def _compile_not_in_allowed_languages(condition: RuleCondition, chat_settings: ChatSettings) -> Tuple[int, Evaluator]:
+    threshold = (condition.values or {}).get("threshold", 0.0)
+    allowed_languages = frozenset(chat_settings.allowed_languages or [])
+
+    async def evaluate(context: RuleContext) -> bool:
+        for lang, prob in context.language_probs.items():
+            if lang not in allowed_languages and prob >= threshold:
+                return True
+        return False
+    return COST_MESSAGE, evaluate
+
+def _compile_previous_restriction_count(condition: RuleCondition, chat_settings: ChatSettings) -> Tuple[int, Evaluator]:
+    values = condition.values or {}
+    target_count = values.get("count", 0)
+    types = _restriction_types(values)
+    this_chat_only = condition.this_chat_only
+
+    async def evaluate(context: RuleContext) -> bool:
+        aggregates = await context.get_restriction_aggregates()
+        scope = context.chat_id if this_chat_only else ALL_CHATS
+        return count_restrictions(aggregates, scope, types) >= target_count
+    return COST_USER, evaluate
+
+def _compile_previous_restriction_time_length(condition: RuleCondition, chat_settings: ChatSettings) -> Tuple[int, Evaluator]:
+    values = condition.values or {}
+    target_seconds = values.get("seconds", 0)
+    window_seconds = values.get("window_hours", 24.0) * 3600
+    types = _restriction_types(values)
+    this_chat_only = condition.this_chat_only
+
+    async def evaluate(context: RuleContext) -> bool:
+        aggregates = await context.get_restriction_aggregates()
+        scope = context.chat_id if this_chat_only else ALL_CHATS
+        return restriction_seconds_since(aggregates, scope, types, time.time() - window_seconds) >= target_seconds
+    return COST_USER, evaluate
+
+def _compile_rolling_share_not_in_allowed_languages(condition: RuleCondition, chat_settings: ChatSettings) -> Tuple[int, Evaluator]:
+    values = condition.values or {}
+    messages = int(values.get("messages", 10))
+    share = values.get("share", 0.5)
+    threshold = values.get("threshold", 0.5)
+
+    async def evaluate(context: RuleContext) -> bool:
+        return rolling_share(await context.get_language_window(), messages, threshold) >= share
+    return COST_USER, evaluate
+
+def _compile_ewma_not_in_allowed_languages(condition: RuleCondition, chat_settings: ChatSettings) -> Tuple[int, Evaluator]:
+    values = condition.values or {}
+    alpha = values.get("alpha", 0.2)
+    threshold = values.get("threshold", 0.5)
+
+    async def evaluate(context: RuleContext) -> bool:
+        return ewma(await context.get_language_window(), alpha) >= threshold
+    return COST_USER, evaluate
+
+def _compile_message_rate(condition: RuleCondition, chat_settings: ChatSettings) -> Tuple[int, Evaluator]:
+    values = condition.values or {}
+    max_messages = int(values.get("messages", 10))
+    window_seconds = values.get("seconds", 60.0)
+
+    async def evaluate(context: RuleContext) -> bool:
+        return flood_tracker.count(context.chat_id, context.user_id, window_seconds) > max_messages
+    return COST_MESSAGE, evaluate
+
+CONDITION_COMPILERS: Dict[str, Callable[[RuleCondition, ChatSettings], Tuple[int, Evaluator]]] = {
+    RuleConditionType.SINGLE_MESSAGE_LANGUAGE_CONFIDENCE.value: _compile_language_confidence,
+    RuleConditionType.SINGLE_MESSAGE_CONFIDENCE_NOT_IN_ALLOWED_LANGUAGES.value: _compile_not_in_allowed_languages,
+    RuleConditionType.PREVIOUS_RESTRICTION_TYPE_COUNT.value: _compile_previous_restriction_count,
+    RuleConditionType.PREVIOUS_RESTRICTION_TYPE_TIME_LENGTH.value: _compile_previous_restriction_time_length,
+    RuleConditionType.ROLLING_SHARE_NOT_IN_ALLOWED_LANGUAGES.value: _compile_rolling_share_not_in_allowed_languages,
+    RuleConditionType.EWMA_NOT_IN_ALLOWED_LANGUAGES.value: _compile_ewma_not_in_allowed_languages,
+    RuleConditionType.MESSAGE_RATE.value: _compile_message_rate,
+}
+
+def compile_condition(condition: RuleCondition, chat_settings: ChatSettings) -> CompiledCondition:
+    condition_type = getattr(condition.type, "value", condition.type)
+    compiler = CONDITION_COMPILERS.get(condition_type)
+    if compiler is None:
+        logger.warning(f"Unknown rule condition type: {condition_type}")
+        return CompiledCondition(condition_type, COST_MESSAGE, _never)
+    cost, evaluate = compiler(condition, chat_settings)
+    return CompiledCondition(condition_type, cost, evaluate)
+
+def rule_stage(conditions: List[CompiledCondition]) -> str:
+    types = {condition.type for condition in conditions}
+    if RuleConditionType.MESSAGE_RATE.value in types and not types & ANALYSIS_CONDITION_TYPES:
+        return STAGE_INGESTION
+    return STAGE_ANALYSIS
+
+def rule_cooldown(rule: ModerationRule) -> float:
+    """The longest message_rate window of the rule, 0 without message_rate conditions"""
+    return max(
+        (
+            float((condition.values or {}).get("seconds", 60.0))
+            for condition in rule.conditions
+            if getattr(condition.type, "value", condition.type) == RuleConditionType.MESSAGE_RATE.value
+        ),
+        default=0.0
+    )
+
+def compile_rules(chat_settings: ChatSettings) -> List[CompiledRule]:
+    compiled = []
+    for index, rule in enumerate(chat_settings.moderation_rules or []):
+        conditions = [compile_condition(condition, chat_settings) for condition in rule.conditions]
+        # Stable sort: conditions of the same cost keep the order the admin gave them
+        conditions.sort(key=lambda condition: condition.cost)
+        compiled.append(CompiledRule(
+            index, rule, rule.condition_relation == ConditionRelationType.AND, tuple(conditions),
+            rule_stage(conditions), rule_cooldown(rule)
+        ))
+    return compiled
+
+class RuleEngine:
+    def __init__(self, max_chats: int, max_cooldowns: int = 100_000):
+        self.max_chats = max_chats
+        self.max_cooldowns = max_cooldowns
+        self._compiled: "OrderedDict[int, Tuple[int, List[CompiledRule]]]" = OrderedDict()
+        # (chat_id, user_id, rule index) -> monotonic time until which the rule stays quiet
+        self._cooldowns: "OrderedDict[Tuple[int, int, int], float]" = OrderedDict()
+
+    def get_compiled_rules(self, chat: Chat) -> List[CompiledRule]:
+        """Compiled rules of a chat, recompiled when its settings_version changes"""
+        cached = self._compiled.get(chat.chat_id)
+        if cached is not None and cached[0] == chat.settings_version:
+            self._compiled.move_to_end(chat.chat_id)
+            cache_lookups_counter.inc(cache="moderation_rules", result="hit")
+            return cached[1]
+
+        cache_lookups_counter.inc(cache="moderation_rules", result="miss")
+        compiled = compile_rules(chat.chat_settings)
+        self._compiled[chat.chat_id] = (chat.settings_version, compiled)
+        self._compiled.move_to_end(chat.chat_id)
+        while len(self._compiled) > self.max_chats:
+            self._compiled.popitem(last=False)
+        return compiled
+
+    def invalidate(self, chat_id: int):
+        self._compiled.pop(int(chat_id), None)
+
+    def has_rules(self, chat: Chat, stage: str) -> bool:
+        if not chat or not chat.chat_settings or not chat.chat_settings.moderation_rules:
+            return False
+        return any(compiled_rule.stage == stage for compiled_rule in self.get_compiled_rules(chat))
+
+    async def triggered_rules(
+        self, chat: Chat, context: RuleContext, first_only: bool = False, stage: str = STAGE_ANALYSIS
+    ) -> List[Tuple[int, ModerationRule]]:
+        """(rule index, rule) of every rule of the stage the message triggers, in rule order"""
+        triggered = []
+        if not chat or not chat.chat_settings:
+            return triggered
+        now = time.monotonic()
+        for compiled_rule in self.get_compiled_rules(chat):
+            if compiled_rule.stage != stage:
+                continue
+            cooldown_key = (chat.chat_id, context.user_id, compiled_rule.index)
+            if compiled_rule.cooldown_seconds and self._cooldowns.get(cooldown_key, 0.0) > now:
+                continue
+            if await compiled_rule.matches(context):
+                triggered.append((compiled_rule.index, compiled_rule.rule))
+                if compiled_rule.cooldown_seconds:
+                    self._start_cooldown(cooldown_key, now + compiled_rule.cooldown_seconds, now)
+                if first_only:
+                    break
+        return triggered
+
+    def _start_cooldown(self, key: Tuple[int, int, int], until: float, now: float):
+        self._cooldowns[key] = until
+        self._cooldowns.move_to_end(key)
+        # Oldest first: drop expired cooldowns from the front, then any beyond the cap
+        while self._cooldowns:
+            oldest_until = next(iter(self._cooldowns.values()))
+            if oldest_until > now and len(self._cooldowns) <= self.max_cooldowns:
+                break
+            self._cooldowns.popitem(last=False)
+
+rule_engine = RuleEngine(settings.RULE_ENGINE_CACHE_SIZE, settings.FLOOD_TRACKER_MAX_USERS)
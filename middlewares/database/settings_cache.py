@@ -0,0 +1,63 @@
+"""
+Effective settings of chats that follow another chat's settings.
+
+A chat with ChatSettings.sync_settings_with set is a follower: it runs under
+its leader's settings, except for the fields in LOCAL_FIELDS, which stay its
+own. Followers store no copy of the leader's settings. When the leader's
+settings change, one update_many bumps the settings_version of all its
+followers (see DatabaseMiddleware.update_chat). The cache below keys each
+follower's merged settings on that version, so a message reads the leader's
+chat once per settings change instead of on every message. Only one level is
+followed: a leader's own sync_settings_with is ignored.
+"""
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+from .models import Chat, ChatSettings
+from .rule_engine import cache_lookups_counter
+from settings import get_settings
+
+settings = get_settings()
+
+# Settings a follower keeps its own values for
+LOCAL_FIELDS = ("sync_blocklist_with", "sync_settings_with", "chat_for_logs")
+
+def merge_settings(leader_settings: ChatSettings, own_settings: ChatSettings) -> ChatSettings:
+    """The leader's settings with the follower's LOCAL_FIELDS"""
+    return leader_settings.model_copy(update={field: getattr(own_settings, field) for field in LOCAL_FIELDS})
+
+class SettingsCache:
+    def __init__(self, max_chats: int):
+        self.max_chats = max_chats
+        # follower chat_id -> (follower settings_version, effective settings)
+        self._settings: "OrderedDict[int, Tuple[int, ChatSettings]]" = OrderedDict()
+
+    async def resolve(self, chat: Optional[Chat], load_chat: Callable[[int], Awaitable[Optional[Chat]]]) -> Optional[Chat]:
+        """The chat with its effective settings; followers get a copy, never to be saved"""
+        if chat is None or not chat.chat_settings:
+            return chat
+        leader_id = chat.chat_settings.sync_settings_with
+        if not leader_id or int(leader_id) == chat.chat_id:
+            return chat
+
+        cached = self._settings.get(chat.chat_id)
+        if cached is not None and cached[0] == chat.settings_version:
+            self._settings.move_to_end(chat.chat_id)
+            cache_lookups_counter.inc(cache="synced_settings", result="hit")
+            effective = cached[1]
+        else:
+            cache_lookups_counter.inc(cache="synced_settings", result="miss")
+            leader = await load_chat(int(leader_id))
+            if leader is None or not leader.chat_settings:
+                # Leader gone: the follower runs under its own settings
+                return chat
+            effective = merge_settings(leader.chat_settings, chat.chat_settings)
+            self._settings[chat.chat_id] = (chat.settings_version, effective)
+            self._settings.move_to_end(chat.chat_id)
+            while len(self._settings) > self.max_chats:
+                self._settings.popitem(last=False)
+        return chat.model_copy(update={"chat_settings": effective})
+
+    def invalidate(self, chat_id: int):
+        self._settings.pop(int(chat_id), None)
+
+settings_cache = SettingsCache(settings.SETTINGS_CACHE_SIZE)
@@ -0,0 +1,99 @@
+"""
+Event loop health monitor for the async apps.
+
+Measures how late the loop wakes a sleeping probe (loop lag), and times every
+callback the loop runs, flagging the ones that hold the loop longer than a
+threshold together with the coroutine or function they belong to. Callback
+timing hooks asyncio's Handle, so it covers the standard event loop; under uvloop
+only the lag probe runs.
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+from settings import get_settings
+from middlewares.monitoring.metrics import registry
+
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+loop_lag_histogram = registry.histogram(
+    "event_loop_lag_seconds", "Delay between a probe's scheduled and actual wake-up",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+loop_lag_gauge = registry.gauge("event_loop_lag_last_seconds", "Lag measured by the last probe")
+slow_callbacks_counter = registry.counter(
+    "event_loop_slow_callbacks_total", "Callbacks that blocked the loop over the threshold", ["callback"]
+)
+slow_callback_duration_histogram = registry.histogram(
+    "event_loop_slow_callback_duration_seconds", "Duration of slow callbacks", ["callback"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+def describe_callback(handle: asyncio.Handle) -> str:
+    """Name of the code a loop handle runs: the task's coroutine, or the callback function"""
+    callback = getattr(handle, "_callback", None)
+    owner = getattr(callback, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        return getattr(coro, "__qualname__", None) or owner.get_name()
+    return getattr(callback, "__qualname__", None) or repr(callback)
+
+class LoopMonitor:
+    def __init__(self, probe_interval: float, slow_callback_threshold: float):
+        self.probe_interval = probe_interval
+        self.slow_callback_threshold = slow_callback_threshold
+        self._probe_task: Optional[asyncio.Task] = None
+        self._original_run = None
+
+    def start(self):
+        """Start the lag probe on the running loop and begin timing callbacks"""
+        self._install_callback_timer()
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.get_running_loop().create_task(self._probe())
+
+    def stop(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+        if self._original_run is not None:
+            asyncio.Handle._run = self._original_run
+            self._original_run = None
+
+    async def _probe(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self.probe_interval
+            await asyncio.sleep(self.probe_interval)
+            lag = max(0.0, loop.time() - scheduled)
+            loop_lag_histogram.observe(lag)
+            loop_lag_gauge.set(lag)
+
+    def _install_callback_timer(self):
+        if self._original_run is not None:
+            return
+        original_run = asyncio.Handle._run
+        threshold = self.slow_callback_threshold
+
+        # Same approach as the loop's debug mode (slow_callback_duration), without
+        # the rest of debug mode's overhead. TimerHandle inherits _run from Handle.
+        def timed_run(handle):
+            started = time.perf_counter()
+            try:
+                return original_run(handle)
+            finally:
+                duration = time.perf_counter() - started
+                if duration >= threshold:
+                    name = describe_callback(handle)
+                    slow_callbacks_counter.inc(callback=name)
+                    slow_callback_duration_histogram.observe(duration, callback=name)
+                    logger.warning("Event loop blocked for %.3fs by %s", duration, name)
+
+        self._original_run = original_run
+        asyncio.Handle._run = timed_run
+
+loop_monitor = LoopMonitor(
+    probe_interval=settings.LOOP_MONITOR_INTERVAL_SECONDS,
+    slow_callback_threshold=settings.LOOP_SLOW_CALLBACK_SECONDS
+)
@@ -0,0 +1,78 @@
+import functools
+import inspect
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+from pymongo import monitoring
+from middlewares.monitoring.metrics import registry
+
+# DatabaseMiddleware method on whose behalf Mongo commands are currently sent.
+# Motor runs pymongo in executor threads with a copy of the caller's context,
+# so the command listener sees the value set by the calling coroutine.
+current_db_method: ContextVar[str] = ContextVar("current_db_method", default="other")
+# Chat whose queue message is being handled, and the Mongo commands sent on behalf
+# of each chat since the last chat cost flush (see database/chat_costs.py)
+current_cost_chat: ContextVar[Optional[int]] = ContextVar("current_cost_chat", default=None)
+chat_round_trips: Counter = Counter()
+
+db_method_calls_counter = registry.counter(
+    "db_method_calls_total", "DatabaseMiddleware method calls", ["method"]
+)
+db_method_errors_counter = registry.counter(
+    "db_method_errors_total", "DatabaseMiddleware method calls that raised", ["method"]
+)
+db_method_duration_histogram = registry.histogram(
+    "db_method_duration_seconds", "DatabaseMiddleware method latency", ["method"]
+)
+mongo_round_trips_counter = registry.counter(
+    "mongo_round_trips_total", "Mongo commands sent, by calling DatabaseMiddleware method", ["method", "command"]
+)
+mongo_command_failures_counter = registry.counter(
+    "mongo_command_failures_total", "Failed Mongo commands", ["command"]
+)
+mongo_command_duration_histogram = registry.histogram(
+    "mongo_command_duration_seconds", "Mongo command round trip time", ["command"]
+)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener counting round trips and their latency"""
+    def started(self, event):
+        pass
+
+    def _record(self, event):
+        mongo_round_trips_counter.inc(method=current_db_method.get(), command=event.command_name)
+        chat_id = current_cost_chat.get()
+        if chat_id is not None:
+            chat_round_trips[chat_id] += 1
+        mongo_command_duration_histogram.observe(event.duration_micros / 1_000_000, command=event.command_name)
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+        mongo_command_failures_counter.inc(command=event.command_name)
+
+def _timed_db_method(name: str, method):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        token = current_db_method.set(name)
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except Exception:
+            db_method_errors_counter.inc(method=name)
+            raise
+        finally:
+            db_method_duration_histogram.observe(time.perf_counter() - started, method=name)
+            db_method_calls_counter.inc(method=name)
+            current_db_method.reset(token)
+    return wrapper
+
+def instrument_db_methods(cls):
+    """Class decorator timing every public coroutine method and tagging its Mongo commands"""
+    for name, attr in list(vars(cls).items()):
+        if not name.startswith("_") and inspect.iscoroutinefunction(attr):
+            setattr(cls, name, _timed_db_method(name, attr))
+    return cls
@@ -0,0 +1,95 @@
+"""
+Logging helpers shared by the backend and bot logging configs: a JSON formatter,
+lazy payload redaction and per-message-type sampling of hot-path records.
+"""
+import json
+import logging
+import random
+from typing import Any, Dict, Mapping, Optional
+from middlewares.monitoring import tracing
+
+# Payload fields holding user content or identity; logged as their length only
+REDACTED_FIELDS = frozenset({"text", "content", "message_text", "name", "username", "full_name", "stats", "top_stats", "ranking_stats", "report"})
+
+def _redact(value: Any) -> Any:
+    if isinstance(value, Mapping):
+        return {
+            key: f"<redacted {len(str(item))} chars>" if key in REDACTED_FIELDS else _redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_redact(item) for item in value]
+    return value
+
+class redacted:
+    """
+    Log argument wrapping a queue payload. Redaction and formatting only happen
+    if the record is emitted, and the SamplingFilter samples the record by the
+    payload's message_type:
+
+        logger.info("Received message: %s", redacted(message_data))
+    """
+    __slots__ = ("payload",)
+
+    def __init__(self, payload: Optional[Mapping]):
+        self.payload = payload or {}
+
+    @property
+    def message_type(self) -> Optional[str]:
+        message_type = self.payload.get("message_type")
+        return getattr(message_type, "value", message_type)
+
+    def __str__(self) -> str:
+        return json.dumps(_redact(self.payload), ensure_ascii=False, default=str)
+
+def _record_message_type(record: logging.LogRecord) -> Optional[str]:
+    message_type = getattr(record, "message_type", None)
+    if message_type is not None:
+        return getattr(message_type, "value", message_type)
+    args = record.args if isinstance(record.args, tuple) else ()
+    for arg in args:
+        if isinstance(arg, redacted):
+            return arg.message_type
+    return None
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of the INFO/DEBUG records of each message type
+    (rates: {message_type: keep probability}). Records without a message type
+    and WARNING or above always pass.
+    """
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = dict(rates)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rates.get(_record_message_type(record))
+        return rate is None or random.random() < rate
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the message type and trace id when known"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        message_type = _record_message_type(record)
+        if message_type is not None:
+            entry["message_type"] = message_type
+        trace_id = tracing.current_trace_id()
+        if trace_id is not None:
+            entry["trace_id"] = trace_id
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+def build_formatter(log_format: str) -> logging.Formatter:
+    if log_format == "json":
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT)
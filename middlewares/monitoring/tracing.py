@@ -0,0 +1,160 @@
+"""
+Lightweight per-message tracing.
+
+A trace starts in the bot when a group message is received. Its context (trace id,
+parent span id, when the trace started and when the message was last sent) travels
+under the "trace" key of queue payloads, and in the task headers of worker_queue.
+Every stage records spans, including the time the message waited in each queue,
+and writes them as JSON lines to the configured exporter.
+"""
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+from settings import get_settings
+
+settings = get_settings()
+
+TRACE_KEY = "trace"
+
+_current_trace: ContextVar[Optional[Dict[str, Any]]] = ContextVar("current_trace", default=None)
+_current_span_id: ContextVar[Optional[str]] = ContextVar("current_span_id", default=None)
+
+class SpanExporter:
+    """Writes finished spans as JSON lines to stdout or appends them to a file"""
+    def __init__(self, target: str):
+        self.target = target
+        self._file = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Dict[str, Any]):
+        line = json.dumps(span, default=str) + "\n"
+        with self._lock:
+            if self.target == "stdout":
+                sys.stdout.write(line)
+                sys.stdout.flush()
+                return
+            if self._file is None:
+                # Opened lazily, so forked worker processes get their own file handle
+                self._file = open(self.target, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+
+exporter = SpanExporter(settings.TRACING_EXPORT)
+
+class Span:
+    def __init__(self, name: str, trace: Dict[str, Any], parent_span_id: Optional[str], attributes: Dict[str, Any], start: Optional[float] = None):
+        self.name = name
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_span_id = parent_span_id
+        self.attributes = attributes
+        self.start = time.time() if start is None else start
+        self.error = None
+        self._tokens = None
+        self._ended = False
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def end(self, end: Optional[float] = None):
+        if self._ended:
+            return
+        self._ended = True
+        end = time.time() if end is None else end
+        exporter.export({
+            "trace_id": self.trace["trace_id"],
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start": self.start,
+            "end": end,
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error
+        })
+
+    def __enter__(self):
+        # Spans and injected contexts created inside this block become its children
+        self._tokens = (_current_trace.set(self.trace), _current_span_id.set(self.span_id))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.error = repr(exc)
+        _current_trace.reset(self._tokens[0])
+        _current_span_id.reset(self._tokens[1])
+        self.end()
+
+class _NoopSpan:
+    """Returned for messages that are not traced; records nothing"""
+    span_id = None
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def end(self, end: Optional[float] = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+def new_trace() -> Optional[Dict[str, Any]]:
+    """Start a trace for a new message, or return None if it is not sampled"""
+    if not settings.TRACING_ENABLED or random.random() >= settings.TRACING_SAMPLE_RATE:
+        return None
+    now = time.time()
+    return {"trace_id": uuid.uuid4().hex, "parent_span_id": None, "started_at": now, "sent_at": now}
+
+def extract(carrier: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Read the trace context from a payload or header table"""
+    trace = (carrier or {}).get(TRACE_KEY)
+    if isinstance(trace, dict) and trace.get("trace_id"):
+        return trace
+    return None
+
+def start_span(name: str, trace: Optional[Dict[str, Any]] = None, **attributes):
+    """
+    Start a span of `trace`, or of the trace of the enclosing span if None.
+    Use it as a context manager, or call end() on it.
+    """
+    if trace is None:
+        trace = _current_trace.get()
+        if trace is None:
+            return NOOP_SPAN
+        parent_span_id = _current_span_id.get()
+    else:
+        parent_span_id = trace.get("parent_span_id")
+    return Span(name, trace, parent_span_id, attributes)
+
+def record_queue_wait(queue: str, trace: Optional[Dict[str, Any]]):
+    """Record the time a message spent in `queue`, from its sent_at to now"""
+    if trace is None or not trace.get("sent_at"):
+        return
+    Span("queue_wait", trace, trace.get("parent_span_id"), {"queue": queue}, start=trace["sent_at"]).end()
+
+def current_trace_id() -> Optional[str]:
+    """Trace id of the enclosing span, if the current message is traced"""
+    trace = _current_trace.get()
+    return trace["trace_id"] if trace is not None else None
+
+def inject(carrier: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the current trace context to an outgoing payload, if the message is traced"""
+    trace = _current_trace.get()
+    if trace is not None:
+        carrier[TRACE_KEY] = {
+            "trace_id": trace["trace_id"],
+            "parent_span_id": _current_span_id.get() or trace.get("parent_span_id"),
+            "started_at": trace.get("started_at"),
+            "sent_at": time.time()
+        }
+    return carrier
@@ -0,0 +1,113 @@
+"""
+Wire codecs for queue messages.
+
+Every message body is an envelope of {"job_id", "result"}. Producers encode it
+with the codec selected by RABBITMQ_MESSAGE_CODEC and record it in the AMQP
+content_type; consumers pick the decoder from the content_type of each message,
+so producers and consumers can be upgraded independently. Messages without a
+content_type are treated as JSON (what older producers send).
+
+The msgpack codec packs the envelope as a [job_id, result] array and replaces
+the "message_type" string with a short integer tag. It needs the optional
+`msgpack` package; without it producers fall back to JSON.
+"""
+import json
+import logging
+from typing import Any, Dict, Optional
+from middlewares.rabbitmq.mq_enums import GeneralBackendQueueMessageType, TelegramQueueMessageType, WorkerResQueueMessageType
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the deployment
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/x-msgpack"
+
+CODEC_CONTENT_TYPES = {
+    "json": JSON_CONTENT_TYPE,
+    "msgpack": MSGPACK_CONTENT_TYPE,
+}
+
+# Tag = position in this list. Only ever append, and list new message types
+# explicitly: the tags are part of the wire format.
+_TAGGED_MESSAGE_TYPES = [message_type.value for message_type in (
+    GeneralBackendQueueMessageType.TEXT_TO_ANALYZE,
+    GeneralBackendQueueMessageType.MY_CHAT_STATS_COMMAND_TG,
+    GeneralBackendQueueMessageType.MY_GLOBAL_STATS_COMMAND_TG,
+    GeneralBackendQueueMessageType.CHAT_TOP_COMMAND_TG,
+    GeneralBackendQueueMessageType.GLOBAL_TOP_COMMAND_TG,
+    GeneralBackendQueueMessageType.MY_CHAT_RANKING_COMMAND_TG,
+    GeneralBackendQueueMessageType.MY_GLOBAL_RANKING_COMMAND_TG,
+    GeneralBackendQueueMessageType.CHAT_STATS_COMMAND_TG,
+    GeneralBackendQueueMessageType.GLOBAL_STATS_COMMAND_TG,
+    GeneralBackendQueueMessageType.CHAT_GLOBAL_TOP_COMMAND_TG,
+    GeneralBackendQueueMessageType.GLOBAL_CHAT_RANKING_COMMAND_TG,
+    TelegramQueueMessageType.MY_CHAT_STATS_COMMAND_ANSWER,
+    TelegramQueueMessageType.MY_GLOBAL_STATS_COMMAND_ANSWER,
+    TelegramQueueMessageType.CHAT_TOP_COMMAND_ANSWER,
+    TelegramQueueMessageType.GLOBAL_TOP_COMMAND_ANSWER,
+    TelegramQueueMessageType.MY_CHAT_RANKING_COMMAND_ANSWER,
+    TelegramQueueMessageType.MY_GLOBAL_RANKING_COMMAND_ANSWER,
+    TelegramQueueMessageType.CHAT_STATS_COMMAND_ANSWER,
+    TelegramQueueMessageType.GLOBAL_STATS_COMMAND_ANSWER,
+    TelegramQueueMessageType.CHAT_GLOBAL_TOP_COMMAND_ANSWER,
+    TelegramQueueMessageType.GLOBAL_CHAT_RANKING_COMMAND_ANSWER,
+    TelegramQueueMessageType.ADMIN_NOTIFICATION,
+    TelegramQueueMessageType.USER_NOTIFICATION,
+    TelegramQueueMessageType.MODERATION_ACTION,
+    WorkerResQueueMessageType.TEXT_ANALYSIS_COMPLETED,
+    GeneralBackendQueueMessageType.BACKTEST_RULES_COMMAND_TG,
+    TelegramQueueMessageType.BACKTEST_RULES_COMMAND_ANSWER,
+    TelegramQueueMessageType.LIFT_RESTRICTION,
+)]
+# Some enums share values, the first tag wins
+MESSAGE_TYPE_TAGS: Dict[str, int] = {}
+for _tag, _value in enumerate(_TAGGED_MESSAGE_TYPES):
+    MESSAGE_TYPE_TAGS.setdefault(_value, _tag)
+
+def _tag_message_type(result: Dict[str, Any]) -> Dict[str, Any]:
+    message_type = result.get("message_type")
+    if message_type is None:
+        return result
+    tag = MESSAGE_TYPE_TAGS.get(getattr(message_type, "value", message_type))
+    if tag is None:
+        return result
+    tagged = dict(result)
+    tagged["message_type"] = tag
+    return tagged
+
+def _untag_message_type(result: Dict[str, Any]) -> Dict[str, Any]:
+    message_type = result.get("message_type")
+    if isinstance(message_type, int) and 0 <= message_type < len(_TAGGED_MESSAGE_TYPES):
+        result["message_type"] = _TAGGED_MESSAGE_TYPES[message_type]
+    return result
+
+def resolve_content_type(codec: str) -> str:
+    """Content type to produce for a configured codec name, falling back to JSON"""
+    content_type = CODEC_CONTENT_TYPES.get(codec)
+    if content_type is None:
+        logger.warning(f"Unknown message codec {codec!r}, using json")
+        return JSON_CONTENT_TYPE
+    if content_type == MSGPACK_CONTENT_TYPE and msgpack is None:
+        logger.warning("msgpack is not installed, using json for queue messages")
+        return JSON_CONTENT_TYPE
+    return content_type
+
+def encode_message(job_id: str, result: Dict[str, Any], content_type: str = JSON_CONTENT_TYPE) -> bytes:
+    if content_type == MSGPACK_CONTENT_TYPE:
+        return msgpack.packb([job_id, _tag_message_type(result)], use_bin_type=True)
+    return json.dumps({"job_id": job_id, "result": result}).encode()
+
+def decode_message(body: bytes, content_type: Optional[str] = None) -> Dict[str, Any]:
+    """Decode a message body into the {"job_id", "result"} envelope"""
+    if content_type == MSGPACK_CONTENT_TYPE:
+        if msgpack is None:
+            raise ValueError("Received a msgpack message but msgpack is not installed")
+        job_id, result = msgpack.unpackb(body, raw=False, strict_map_key=False)
+        return {"job_id": job_id, "result": _untag_message_type(result)}
+    if content_type in (None, "", JSON_CONTENT_TYPE):
+        return json.loads(body)
+    raise ValueError(f"Unsupported message content type: {content_type}")
@@ -0,0 +1,74 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+from middlewares.monitoring.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+messages_counter = registry.counter(
+    "queue_messages_total", "Queue messages handled, by dispatcher and message type", ["dispatcher", "message_type"]
+)
+errors_counter = registry.counter(
+    "queue_message_errors_total", "Queue messages whose handler raised", ["dispatcher", "message_type"]
+)
+unhandled_counter = registry.counter(
+    "queue_messages_unhandled_total", "Queue messages without a registered handler", ["dispatcher"]
+)
+duration_histogram = registry.histogram(
+    "queue_message_duration_seconds", "Handler latency per message type", ["dispatcher", "message_type"]
+)
+in_flight_gauge = registry.gauge(
+    "queue_messages_in_flight", "Messages currently being handled", ["dispatcher", "message_type"]
+)
+
+Handler = Callable[..., Awaitable[Any]]
+
+class MessageDispatcher:
+    """
+    Routes queue messages to handlers registered by message type and records
+    per-type count, latency, errors and in-flight messages.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._handlers: Dict[str, Handler] = {}
+
+    @staticmethod
+    def _type_key(message_type) -> str:
+        return getattr(message_type, "value", message_type)
+
+    def register(self, message_type):
+        """Decorator registering the handler of a message type"""
+        def decorator(handler: Handler) -> Handler:
+            self.add_handler(message_type, handler)
+            return handler
+        return decorator
+
+    def add_handler(self, message_type, handler: Handler):
+        key = self._type_key(message_type)
+        if key in self._handlers:
+            raise ValueError(f"{self.name}: a handler for {key} is already registered")
+        self._handlers[key] = handler
+
+    def get_handler(self, message_type) -> Optional[Handler]:
+        return self._handlers.get(self._type_key(message_type))
+
+    async def dispatch(self, message_type, *args, **kwargs) -> Any:
+        key = self._type_key(message_type)
+        handler = self._handlers.get(key)
+        if handler is None:
+            unhandled_counter.inc(dispatcher=self.name)
+            logger.warning(f"{self.name}: unhandled message type: {message_type}")
+            return None
+
+        labels = {"dispatcher": self.name, "message_type": key}
+        in_flight_gauge.inc(**labels)
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            errors_counter.inc(**labels)
+            raise
+        finally:
+            duration_histogram.observe(time.perf_counter() - started, **labels)
+            messages_counter.inc(**labels)
+            in_flight_gauge.dec(**labels)
@@ -1,5 +1,10 @@
 from enum import Enum
 
+class BackendWorkload(str, Enum):
+    INGESTION = "ingestion"
+    COMMANDS = "commands"
+    REPORTS = "reports"
+
 class GeneralBackendQueueMessageType(str, Enum):
     TEXT_TO_ANALYZE = "text_to_analyze"
     MY_CHAT_STATS_COMMAND_TG = "my_chat_stats_command_tg"
@@ -12,6 +17,7 @@ class GeneralBackendQueueMessageType(str, Enum):
     GLOBAL_STATS_COMMAND_TG = "global_stats_command_tg"
     CHAT_GLOBAL_TOP_COMMAND_TG = "chat_global_top_command_tg"
     GLOBAL_CHAT_RANKING_COMMAND_TG = "global_chat_ranking_command_tg"
+    BACKTEST_RULES_COMMAND_TG = "backtest_rules_command_tg"
 
 class TelegramQueueMessageType(str, Enum):
     MY_CHAT_STATS_COMMAND_ANSWER = "my_chat_stats_command_tg"
@@ -27,6 +33,8 @@ class TelegramQueueMessageType(str, Enum):
     ADMIN_NOTIFICATION = "admin_notification"
     USER_NOTIFICATION = "user_notification"
     MODERATION_ACTION = "moderation_action"
+    BACKTEST_RULES_COMMAND_ANSWER = "backtest_rules_command_answer"
+    LIFT_RESTRICTION = "lift_restriction"
 
 class WorkerResQueueMessageType(str, Enum):
     TEXT_ANALYSIS_COMPLETED = "text_analysis_completed"
\ No newline at end of file
@@ -1,78 +1,326 @@
 import aio_pika
-import json
 import logging
 import asyncio
+import time
+import uuid
 from enum import Enum
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from aio_pika import IncomingMessage
 from settings import get_settings
+from middlewares.rabbitmq.codec import encode_message, decode_message, resolve_content_type
+from middlewares.rabbitmq.routing import get_backend_queue
+from middlewares.monitoring.metrics import registry
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+consumed_counter = registry.counter("queue_messages_consumed_total", "Messages received by consumers", ["queue"])
+lag_histogram = registry.histogram(
+    "queue_message_lag_seconds", "Time between publishing a message and a consumer receiving it", ["queue"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0)
+)
+queue_depth_gauge = registry.gauge("rabbitmq_queue_depth", "Messages ready in the queue", ["queue"])
+queue_consumers_gauge = registry.gauge("rabbitmq_queue_consumers", "Consumers attached to the queue", ["queue"])
+
+class PublishOutcome(NamedTuple):
+    """Result of one message of a publish_many batch"""
+    queue: str
+    job_id: str
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+# Put in the idle queue when a slot is freed, see ChannelPool
+_FREED_SLOT = object()
+
+class ChannelPool:
+    """
+    Fixed-size pool of publishing channels on one connection.
+    Channels are opened lazily and replaced when they are found closed at checkout.
+    A closed channel checked in frees its slot and wakes one waiting checkout with
+    _FREED_SLOT, so the waiter opens the replacement instead of waiting forever.
+    """
+    def __init__(self, connection, max_size: int):
+        self.connection = connection
+        self.max_size = max_size
+        self._idle = asyncio.Queue()
+        self._opened = 0
+
+    async def _checkout(self):
+        while True:
+            if self._idle.empty() and self._opened < self.max_size:
+                self._opened += 1
+                try:
+                    return await self.connection.channel()
+                except Exception:
+                    self._opened -= 1
+                    raise
+
+            channel = await self._idle.get()
+            if channel is _FREED_SLOT:
+                continue
+            if not channel.is_closed:
+                return channel
+            # Drop dead channels; a replacement is opened on the next loop iteration
+            self._opened -= 1
+
+    def _checkin(self, channel):
+        if channel.is_closed:
+            self._opened -= 1
+            self._idle.put_nowait(_FREED_SLOT)
+        else:
+            self._idle.put_nowait(channel)
+
+    def acquire(self):
+        return _PooledChannel(self)
+
+class _PooledChannel:
+    def __init__(self, pool: ChannelPool):
+        self.pool = pool
+        self.channel = None
+
+    async def __aenter__(self):
+        self.channel = await self.pool._checkout()
+        return self.channel
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.pool._checkin(self.channel)
+
 class RabbitMQMiddleware:
     def __init__(self):
         self.connection = None
         self.channel = None
         self.telegram_queue = None
+        self.channel_pool = None
+        self._loop = None
+        self._connect_lock = None
+        self._sync_loop = None
+        # Request/reply state: an exclusive reply queue and futures keyed by correlation_id
+        self._reply_queue = None
+        self._reply_lock = None
+        self._pending_replies: Dict[str, asyncio.Future] = {}
+        self.content_type = resolve_content_type(settings.RABBITMQ_MESSAGE_CODEC)
+
+    def _bind_to_running_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Connections, channels and locks are tied to the loop they were created on
+            self._close_stale_connection()
+            self._loop = loop
+            self.connection = None
+            self.channel = None
+            self.channel_pool = None
+            self._connect_lock = asyncio.Lock()
+            self._reply_queue = None
+            self._reply_lock = asyncio.Lock()
+            self._pending_replies = {}
+
+    def _close_stale_connection(self):
+        """Close the connection of the previous loop on that loop, when it next runs"""
+        if self.connection is None or self._loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.connection.close(), self._loop)
+        except RuntimeError:
+            # The loop is closed, and its sockets with it
+            logger.debug("Dropped the RabbitMQ connection of a closed event loop")
 
     async def connect(self):
-        if self.connection is None or self.connection.is_closed:
-            self.connection = await aio_pika.connect_robust(settings.RABBITMQ_URL)
-        if self.channel is None or self.channel.is_closed:
-            self.channel = await self.connection.channel()
-            await self.channel.set_qos(prefetch_count=1)
-            await self.declare_queues()
+        self._bind_to_running_loop()
+        async with self._connect_lock:
+            if self.connection is None or self.connection.is_closed:
+                self.connection = await aio_pika.connect_robust(settings.RABBITMQ_URL)
+                self.channel_pool = ChannelPool(self.connection, settings.RABBITMQ_PUBLISH_CHANNEL_POOL_SIZE)
+                self._reply_queue = None
+            if self.channel is None or self.channel.is_closed:
+                self.channel = await self.connection.channel()
+                await self.channel.set_qos(prefetch_count=1)
+                await self.declare_queues()
 
     async def declare_queues(self):
         self.backend_general_queue = await self.channel.declare_queue(settings.RABBITMQ_GENERAL_QUEUE, durable=True)
-        await self.channel.declare_queue(settings.RABBITMQ_WORKER_QUEUE, durable=True)
+        await self.channel.declare_queue(settings.RABBITMQ_COMMANDS_QUEUE, durable=True)
+        await self.channel.declare_queue(settings.RABBITMQ_REPORTS_QUEUE, durable=True)
+        await self.channel.declare_queue(
+            settings.RABBITMQ_WORKER_QUEUE,
+            durable=True,
+            arguments={"x-max-priority": settings.RABBITMQ_WORKER_QUEUE_MAX_PRIORITY}
+        )
         self.telegram_queue = await self.channel.declare_queue(settings.RABBITMQ_TELEGRAM_QUEUE, durable=True)
         self.worker_results_queue = await self.channel.declare_queue(settings.RABBITMQ_RESULT_QUEUE, durable=True)
 
-    async def store_result(self, queue: str, job_id: str, result: dict):
-        logger.info(f"Storing result for job_id {job_id} in queue {queue} (sync)")
-        connection = await aio_pika.connect_robust(settings.RABBITMQ_URL)
-        channel = await connection.channel()
-        await channel.default_exchange.publish(
-            aio_pika.Message(
-                body=json.dumps({"job_id": job_id, "result": result}).encode(),
-                delivery_mode=aio_pika.DeliveryMode.PERSISTENT
-            ),
-            routing_key=queue
+    async def _ensure_connected(self):
+        if (
+            self._loop is not asyncio.get_running_loop()
+            or self.connection is None
+            or self.connection.is_closed
+        ):
+            await self.connect()
+
+    def _build_message(self, job_id: str, result: dict) -> aio_pika.Message:
+        return aio_pika.Message(
+            body=encode_message(job_id, result, self.content_type),
+            content_type=self.content_type,
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            # The AMQP timestamp property has whole-second resolution, too coarse for lag
+            headers={"published_at": time.time()}
         )
-        await connection.close()
+
+    async def store_result(self, queue: str, job_id: str, result: dict):
+        logger.debug("Storing result for job_id %s in queue %s", job_id, queue)
+        await self._ensure_connected()
+        # Publish over a pooled channel of the long-lived connection instead of
+        # opening a connection per message
+        async with self.channel_pool.acquire() as channel:
+            await channel.default_exchange.publish(self._build_message(job_id, result), routing_key=queue)
+
+    async def publish_to_backend(self, job_id: str, message_data: dict):
+        """Send a message to the backend queue of its workload (see routing.MESSAGE_TYPE_WORKLOADS)"""
+        await self.store_result(get_backend_queue(message_data.get("message_type")), job_id, message_data)
+
+    async def consume(self, queue_name: str, callback, prefetch_count: int = 1):
+        """Consume a durable queue on a dedicated channel with its own prefetch limit"""
+        await self._ensure_connected()
+        channel = await self.connection.channel()
+        await channel.set_qos(prefetch_count=prefetch_count)
+        queue = await channel.declare_queue(queue_name, durable=True)
+        await queue.consume(callback)
+        return queue
+
+    async def publish_many(self, messages: List[Tuple[str, str, dict]]) -> List[PublishOutcome]:
+        """
+        Publish a batch of (queue, job_id, result) messages on one channel.
+
+        All messages are written back to back and their publisher confirms are
+        awaited together, so a batch costs about one broker round trip. Messages
+        keep their order within the channel. Returns one PublishOutcome per
+        message, in input order; failures are reported, not raised.
+        """
+        if not messages:
+            return []
+        logger.debug("Publishing batch of %d messages", len(messages))
+        await self._ensure_connected()
+        async with self.channel_pool.acquire() as channel:
+            exchange = channel.default_exchange
+            confirms = await asyncio.gather(
+                *(
+                    exchange.publish(self._build_message(job_id, result), routing_key=queue)
+                    for queue, job_id, result in messages
+                ),
+                return_exceptions=True
+            )
+
+        outcomes = []
+        for (queue, job_id, _), confirm in zip(messages, confirms):
+            error = confirm if isinstance(confirm, BaseException) else None
+            if error is not None:
+                logger.error(f"Failed to publish job_id {job_id} to queue {queue}: {error}")
+            outcomes.append(PublishOutcome(queue, job_id, error))
+        return outcomes
+
+    def record_consumed(self, message: IncomingMessage):
+        """Count a received message and observe its queue lag (publish timestamp to now)"""
+        queue = message.routing_key or "unknown"
+        consumed_counter.inc(queue=queue)
+        published_at = (message.headers or {}).get("published_at")
+        if isinstance(published_at, (int, float)):
+            lag_histogram.observe(max(0.0, time.time() - published_at), queue=queue)
+
+    async def sample_queue_depths(self, queue_names: Iterable[str]) -> Dict[str, int]:
+        """Read message and consumer counts of existing queues with passive declares"""
+        await self._ensure_connected()
+        depths = {}
+        for name in queue_names:
+            queue = await self.channel.declare_queue(name, passive=True)
+            depths[name] = queue.declaration_result.message_count
+            queue_depth_gauge.set(depths[name], queue=name)
+            queue_consumers_gauge.set(queue.declaration_result.consumer_count, queue=name)
+        return depths
+
+    async def monitor_queue_depths(self, queue_names: Iterable[str], interval: float):
+        """Refresh the queue depth gauges every `interval` seconds until cancelled"""
+        queue_names = list(queue_names)
+        while True:
+            try:
+                await self.sample_queue_depths(queue_names)
+            except Exception as e:
+                logger.warning(f"Failed to sample queue depths: {e}")
+            await asyncio.sleep(interval)
 
     #FIXME: This is a workaround to use async code in sync code
     def store_result_sync(self, queue_name, message_id, result_data):
         """
-        Synchronous version of store_result for use in Celery tasks
+        Synchronous version of store_result for use in Celery tasks.
+        Runs on a private event loop that is kept for the life of the process,
+        so the connection and channel pool survive between calls.
         """
-        if not self.connection or self.connection.is_closed:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                loop.run_until_complete(self.connect())
-            finally:
-                loop.close()
-        
-        # Create a new event loop for this operation
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
+        if self._sync_loop is None or self._sync_loop.is_closed():
+            self._sync_loop = asyncio.new_event_loop()
+        return self._sync_loop.run_until_complete(self.store_result(queue_name, message_id, result_data))
+    
+    async def _ensure_reply_queue(self):
+        async with self._reply_lock:
+            if self._reply_queue is None:
+                channel = await self.connection.channel()
+                # Server-named, exclusive to this connection, removed when we disconnect
+                self._reply_queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+                await self._reply_queue.consume(self._on_reply, no_ack=True)
+
+    async def _on_reply(self, message: IncomingMessage):
+        future = self._pending_replies.pop(message.correlation_id, None)
+        if future is None or future.done():
+            # The caller already timed out, or the reply is not ours
+            logger.debug("Discarding reply with unknown correlation_id %s", message.correlation_id)
+            return
         try:
-            return loop.run_until_complete(self.store_result(queue_name, message_id, result_data))
+            future.set_result(decode_message(message.body, message.content_type).get("result"))
+        except Exception as e:
+            future.set_exception(e)
+
+    async def call(self, queue: str, request: dict, timeout: Optional[float] = None) -> dict:
+        """
+        Send a request to `queue` and wait for the reply.
+
+        The request carries reply_to (this process's exclusive reply queue) and a
+        correlation_id; the reply resolves the matching pending future. Raises
+        asyncio.TimeoutError if no reply arrives within `timeout` seconds.
+        """
+        timeout = settings.RABBITMQ_RPC_TIMEOUT_SECONDS if timeout is None else timeout
+        await self._ensure_connected()
+        await self._ensure_reply_queue()
+
+        correlation_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending_replies[correlation_id] = future
+        try:
+            message = aio_pika.Message(
+                body=encode_message(correlation_id, request, self.content_type),
+                content_type=self.content_type,
+                correlation_id=correlation_id,
+                reply_to=self._reply_queue.name,
+                # Nobody waits for the answer after the timeout, don't process the request either
+                expiration=timeout
+            )
+            async with self.channel_pool.acquire() as channel:
+                await channel.default_exchange.publish(message, routing_key=queue)
+            return await asyncio.wait_for(future, timeout)
         finally:
-            loop.close()
-    
-    async def get_result(self, queue: str, job_id: str):
-        if self.channel is None or self.channel.is_closed:
-            await self.connect()
-        async with self.channel.iterator(queue) as queue_iter:
-            async for message in queue_iter:
-                async with message.process():
-                    message_data = json.loads(message.body)
-                    if message_data["job_id"] == job_id:
-                        logger.info(f"Retrieved result for job_id {job_id} from queue {queue}")
-                        return message_data["result"]
-        return None
-
-rabbitmq_manager = RabbitMQMiddleware()
\ No newline at end of file
+            self._pending_replies.pop(correlation_id, None)
+
+    async def reply(self, request: IncomingMessage, result: dict) -> bool:
+        """Answer a request sent with call(); returns False if the message expects no reply"""
+        if not request.reply_to:
+            return False
+        await self._ensure_connected()
+        message = aio_pika.Message(
+            body=encode_message(request.correlation_id, result, self.content_type),
+            content_type=self.content_type,
+            correlation_id=request.correlation_id
+        )
+        async with self.channel_pool.acquire() as channel:
+            await channel.default_exchange.publish(message, routing_key=request.reply_to)
+        return True
+
+rabbitmq_manager = RabbitMQMiddleware()
@@ -0,0 +1,45 @@
+from typing import Dict
+from settings import get_settings
+from middlewares.rabbitmq.mq_enums import BackendWorkload, GeneralBackendQueueMessageType
+
+settings = get_settings()
+
+# Which backend workload each message type belongs to. Global reports scan every
+# user or chat and can take seconds, so they must never delay ingestion or the
+# per-user/per-chat commands.
+MESSAGE_TYPE_WORKLOADS: Dict[GeneralBackendQueueMessageType, BackendWorkload] = {
+    GeneralBackendQueueMessageType.TEXT_TO_ANALYZE: BackendWorkload.INGESTION,
+    GeneralBackendQueueMessageType.MY_CHAT_STATS_COMMAND_TG: BackendWorkload.COMMANDS,
+    GeneralBackendQueueMessageType.MY_GLOBAL_STATS_COMMAND_TG: BackendWorkload.COMMANDS,
+    GeneralBackendQueueMessageType.CHAT_TOP_COMMAND_TG: BackendWorkload.COMMANDS,
+    GeneralBackendQueueMessageType.MY_CHAT_RANKING_COMMAND_TG: BackendWorkload.COMMANDS,
+    GeneralBackendQueueMessageType.CHAT_STATS_COMMAND_TG: BackendWorkload.COMMANDS,
+    GeneralBackendQueueMessageType.GLOBAL_TOP_COMMAND_TG: BackendWorkload.REPORTS,
+    GeneralBackendQueueMessageType.MY_GLOBAL_RANKING_COMMAND_TG: BackendWorkload.REPORTS,
+    GeneralBackendQueueMessageType.GLOBAL_STATS_COMMAND_TG: BackendWorkload.REPORTS,
+    GeneralBackendQueueMessageType.CHAT_GLOBAL_TOP_COMMAND_TG: BackendWorkload.REPORTS,
+    GeneralBackendQueueMessageType.GLOBAL_CHAT_RANKING_COMMAND_TG: BackendWorkload.REPORTS,
+    GeneralBackendQueueMessageType.BACKTEST_RULES_COMMAND_TG: BackendWorkload.REPORTS,
+}
+
+WORKLOAD_QUEUES: Dict[BackendWorkload, str] = {
+    BackendWorkload.INGESTION: settings.RABBITMQ_GENERAL_QUEUE,
+    BackendWorkload.COMMANDS: settings.RABBITMQ_COMMANDS_QUEUE,
+    BackendWorkload.REPORTS: settings.RABBITMQ_REPORTS_QUEUE,
+}
+
+WORKLOAD_PREFETCH: Dict[BackendWorkload, int] = {
+    BackendWorkload.INGESTION: settings.RABBITMQ_INGESTION_PREFETCH,
+    BackendWorkload.COMMANDS: settings.RABBITMQ_COMMANDS_PREFETCH,
+    BackendWorkload.REPORTS: settings.RABBITMQ_REPORTS_PREFETCH,
+}
+
+def get_backend_workload(message_type: str) -> BackendWorkload:
+    """Workload of a backend message type; unknown types go with the interactive commands"""
+    try:
+        return MESSAGE_TYPE_WORKLOADS.get(GeneralBackendQueueMessageType(message_type), BackendWorkload.COMMANDS)
+    except ValueError:
+        return BackendWorkload.COMMANDS
+
+def get_backend_queue(message_type: str) -> str:
+    return WORKLOAD_QUEUES[get_backend_workload(message_type)]
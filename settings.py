@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings
+from typing import Dict
 from functools import lru_cache
 
 class Settings(BaseSettings):
@@ -25,15 +26,97 @@ class Settings(BaseSettings):
     RABBITMQ_WORKER_QUEUE: str = "worker_queue"
     RABBITMQ_TELEGRAM_QUEUE: str = "telegram_queue"
     RABBITMQ_RESULT_QUEUE: str = "result_queue"
+    # Backend queues per workload: general_queue carries ingestion (TEXT_TO_ANALYZE),
+    # interactive commands and heavy global reports get their own queues
+    RABBITMQ_COMMANDS_QUEUE: str = "commands_queue"
+    RABBITMQ_REPORTS_QUEUE: str = "reports_queue"
+    # Prefetch per workload consumer = how many messages of that workload are handled concurrently
+    RABBITMQ_INGESTION_PREFETCH: int = 1
+    RABBITMQ_COMMANDS_PREFETCH: int = 4
+    RABBITMQ_REPORTS_PREFETCH: int = 1
+
+    # Wire format for produced queue messages: "json" or "msgpack" (consumers accept both)
+    RABBITMQ_MESSAGE_CODEC: str = "json"
+
+    # Request/reply over RabbitMQ (RabbitMQMiddleware.call)
+    RABBITMQ_RPC_TIMEOUT_SECONDS: float = 30.0
+
+    # Channels kept open for publishing on the shared connection
+    RABBITMQ_PUBLISH_CHANNEL_POOL_SIZE: int = 4
+
+    # How often the apps refresh the queue depth gauges exposed on /metrics
+    QUEUE_METRICS_INTERVAL_SECONDS: float = 15.0
+
+    # Event loop monitor in the bot and backend apps: lag probe interval and the
+    # duration above which a callback is reported as blocking the loop
+    LOOP_MONITOR_ENABLED: bool = True
+    LOOP_MONITOR_INTERVAL_SECONDS: float = 0.5
+    LOOP_SLOW_CALLBACK_SECONDS: float = 0.1
+
+    # Priority lanes for worker_queue (RabbitMQ x-max-priority, higher runs first)
+    RABBITMQ_WORKER_QUEUE_MAX_PRIORITY: int = 10
+    ANALYSIS_PRIORITY_NEW_MEMBER: int = 9
+    ANALYSIS_PRIORITY_SAMPLED: int = 1
 
     # Celery settings
     CELERY_BROKER_URL: str
     CELERY_RESULT_BACKEND: str
     CELERY_AUTOSCALE_MIN: int = 2
     CELERY_AUTOSCALE_MAX: int = 8
+    # Queue-depth autoscaler: keep the estimated worker_queue wait under the SLO
+    AUTOSCALER_LATENCY_SLO_SECONDS: float = 5.0
+    AUTOSCALER_PROBE_INTERVAL_SECONDS: float = 5.0
+    AUTOSCALER_SCALE_DOWN_RATIO: float = 0.5
+    CELERY_METRICS_PORT: int = 9101  # 0 disables the worker's metrics endpoint
     
+    # /analyze_language command (detection runs in a process pool off the bot's event loop)
+    BOT_DETECTION_POOL_SIZE: int = 2
+    BOT_DETECTION_TIMEOUT_SECONDS: float = 10.0
+    BOT_DETECTION_CACHE_SIZE: int = 1024
+    ANALYZE_LANGUAGE_RATE_LIMIT: int = 5
+    ANALYZE_LANGUAGE_RATE_WINDOW_SECONDS: float = 60.0
+
+    # Compiled moderation rules kept per chat (recompiled when the chat's settings change)
+    RULE_ENGINE_CACHE_SIZE: int = 1024
+    # Effective settings kept per chat following another chat's settings (sync_settings_with)
+    SETTINGS_CACHE_SIZE: int = 1024
+    # Analyzed messages kept per user and chat for the rolling language conditions
+    LANGUAGE_WINDOW_SIZE: int = 50
+
+    # In-memory message rate tracking for the message_rate condition (per backend process)
+    FLOOD_TRACKER_SHARDS: int = 16
+    FLOOD_TRACKER_MAX_EVENTS: int = 100
+    FLOOD_TRACKER_MAX_USERS: int = 100_000
+    FLOOD_TRACKER_IDLE_SECONDS: float = 3600.0
+
+    # Admin notifications after the first one in a chat are collected for this long and sent as one digest (0 disables)
+    ADMIN_NOTIFICATION_DIGEST_SECONDS: float = 30.0
+    ADMIN_NOTIFICATION_DIGEST_MAX_LINES: int = 20
+
+    # Removal of expired restrictions from User.restrictions
+    RESTRICTION_SWEEP_INTERVAL_SECONDS: float = 30.0
+    RESTRICTION_SWEEP_BATCH_SIZE: int = 500
+
+    # Full reload of the in-memory join screening index (change streams keep it current in between when available)
+    JOIN_SCREENING_REFRESH_SECONDS: float = 300.0
+
+    # Per-chat cost totals are written to the chat_costs collection this often
+    CHAT_COST_FLUSH_SECONDS: float = 60.0
+
+    # Processes building and evaluating rule backtests, off the backend's event loop and GIL
+    BACKTEST_POOL_SIZE: int = 1
+
     # Logging
     LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "text"  # "text" or "json" (one object per line)
+    # Fraction of INFO/DEBUG records kept per message type; unlisted types are always kept
+    LOG_SAMPLE_RATES: Dict[str, float] = {"text_to_analyze": 0.01, "text_analysis_completed": 0.01}
+
+    # Per-message tracing across the queues; a sampled message carries its trace context
+    # and every stage writes its spans as JSON lines to TRACING_EXPORT ("stdout" or a file path)
+    TRACING_ENABLED: bool = False
+    TRACING_SAMPLE_RATE: float = 0.01
+    TRACING_EXPORT: str = "stdout"
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,51 @@
+import pytest
+
+from bot_telegram.utils.language_detection import DetectionCache, SlidingWindowRateLimiter, LanguageDetector
+
+
+class TestAnalyzeLanguageCommandHelpers:
+    """Test suite for the /analyze_language rate limiter, cache and detection pool."""
+
+    def test_rate_limiter_blocks_after_limit(self):
+        """Test that a user is throttled once the window is full."""
+        limiter = SlidingWindowRateLimiter(limit=2, window_seconds=60)
+
+        assert limiter.retry_after(1, now=0) == 0
+        assert limiter.retry_after(1, now=1) == 0
+        assert limiter.retry_after(1, now=2) == pytest.approx(58)
+
+        # Other users are not affected
+        assert limiter.retry_after(2, now=2) == 0
+
+    def test_rate_limiter_window_slides(self):
+        """Test that old calls stop counting after the window passes."""
+        limiter = SlidingWindowRateLimiter(limit=1, window_seconds=10)
+
+        assert limiter.retry_after(1, now=0) == 0
+        assert limiter.retry_after(1, now=5) > 0
+        assert limiter.retry_after(1, now=10) == 0
+
+    def test_detection_cache_evicts_least_recently_used(self):
+        """Test LRU eviction of cached detection results."""
+        cache = DetectionCache(max_size=2)
+        cache.put("first", [("en", 0.9)])
+        cache.put("second", [("uk", 0.9)])
+
+        # Touch "first" so "second" becomes the oldest entry
+        assert cache.get("first") == [("en", 0.9)]
+        cache.put("third", [("de", 0.9)])
+
+        assert cache.get("second") is None
+        assert cache.get("first") is not None
+        assert cache.get("third") is not None
+
+    @pytest.mark.asyncio
+    async def test_detector_returns_cached_result_without_pool(self):
+        """Test that a cache hit never starts the process pool."""
+        detector = LanguageDetector(pool_size=1, cache_size=10, timeout=1)
+        detector.cache.put("Hello world", [("en", 0.99)])
+
+        result = await detector.detect("Hello world")
+
+        assert result == [("en", 0.99)]
+        assert detector._executor is None
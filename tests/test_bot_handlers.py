@@ -305,4 +305,79 @@ For more information, contact the bot administrator.
             if user.last_name:
                 mention += f" {user.last_name}"
         
-        assert mention == "John Doe"
\ No newline at end of file
+        assert mention == "John Doe"
+
+class TestTelegramMetricsMiddleware:
+    """Test suite for Bot API call metrics."""
+
+    @pytest.mark.asyncio
+    async def test_retry_after_is_counted(self):
+        """Test that 429 responses are counted separately from other outcomes."""
+        from aiogram.exceptions import TelegramRetryAfter
+        from aiogram.methods import SendMessage
+        from bot_telegram.utils.telegram_metrics import (
+            TelegramMetricsMiddleware, requests_counter, retry_after_counter, request_duration_histogram
+        )
+
+        middleware = TelegramMetricsMiddleware()
+        method = SendMessage(chat_id=1, text="hi")
+        ok_request = AsyncMock(return_value="response")
+        limited_request = AsyncMock(side_effect=TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=3))
+
+        before_ok = requests_counter.get(method="SendMessage", status="ok")
+        before_limited = retry_after_counter.get(method="SendMessage")
+
+        assert await middleware(ok_request, Mock(), method) == "response"
+        with pytest.raises(TelegramRetryAfter):
+            await middleware(limited_request, Mock(), method)
+
+        assert requests_counter.get(method="SendMessage", status="ok") == before_ok + 1
+        assert retry_after_counter.get(method="SendMessage") == before_limited + 1
+        assert request_duration_histogram.get_count(method="SendMessage") >= 2
+
+    @pytest.mark.asyncio
+    async def test_calls_are_counted_per_chat_for_string_chat_ids(self):
+        """Test that queue-driven calls with string chat ids count for the chat, @usernames don't."""
+        from aiogram.methods import SendMessage
+        from bot_telegram.utils.telegram_metrics import TelegramMetricsMiddleware
+        from middlewares.database.chat_costs import chat_costs
+
+        middleware = TelegramMetricsMiddleware()
+        request = AsyncMock(return_value="response")
+        chat_costs.drain()
+
+        await middleware(request, Mock(), SendMessage(chat_id="-100123", text="hi"))
+        await middleware(request, Mock(), SendMessage(chat_id=-100123, text="hi"))
+        await middleware(request, Mock(), SendMessage(chat_id="@channel", text="hi"))
+
+        pending = chat_costs.drain()
+        assert pending[-100123]["telegram_calls"] == 2
+        assert set(pending) == {-100123}
+
+
+class TestChatMemberRouting:
+    """Test suite for which chat_member handler an update reaches."""
+
+    @staticmethod
+    def _update(old_status, new_status):
+        return Mock(
+            old_chat_member=Mock(status=old_status, is_member=False),
+            new_chat_member=Mock(status=new_status, is_member=True)
+        )
+
+    @pytest.mark.asyncio
+    async def test_users_joining_as_admins_reach_the_admin_handler(self):
+        """Test that join screening only takes plain joins, leaving admin joins to on_admin_status_changed."""
+        from aiogram.enums import ChatMemberStatus
+        from bot_telegram.event_routers import chat_events
+
+        handlers = chat_events.chat_events_router.chat_member.handlers
+
+        async def first_match(update):
+            for handler in handlers:
+                if (await handler.check(update))[0]:
+                    return handler.callback
+
+        assert await first_match(self._update(ChatMemberStatus.LEFT, ChatMemberStatus.MEMBER)) is chat_events.on_user_joined
+        assert await first_match(self._update(ChatMemberStatus.LEFT, ChatMemberStatus.ADMINISTRATOR)) is chat_events.on_admin_status_changed
+        assert await first_match(self._update(ChatMemberStatus.KICKED, ChatMemberStatus.CREATOR)) is chat_events.on_admin_status_changed
@@ -318,4 +318,113 @@ class TestCeleryIntegration:
         ready = get_ready_tasks()
         assert "apply_moderation" in ready
         assert "update_stats" in ready
-        assert "send_notification" not in ready
\ No newline at end of file
+        assert "send_notification" not in ready
+
+class TestAsyncWorkerCompatibility:
+    """Test suite for the asyncio worker's compatibility with Celery task messages."""
+
+    def test_parse_protocol_2_task_message(self):
+        """Test parsing a Celery protocol 2 message (task name in headers)."""
+        from backend.worker_handlers.async_worker import parse_celery_task, ANALYZE_LANGUAGE_TASK
+
+        args = ["Hello world", "-100123", "42", 456789, "2024-01-01 00:00:00", "Test", "testuser"]
+        message = Mock()
+        message.headers = {"task": ANALYZE_LANGUAGE_TASK, "id": "task-1"}
+        message.body = json.dumps([args, {}, {"callbacks": None}]).encode()
+
+        task_name, parsed_args, parsed_kwargs = parse_celery_task(message)
+
+        assert task_name == ANALYZE_LANGUAGE_TASK
+        assert parsed_args == args
+        assert parsed_kwargs == {}
+
+    def test_parse_protocol_1_task_message(self):
+        """Test parsing a legacy Celery protocol 1 message (task name in body)."""
+        from backend.worker_handlers.async_worker import parse_celery_task
+
+        message = Mock()
+        message.headers = {}
+        message.body = json.dumps({"task": "some.task", "args": [1], "kwargs": {"a": 2}}).encode()
+
+        assert parse_celery_task(message) == ("some.task", [1], {"a": 2})
+
+    def test_result_message_matches_celery_task_format(self):
+        """Test that both runtimes build identical result payloads."""
+        from backend.worker_handlers.detection import build_analysis_result, get_analysis_job_id
+
+        result = build_analysis_result(
+            "Hello world", "-100123", "42", 456789, "2024-01-01", "Test", "testuser", [{"lang": "en", "prob": 0.99}]
+        )
+
+        assert result["message_type"] == "text_analysis_completed"
+        assert result["analysis_result"] == [{"lang": "en", "prob": 0.99}]
+        assert get_analysis_job_id("-100123", "42") == "-10012342"
+
+
+class TestAnalysisPriorityRouting:
+    """Test suite for the priority lanes of worker_queue."""
+
+    @pytest.mark.asyncio
+    async def test_worker_queue_declares_max_priority(self):
+        """Test that both the Celery queue and the aio_pika declaration carry x-max-priority."""
+        from backend.worker_handlers.celery_config import worker_queue
+        from middlewares.rabbitmq.queue_manager import RabbitMQMiddleware
+        from settings import get_settings
+
+        settings = get_settings()
+        arguments = {"x-max-priority": settings.RABBITMQ_WORKER_QUEUE_MAX_PRIORITY}
+        manager = RabbitMQMiddleware()
+        manager.channel = Mock(declare_queue=AsyncMock())
+
+        await manager.declare_queues()
+
+        assert worker_queue.queue_arguments == arguments
+        manager.channel.declare_queue.assert_any_await(settings.RABBITMQ_WORKER_QUEUE, durable=True, arguments=arguments)
+
+    async def _ingest(self, analyzed_messages: int):
+        """Ingest one message from a user with that many analyzed messages; returns the apply_async kwargs"""
+        from backend.queue_handlers.general_queue import analyze_text
+        from middlewares.database.models import Chat, ChatSettings
+
+        chat = Chat.model_construct(chat_id=-100, last_known_name="test", chat_settings=ChatSettings(analysis_frequency=1), settings_version=0)
+        user = Mock(username="testuser", chat_history={"-100": [Mock()] * analyzed_messages})
+        # Mock's own "name" argument names the mock, so the attribute is set afterwards
+        user.name = "Test"
+        message_data = {
+            "user_id": 456789,
+            "name": "Test",
+            "username": "testuser",
+            "chat_message": {"chat_id": "-100", "message_id": "42", "content": "Hello world test message", "timestamp": "2024-01-01 00:00:00"},
+        }
+        with patch.object(analyze_text, "database", Mock(
+                user_exists=AsyncMock(return_value=True), get_user=AsyncMock(return_value=user),
+                chat_exists=AsyncMock(return_value=True), is_user_in_chat=AsyncMock(return_value=True),
+                get_effective_chat=AsyncMock(return_value=chat))), \
+             patch.object(analyze_text.analyze_language, "apply_async") as apply_async:
+            await analyze_text.handle_text_to_analyze(message_data)
+
+        apply_async.assert_called_once()
+        return apply_async.call_args.kwargs
+
+    @pytest.mark.asyncio
+    async def test_new_member_messages_use_the_high_priority_lane(self):
+        """Test that a new member's message is published with ANALYSIS_PRIORITY_NEW_MEMBER."""
+        from settings import get_settings
+
+        settings = get_settings()
+        kwargs = await self._ingest(analyzed_messages=0)
+
+        assert kwargs["priority"] == settings.ANALYSIS_PRIORITY_NEW_MEMBER
+        assert kwargs["queue"] == settings.RABBITMQ_WORKER_QUEUE
+        assert "enqueued_at" in kwargs["headers"]
+
+    @pytest.mark.asyncio
+    async def test_sampled_messages_use_the_low_priority_lane(self):
+        """Test that a sampled message from an established member is published with ANALYSIS_PRIORITY_SAMPLED."""
+        from settings import get_settings
+
+        settings = get_settings()
+        kwargs = await self._ingest(analyzed_messages=50)
+
+        assert kwargs["priority"] == settings.ANALYSIS_PRIORITY_SAMPLED
+        assert kwargs["queue"] == settings.RABBITMQ_WORKER_QUEUE
@@ -301,4 +301,325 @@ class TestDatabaseFunctions:
         success = await mock_database.execute_transaction(operations)
         
         assert success is True
-        mock_database.execute_transaction.assert_called_once_with(operations)
\ No newline at end of file
+        mock_database.execute_transaction.assert_called_once_with(operations)
+
+class TestDatabaseInstrumentation:
+    """Test suite for DatabaseMiddleware method and Mongo command metrics."""
+
+    @pytest.mark.asyncio
+    async def test_instrumented_methods_are_timed(self):
+        """Test that public coroutine methods record calls, errors and latency."""
+        from middlewares.monitoring.mongo import (
+            instrument_db_methods, current_db_method,
+            db_method_calls_counter, db_method_errors_counter, db_method_duration_histogram
+        )
+
+        @instrument_db_methods
+        class FakeDatabase:
+            async def fake_lookup(self):
+                return current_db_method.get()
+
+            async def fake_failure(self):
+                raise RuntimeError("mongo down")
+
+            async def _private_helper(self):
+                return current_db_method.get()
+
+        db = FakeDatabase()
+
+        assert await db.fake_lookup() == "fake_lookup"
+        assert await db._private_helper() == "other"
+        with pytest.raises(RuntimeError):
+            await db.fake_failure()
+
+        assert db_method_calls_counter.get(method="fake_lookup") == 1
+        assert db_method_duration_histogram.get_count(method="fake_lookup") == 1
+        assert db_method_errors_counter.get(method="fake_failure") == 1
+        assert db_method_calls_counter.get(method="_private_helper") == 0
+
+    def test_command_listener_attributes_round_trips(self):
+        """Test that Mongo commands are counted against the calling method."""
+        from middlewares.monitoring.mongo import (
+            MongoCommandMetrics, current_db_method, mongo_round_trips_counter, mongo_command_failures_counter
+        )
+
+        listener = MongoCommandMetrics()
+        event = Mock(command_name="find", duration_micros=1500)
+
+        token = current_db_method.set("fake_get_user")
+        try:
+            listener.succeeded(event)
+            listener.failed(event)
+        finally:
+            current_db_method.reset(token)
+
+        assert mongo_round_trips_counter.get(method="fake_get_user", command="find") == 2
+        assert mongo_command_failures_counter.get(command="find") >= 1
+
+
+class TestRestrictionExpirySweeper:
+    """Test suite for the background removal of expired restrictions."""
+
+    def _doc(self, now):
+        return {
+            "user_id": 7,
+            "next_restriction_expiry": now - timedelta(minutes=5),
+            "restrictions": {
+                "-100": [
+                    {"restriction_type": "timeout", "duration_seconds": 600, "expires_at": now - timedelta(minutes=5)},
+                    {"restriction_type": "temporary_ban", "duration_seconds": 10, "expires_at": now - timedelta(seconds=1)},
+                ],
+                "-200": [
+                    {"restriction_type": "timeout", "duration_seconds": 3600, "expires_at": now + timedelta(hours=1)},
+                    {"restriction_type": "permanent_ban", "duration_seconds": None},
+                ],
+            },
+        }
+
+    def test_plan_removal(self):
+        """Test which chats are pulled and the next expiry that is kept."""
+        from backend.functions.restrictions.expiry_sweeper import plan_removal
+
+        now = datetime.now()
+        removal, expired = plan_removal(self._doc(now), now)
+
+        assert removal["chat_ids"] == ["-100"]
+        assert removal["next_expiry"] == now + timedelta(hours=1)
+        assert removal["previous_expiry"] == now - timedelta(minutes=5)
+        assert [restriction["restriction_type"] for _, restriction in expired] == ["timeout", "temporary_ban"]
+
+    def test_lift_only_what_telegram_keeps_forever(self):
+        """Test that only out-of-range durations need an explicit lift."""
+        from backend.functions.restrictions.expiry_sweeper import needs_lift_action
+
+        assert not needs_lift_action({"restriction_type": "timeout", "duration_seconds": 600})
+        assert needs_lift_action({"restriction_type": "temporary_ban", "duration_seconds": 10})
+        assert needs_lift_action({"restriction_type": "timeout", "duration_seconds": 400 * 24 * 3600})
+        assert not needs_lift_action({"restriction_type": "warning", "duration_seconds": 10})
+
+    @pytest.mark.asyncio
+    async def test_sweep_removes_in_bulk_and_sends_lift_actions(self):
+        """Test one sweep: a bulk removal per batch and lift messages for the bot."""
+        from backend.functions.restrictions.expiry_sweeper import RestrictionExpirySweeper, removed_counter
+
+        now = datetime.now()
+        before = removed_counter.get(restriction_type="temporary_ban")
+        sweeper = RestrictionExpirySweeper(interval_seconds=30, batch_size=10)
+        with patch("backend.functions.restrictions.expiry_sweeper.database") as database, \
+                patch("backend.functions.restrictions.expiry_sweeper.rabbitmq_manager") as manager:
+            database.get_users_with_expired_restrictions = AsyncMock(return_value=[self._doc(now)])
+            database.remove_expired_restrictions = AsyncMock(return_value=1)
+            manager.publish_many = AsyncMock(return_value=[Mock(ok=True)])
+
+            assert await sweeper.sweep() == 1
+
+        database.remove_expired_restrictions.assert_awaited_once()
+        lift_messages = manager.publish_many.await_args.args[0]
+        assert len(lift_messages) == 1
+        assert lift_messages[0][2]["restriction_type"] == "temporary_ban"
+        assert removed_counter.get(restriction_type="temporary_ban") == before + 1
+
+
+class TestJoinScreeningIndex:
+    """Test suite for the in-memory join screening index."""
+    def _index(self):
+        from middlewares.database.join_screening import JoinScreeningIndex
+
+        index = JoinScreeningIndex(refresh_seconds=300)
+        index.load(
+            [
+                {"chat_id": -100, "blocked_users": [1], "chat_settings": {"sync_blocklist_with": [-200]}},
+                {"chat_id": -200, "blocked_users": [2], "chat_settings": {}},
+            ],
+            [
+                {"user_id": 3, "restrictions": {"-200": [{"restriction_type": "permanent_ban"}]}},
+                {"user_id": 4, "restrictions": {"-100": [
+                    {"restriction_type": "temporary_ban", "expires_at": datetime.fromtimestamp(2000)},
+                    {"restriction_type": "timeout", "expires_at": datetime.fromtimestamp(5000)},
+                ]}},
+            ]
+        )
+        return index
+
+    def test_screens_against_synced_blocklists_and_bans(self):
+        """Test that blocklists and bans of synced chats refuse a join, not the other way round."""
+        index = self._index()
+
+        assert index.screen(-100, 1) == ("blocked", -100)
+        assert index.screen(-100, 2) == ("blocked", -200)
+        assert index.screen(-100, 3) == ("banned", -200)
+        assert index.screen(-200, 1) == ("allowed", None)
+        assert index.screen(-100, 5) == ("allowed", None)
+
+    def test_expired_bans_and_timeouts_allow_the_join(self):
+        """Test that a ban counts until it expires and a timeout never does."""
+        index = self._index()
+
+        assert index.screen(-100, 4, now=1000) == ("banned", -100)
+        assert index.screen(-100, 4, now=3000) == ("allowed", None)
+
+    def test_change_events_update_the_index(self):
+        """Test that chat and user documents from change events replace their entries."""
+        index = self._index()
+
+        index.apply_chat({"chat_id": -100, "blocked_users": [], "chat_settings": {"sync_blocklist_with": []}})
+        index.apply_user({"user_id": 3, "restrictions": {}})
+        index.note_ban(-100, 6)
+
+        assert index.screen(-100, 1) == ("allowed", None)
+        assert index.screen(-100, 2) == ("allowed", None)
+        assert index.screen(-200, 3) == ("allowed", None)
+        assert index.screen(-100, 6) == ("banned", -100)
+
+
+class TestSettingsSync:
+    """Test suite for chats following another chat's settings."""
+    def _chat(self, chat_id, version=0, **settings):
+        from middlewares.database.models import Chat, ChatSettings
+
+        return Chat.model_construct(
+            chat_id=chat_id, last_known_name=str(chat_id), chat_settings=ChatSettings(**settings), settings_version=version
+        )
+
+    @pytest.mark.asyncio
+    async def test_follower_resolves_leader_settings_once_per_version(self):
+        """Test that a follower gets the leader's settings, keeping its local fields, read once per version."""
+        from middlewares.database.settings_cache import SettingsCache
+
+        leader = self._chat(-100, allowed_languages=["de"], chat_for_logs=1)
+        follower = self._chat(-200, version=3, allowed_languages=["uk"], sync_settings_with=-100, chat_for_logs=2)
+        load_chat = AsyncMock(return_value=leader)
+        cache = SettingsCache(max_chats=10)
+
+        effective = await cache.resolve(follower, load_chat)
+        await cache.resolve(follower, load_chat)
+
+        assert effective.chat_settings.allowed_languages == ["de"]
+        assert effective.chat_settings.chat_for_logs == 2
+        assert effective.chat_settings.sync_settings_with == -100
+        assert follower.chat_settings.allowed_languages == ["uk"]
+        load_chat.assert_awaited_once_with(-100)
+
+        follower.settings_version = 4
+        await cache.resolve(follower, load_chat)
+        assert load_chat.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_non_followers_and_missing_leaders_keep_own_settings(self):
+        """Test that chats without a (reachable) leader are returned unchanged."""
+        from middlewares.database.settings_cache import SettingsCache
+
+        cache = SettingsCache(max_chats=10)
+        load_chat = AsyncMock(return_value=None)
+        own = self._chat(-100)
+        orphan = self._chat(-200, sync_settings_with=-300)
+
+        assert await cache.resolve(own, load_chat) is own
+        load_chat.assert_not_awaited()
+        assert await cache.resolve(orphan, load_chat) is orphan
+
+    @pytest.mark.asyncio
+    async def test_leader_settings_update_bumps_followers_in_one_write(self):
+        """Test that updating a chat's settings invalidates its followers with a single update_many."""
+        from middlewares.database.db import DatabaseMiddleware
+
+        query = Mock(update=AsyncMock(return_value=Mock(chat_id=-100)))
+        database = DatabaseMiddleware()
+        database.db = {"chats": Mock(update_many=AsyncMock())}
+        with patch("middlewares.database.db.Chat", Mock(find_one=Mock(return_value=query))):
+            await database.update_chat(-100, {"chat_settings": {}})
+            await database.update_chat(-100, {"last_known_name": "renamed"})
+
+        database.db["chats"].update_many.assert_awaited_once_with(
+            {"chat_settings.sync_settings_with": -100}, {"$inc": {"settings_version": 1}}
+        )
+
+    @pytest.mark.asyncio
+    async def test_chat_updates_write_only_the_changed_fields(self):
+        """Test that chat updates use targeted operators and bump settings_version with $inc, never a full save."""
+        from middlewares.database.db import DatabaseMiddleware
+
+        query = Mock(update=AsyncMock(return_value=None))
+        database = DatabaseMiddleware()
+        database.db = {"chats": Mock(update_many=AsyncMock())}
+        with patch("middlewares.database.db.Chat", Mock(find_one=Mock(return_value=query))):
+            assert await database.update_chat(-100, {"chat_settings": {"rules": []}}) is None
+            await database.update_chat(-100, {"last_known_name": "renamed"})
+            await database.add_user_to_chat(-100, 7)
+            await database.remove_user_from_chat(-100, 7)
+
+        updates = [call.args[0] for call in query.update.await_args_list]
+        assert updates == [
+            {"$set": {"chat_settings": {"rules": []}}, "$inc": {"settings_version": 1}},
+            {"$set": {"last_known_name": "renamed"}},
+            {"$addToSet": {"users": 7}},
+            {"$pull": {"users": 7}},
+        ]
+        # No chat was matched, so there are no followers to bump
+        database.db["chats"].update_many.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_full_chat_dict_does_not_set_the_incremented_version(self):
+        """Test that a whole chat dict (as on group migration) never $sets settings_version next to its $inc."""
+        from middlewares.database.db import DatabaseMiddleware
+        from middlewares.database.models import Chat, ChatSettings
+
+        old_chat = Chat.model_construct(chat_id=-100, last_known_name="old", users=[1], settings_version=4, chat_settings=ChatSettings())
+        chat_dict = old_chat.model_dump(exclude={"id"})
+        chat_dict["chat_id"] = -200
+        query = Mock(update=AsyncMock(return_value=None))
+        database = DatabaseMiddleware()
+        with patch("middlewares.database.db.Chat", Mock(find_one=Mock(return_value=query))):
+            await database.update_chat(-200, chat_dict)
+
+        update = query.update.await_args.args[0]
+        assert update["$inc"] == {"settings_version": 1}
+        assert "settings_version" not in update["$set"] and "chat_id" not in update["$set"]
+        assert update["$set"]["users"] == [1]
+
+
+class TestChatCostAccounting:
+    """Test suite for per-chat cost accounting."""
+    def test_drain_merges_recorded_costs_and_attributed_round_trips(self):
+        """Test that Mongo commands sent inside attributed_to count for that chat."""
+        from middlewares.database.chat_costs import ChatCostAccounting
+        from middlewares.monitoring.mongo import MongoCommandMetrics
+
+        accounting = ChatCostAccounting(flush_seconds=60)
+        accounting.drain()
+        accounting.record("-100", messages_seen=1)
+        accounting.record(-100, messages_analyzed=1, detection_cpu_seconds=0.25)
+        accounting.record(None, messages_seen=1)
+        accounting.record("@channel", messages_seen=1)
+        with accounting.attributed_to(-200):
+            MongoCommandMetrics().succeeded(Mock(command_name="find", duration_micros=100))
+            MongoCommandMetrics().succeeded(Mock(command_name="update", duration_micros=100))
+        MongoCommandMetrics().succeeded(Mock(command_name="find", duration_micros=100))
+
+        pending = accounting.drain()
+
+        assert pending[-100]["messages_seen"] == 1
+        assert pending[-100]["detection_cpu_seconds"] == 0.25
+        assert pending[-200]["db_operations"] == 2
+        assert set(pending) == {-100, -200}
+        assert accounting.drain() == {}
+
+    @pytest.mark.asyncio
+    async def test_flush_writes_once_and_keeps_costs_on_failure(self):
+        """Test that a flush is one bulk write and a failed one is retried with the same totals."""
+        from middlewares.database.chat_costs import ChatCostAccounting
+
+        accounting = ChatCostAccounting(flush_seconds=60)
+        accounting.drain()
+        accounting.record(-100, telegram_calls=2)
+        with patch("middlewares.database.chat_costs.database") as database:
+            database.add_chat_costs = AsyncMock(side_effect=RuntimeError("down"))
+            with pytest.raises(RuntimeError):
+                await accounting.flush()
+
+            database.add_chat_costs = AsyncMock(return_value=1)
+            assert await accounting.flush() == 1
+
+        costs, day = database.add_chat_costs.await_args.args
+        assert costs[-100]["telegram_calls"] == 2
+        assert day == datetime.now().strftime("%Y-%m-%d")
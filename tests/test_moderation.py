@@ -3,6 +3,62 @@ from unittest.mock import AsyncMock, Mock, patch
 from datetime import datetime, timedelta
 
 
+def make_chat(rules, allowed_languages=("uk", "en"), version=0, chat_id=-100):
+    from middlewares.database.models import Chat, ChatSettings
+
+    return Chat.model_construct(
+        chat_id=chat_id,
+        last_known_name="test",
+        chat_settings=ChatSettings(moderation_rules=rules, allowed_languages=list(allowed_languages)),
+        settings_version=version
+    )
+
+
+def make_rule(conditions, relation="and", name="rule"):
+    from middlewares.database.models import ModerationRule, RuleCondition
+
+    return ModerationRule(
+        conditions=[RuleCondition(**condition) for condition in conditions],
+        condition_relation=relation,
+        message=name,
+        name=name
+    )
+
+
+def make_record(restriction_type, chat_id="-100", hours_ago=0.0, duration=None):
+    from middlewares.database.models import RestrictionRecord
+
+    return RestrictionRecord(
+        user_id=1, chat_id=chat_id, message_id="1", message_text="", rule_index=0,
+        restriction_type=restriction_type, duration_seconds=duration,
+        timestamp=(datetime.now() - timedelta(hours=hours_ago)).isoformat()
+    )
+
+
+def make_user(restrictions=(), **fields):
+    """User with a restriction history of (restriction_type, duration) pairs and its aggregates"""
+    from middlewares.database.restriction_aggregates import build_restriction_aggregates
+
+    history = [make_record(restriction_type, duration=duration) for restriction_type, duration in restrictions]
+    return Mock(user_id=1, restriction_history=history, restriction_aggregates=build_restriction_aggregates(history), **fields)
+
+
+def make_context(analysis_result, user=None, user_id=1):
+    """RuleContext for a message in chat -100, and the db it loads the user from"""
+    from middlewares.database.rule_engine import RuleContext
+
+    db = Mock()
+    db.get_user = AsyncMock(return_value=user or make_user())
+    return RuleContext(db, user_id, "-100", "text", analysis_result), db
+
+
+def window_context(window):
+    """RuleContext for an allowed-language message from a user with the given language window in chat -100"""
+    context, _ = make_context([{"lang": "uk", "prob": 0.99}], make_user(language_windows={"-100": window}))
+    return context
+
+
+
 class TestModerationFunctions:
     """Test suite for moderation system functions."""
 
@@ -256,4 +312,491 @@ class TestModerationFunctions:
             if not final_result:
                 break  # Short-circuit evaluation
         
-        assert final_result is False  # Second condition fails
\ No newline at end of file
+        assert final_result is False  # Second condition fails
+
+class TestRuleEngine:
+    """Test suite for the compiled moderation rule engine."""
+
+    @pytest.mark.asyncio
+    async def test_not_allowed_language_rule(self):
+        """Test the allowed-language condition against precomputed language sets."""
+        from middlewares.database.rule_engine import RuleEngine
+
+        engine = RuleEngine(max_chats=8)
+        chat = make_chat([make_rule([{"type": "single_message_confidence_not_in_allowed_languages", "values": {"threshold": 0.8}}])])
+
+        russian, _ = make_context([{"lang": "ru", "prob": 0.95}])
+        unsure, _ = make_context([{"lang": "ru", "prob": 0.5}, {"lang": "uk", "prob": 0.5}])
+
+        assert [index for index, _ in await engine.triggered_rules(chat, russian)] == [0]
+        assert await engine.triggered_rules(chat, unsure) == []
+
+    @pytest.mark.asyncio
+    async def test_language_confidence_checks_the_configured_language(self):
+        """Test that the language confidence condition only looks at its language."""
+        from middlewares.database.rule_engine import RuleEngine
+
+        engine = RuleEngine(max_chats=8)
+        chat = make_chat([make_rule([{"type": "single_message_language_confidence", "values": {"language": "ru", "threshold": 0.7}}])])
+
+        english, _ = make_context([{"lang": "en", "prob": 0.99}])
+        russian, _ = make_context([{"lang": "ru", "prob": 0.9}])
+
+        assert await engine.triggered_rules(chat, english) == []
+        assert len(await engine.triggered_rules(chat, russian)) == 1
+
+    @pytest.mark.asyncio
+    async def test_and_short_circuits_before_loading_the_user(self):
+        """Test that a failed cheap condition skips the user-dependent one."""
+        from middlewares.database.rule_engine import RuleEngine
+
+        engine = RuleEngine(max_chats=8)
+        # The user-dependent condition is listed first; the engine runs the cheap one first anyway
+        chat = make_chat([make_rule([
+            {"type": "previous_restriction_type_count", "values": {"restriction_type": ["any"], "count": 1}},
+            {"type": "single_message_confidence_not_in_allowed_languages", "values": {"threshold": 0.8}},
+        ])])
+
+        context, db = make_context([{"lang": "uk", "prob": 0.99}])
+
+        assert await engine.triggered_rules(chat, context) == []
+        db.get_user.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_user_is_loaded_once_per_message(self):
+        """Test that several history conditions share one user load."""
+        from middlewares.database.rule_engine import RuleEngine
+
+        engine = RuleEngine(max_chats=8)
+        chat = make_chat([
+            make_rule([{"type": "previous_restriction_type_count", "values": {"restriction_type": ["warning"], "count": 2}}]),
+            make_rule([{"type": "previous_restriction_type_time_length", "values": {"restriction_type": ["timeout"], "seconds": 600, "window_hours": 1}}]),
+        ])
+        user = make_user([("warning", None), ("warning", None), ("timeout", 300), ("timeout", 300)])
+
+        context, db = make_context([{"lang": "uk", "prob": 0.99}], user)
+
+        assert [index for index, _ in await engine.triggered_rules(chat, context)] == [0, 1]
+        db.get_user.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_or_relation_and_first_only(self):
+        """Test OR rules and stopping at the first triggered rule."""
+        from middlewares.database.rule_engine import RuleEngine
+
+        engine = RuleEngine(max_chats=8)
+        or_rule = make_rule([
+            {"type": "single_message_language_confidence", "values": {"language": "de", "threshold": 0.5}},
+            {"type": "single_message_confidence_not_in_allowed_languages", "values": {"threshold": 0.5}},
+        ], relation="or")
+        chat = make_chat([or_rule, or_rule])
+
+        context, _ = make_context([{"lang": "fr", "prob": 0.9}])
+
+        assert len(await engine.triggered_rules(chat, context)) == 2
+        assert [index for index, _ in await engine.triggered_rules(chat, context, first_only=True)] == [0]
+
+    def test_compiled_rules_cached_until_settings_version_changes(self):
+        """Test that rules are recompiled only when the settings version changes."""
+        from middlewares.database.rule_engine import RuleEngine
+
+        engine = RuleEngine(max_chats=8)
+        rule = make_rule([{"type": "single_message_confidence_not_in_allowed_languages", "values": {"threshold": 0.8}}])
+
+        first = engine.get_compiled_rules(make_chat([rule], version=1))
+        assert engine.get_compiled_rules(make_chat([rule], version=1)) is first
+        assert engine.get_compiled_rules(make_chat([rule], version=2)) is not first
+
+
+class TestRestrictionAggregates:
+    """Test suite for the incrementally maintained restriction aggregates."""
+
+    def test_increments_cover_chat_and_all_chats(self):
+        """Test the $inc document written with each new restriction."""
+        from middlewares.database.restriction_aggregates import aggregate_increments
+
+        increments = aggregate_increments("-100", "timeout", 600, timestamp=7200.0)
+
+        assert increments == {
+            "restriction_aggregates.-100.timeout.count": 1,
+            "restriction_aggregates.-100.timeout.duration_buckets.2": 600,
+            "restriction_aggregates.all.timeout.count": 1,
+            "restriction_aggregates.all.timeout.duration_buckets.2": 600,
+        }
+
+    def test_counts_by_scope_and_type(self):
+        """Test count queries per chat, across chats and for any type."""
+        from middlewares.database.restriction_aggregates import build_restriction_aggregates, count_restrictions
+
+        aggregates = build_restriction_aggregates([
+            make_record("warning"), make_record("warning", chat_id="-200"), make_record("timeout", duration=60)
+        ])
+
+        assert count_restrictions(aggregates, "-100", frozenset({"warning"})) == 1
+        assert count_restrictions(aggregates, "all", frozenset({"warning"})) == 2
+        assert count_restrictions(aggregates, "-100", None) == 2
+        assert count_restrictions(aggregates, "-300", None) == 0
+
+    def test_duration_window_skips_old_buckets(self):
+        """Test that only restrictions inside the sliding window are summed."""
+        import time
+        from middlewares.database.restriction_aggregates import build_restriction_aggregates, restriction_seconds_since
+
+        aggregates = build_restriction_aggregates([
+            make_record("timeout", duration=300),
+            make_record("timeout", hours_ago=48, duration=10_000),
+        ])
+
+        assert restriction_seconds_since(aggregates, "-100", None, time.time() - 3 * 3600) == 300
+        assert restriction_seconds_since(aggregates, "-100", None, time.time() - 72 * 3600) == 10_300
+
+    @pytest.mark.asyncio
+    async def test_users_without_aggregates_are_rebuilt_once(self):
+        """Test the fallback for restrictions recorded before aggregates existed."""
+        from middlewares.database.restriction_aggregates import build_restriction_aggregates
+        from middlewares.database.rule_engine import RuleContext
+
+        history = [make_record("warning"), make_record("warning")]
+        user = Mock(user_id=1, restriction_history=history, restriction_aggregates={})
+        db = Mock()
+        db.get_user = AsyncMock(return_value=user)
+        db.rebuild_restriction_aggregates = AsyncMock(return_value=build_restriction_aggregates(history))
+
+        context = RuleContext(db, 1, "-100", "text", [])
+        await context.get_restriction_aggregates()
+        aggregates = await context.get_restriction_aggregates()
+
+        assert aggregates["-100"]["warning"].count == 2
+        db.rebuild_restriction_aggregates.assert_awaited_once_with(1, user)
+
+
+class TestLanguageWindows:
+    """Test suite for the rolling language conditions and their per-user windows."""
+
+    def test_sample_sums_non_allowed_languages(self):
+        """Test the per-message sample stored in the window."""
+        from middlewares.database.language_windows import non_allowed_probability
+
+        result = [{"lang": "ru", "prob": 0.6}, {"lang": "uk", "prob": 0.3}, {"lang": "bg", "prob": 0.1}]
+
+        assert non_allowed_probability(result, ["uk", "en"]) == pytest.approx(0.7)
+        assert non_allowed_probability(result, ["uk", "ru", "bg"]) == 0.0
+        assert non_allowed_probability([], ["uk"]) == 0.0
+
+    def test_window_is_bounded(self):
+        """Test that the ring buffer keeps only the newest samples."""
+        from middlewares.database.language_windows import push_sample
+
+        window = []
+        for sample in range(10):
+            push_sample(window, sample / 10, 4)
+
+        assert window == [0.6, 0.7, 0.8, 0.9]
+
+    def test_short_history_cannot_reach_a_high_share(self):
+        """Test that missing messages count as allowed in the rolling share."""
+        from middlewares.database.language_windows import rolling_share
+
+        assert rolling_share([0.95], 10, 0.8) == 0.1
+        assert rolling_share([0.1] * 20 + [0.9] * 6, 10, 0.8) == 0.6
+
+    @pytest.mark.asyncio
+    async def test_rolling_share_rule(self):
+        """Test the share-of-last-N-messages condition."""
+        from middlewares.database.rule_engine import RuleEngine
+
+        engine = RuleEngine(max_chats=8)
+        chat = make_chat([make_rule([{
+            "type": "rolling_share_not_in_allowed_languages",
+            "values": {"messages": 5, "share": 0.6, "threshold": 0.8}
+        }])])
+
+        assert await engine.triggered_rules(chat, window_context([0.9])) == []
+        assert await engine.triggered_rules(chat, window_context([0.1, 0.9, 0.9, 0.2, 0.9])) != []
+
+    @pytest.mark.asyncio
+    async def test_ewma_rule(self):
+        """Test the EWMA condition: one outlier is damped, a sustained run is not."""
+        from middlewares.database.rule_engine import RuleEngine
+
+        engine = RuleEngine(max_chats=8)
+        chat = make_chat([make_rule([{
+            "type": "ewma_not_in_allowed_languages",
+            "values": {"alpha": 0.3, "threshold": 0.6}
+        }])])
+
+        assert await engine.triggered_rules(chat, window_context([0.0] * 10 + [1.0])) == []
+        assert await engine.triggered_rules(chat, window_context([0.0] * 10 + [1.0] * 5)) != []
+
+
+class TestFloodTracker:
+    """Test suite for the in-memory message rate tracking."""
+
+    def _tracker(self, **overrides):
+        from middlewares.database.flood_tracker import FloodTracker
+
+        options = {"shards": 4, "max_events": 5, "max_users": 8, "idle_seconds": 60}
+        options.update(overrides)
+        return FloodTracker(**options)
+
+    def test_counts_messages_in_window(self):
+        """Test counting a user's messages per chat within a sliding window."""
+        tracker = self._tracker()
+        for now in (0, 10, 20, 30):
+            tracker.record("-100", 1, now=now)
+        tracker.record("-200", 1, now=30)
+
+        assert tracker.count("-100", 1, 15, now=30) == 2
+        assert tracker.count("-100", 1, 60, now=30) == 4
+        assert tracker.count("-200", 1, 60, now=30) == 1
+        assert tracker.count("-100", 2, 60, now=30) == 0
+
+    def test_events_per_user_are_bounded(self):
+        """Test that only the newest max_events timestamps are kept."""
+        tracker = self._tracker()
+        for now in range(20):
+            tracker.record("-100", 1, now=now)
+
+        assert tracker.count("-100", 1, 60, now=20) == 5
+
+    def test_idle_and_excess_users_are_evicted(self):
+        """Test eviction of idle entries and of the least recent ones over capacity."""
+        tracker = self._tracker(shards=1, max_users=2)
+        tracker.record("-100", 1, now=0)
+        tracker.record("-100", 2, now=50)
+        tracker.record("-100", 3, now=100)
+
+        # User 1 went idle
+        assert len(tracker) == 2
+        assert tracker.count("-100", 1, 1000, now=100) == 0
+
+        # User 2 is the least recent one over capacity
+        tracker.record("-100", 4, now=101)
+        assert len(tracker) == 2
+        assert tracker.count("-100", 2, 1000, now=101) == 0
+        assert tracker.count("-100", 3, 1000, now=101) == 1
+
+    @pytest.mark.asyncio
+    async def test_rate_rules_run_at_ingestion_only(self):
+        """Test that rate-only rules are evaluated at ingestion and skipped after analysis."""
+        from middlewares.database.flood_tracker import flood_tracker
+        from middlewares.database.rule_engine import RuleEngine, STAGE_INGESTION
+
+        engine = RuleEngine(max_chats=8)
+        chat = make_chat([
+            make_rule([{"type": "message_rate", "values": {"messages": 2, "seconds": 60}}], name="flood"),
+            make_rule([
+                {"type": "message_rate", "values": {"messages": 2, "seconds": 60}},
+                {"type": "single_message_confidence_not_in_allowed_languages", "values": {"threshold": 0.5}},
+            ], name="foreign flood"),
+        ])
+        for _ in range(3):
+            flood_tracker.record("-100", 4242)
+
+        context, _ = make_context([{"lang": "ru", "prob": 0.9}], user_id=4242)
+
+        assert engine.has_rules(chat, STAGE_INGESTION)
+        assert [index for index, _ in await engine.triggered_rules(chat, context, stage=STAGE_INGESTION)] == [0]
+        assert [index for index, _ in await engine.triggered_rules(chat, context)] == [1]
+
+    @pytest.mark.asyncio
+    async def test_burst_triggers_rate_rule_once(self):
+        """Test that the messages of one burst past the limit produce one restriction, not one each."""
+        from middlewares.database.flood_tracker import flood_tracker
+        from middlewares.database.rule_engine import RuleEngine, STAGE_INGESTION
+
+        engine = RuleEngine(max_chats=8)
+        chat = make_chat([make_rule([{"type": "message_rate", "values": {"messages": 10, "seconds": 60}}], name="flood")])
+
+        fired = 0
+        for _ in range(15):
+            flood_tracker.record("-100", 4343)
+            context, _ = make_context([], user_id=4343)
+            fired += len(await engine.triggered_rules(chat, context, stage=STAGE_INGESTION))
+
+        assert fired == 1
+
+
+class TestAdminNotificationDigest:
+    """Test suite for coalescing admin notifications into digests."""
+
+    @pytest.mark.asyncio
+    async def test_first_notification_is_immediate_then_digested(self):
+        """Test that a burst costs one immediate message and one digest."""
+        import asyncio
+        from backend.queue_handlers.worker_results_queue.admin_digest import AdminNotificationDigest
+
+        digest = AdminNotificationDigest(window_seconds=0.05, max_lines=2)
+        with patch("backend.queue_handlers.worker_results_queue.admin_digest.rabbitmq_manager") as manager:
+            manager.store_result = AsyncMock()
+            for index in range(4):
+                await digest.notify(-100, f"violation {index}")
+            await digest.notify(-200, "other chat")
+
+            assert manager.store_result.await_count == 2
+            await asyncio.sleep(0.15)
+
+        texts = [call.args[2]["text"] for call in manager.store_result.await_args_list]
+        assert texts[:2] == ["violation 0", "other chat"]
+        assert len(texts) == 3
+        assert texts[2].startswith("3 rule violations")
+        assert "violation 1" in texts[2] and "violation 3" not in texts[2]
+        assert texts[2].endswith("...and 1 more")
+        assert digest._windows == {}
+
+    @pytest.mark.asyncio
+    async def test_flush_all_sends_pending_digests(self):
+        """Test that shutdown sends what the open windows collected."""
+        from backend.queue_handlers.worker_results_queue.admin_digest import AdminNotificationDigest
+
+        digest = AdminNotificationDigest(window_seconds=60, max_lines=10)
+        with patch("backend.queue_handlers.worker_results_queue.admin_digest.rabbitmq_manager") as manager:
+            manager.store_result = AsyncMock()
+            await digest.notify(-100, "first")
+            await digest.notify(-100, "second")
+            await digest.flush_all()
+
+        assert manager.store_result.await_count == 2
+        assert "second" in manager.store_result.await_args_list[1].args[2]["text"]
+
+    def test_digest_fits_a_telegram_message(self):
+        """Test that long digests are cut below Telegram's message length limit."""
+        from backend.queue_handlers.worker_results_queue.admin_digest import build_digest, MAX_DIGEST_LENGTH
+
+        text = build_digest(["x" * 1000] * 10, 0, 30)
+
+        assert len(text) <= MAX_DIGEST_LENGTH + 20
+        assert text.startswith("10 rule violations") and text.endswith("more")
+
+
+class TestRuleBacktester:
+    """Test suite for the vectorized offline rule backtest."""
+
+    def _docs(self):
+        base = datetime(2024, 1, 1, 12, 0, 0)
+
+        def message(minutes, lang, prob):
+            return {"timestamp": str(base + timedelta(minutes=minutes)), "analysis_result": [{"lang": lang, "prob": prob}]}
+
+        return [
+            {
+                "user_id": 1,
+                # Stored out of order on purpose
+                "chat_history": {"-100": [message(3, "ru", 0.9), message(0, "uk", 0.99), message(1, "ru", 0.95), message(2, "ru", 0.6)]},
+                "restriction_history": [
+                    {"chat_id": "-100", "restriction_type": "warning", "rule_index": 0,
+                     "timestamp": (base + timedelta(minutes=1, seconds=30)).isoformat(), "duration_seconds": None},
+                ],
+            },
+            {
+                "user_id": 2,
+                "chat_history": {"-100": [message(0, "en", 0.99), message(0.1, "en", 0.99), message(0.2, "de", 0.9)], "-200": [message(0, "ru", 0.99)]},
+                "restriction_history": [],
+            },
+            {"user_id": 3, "chat_history": {"-100": [{"timestamp": str(base), "analysis_result": None}]}, "restriction_history": []},
+        ]
+
+    def _backtest(self, conditions, relation="and"):
+        from backend.functions.backtest.rule_backtester import backtest_chat
+        from middlewares.database.models import ChatSettings
+
+        rule = make_rule(conditions, relation=relation)
+        return backtest_chat(self._docs(), -100, [rule], ChatSettings(allowed_languages=["uk", "en"]))
+
+    def test_single_message_conditions(self):
+        """Test language conditions over the columns; unanalyzed messages are skipped."""
+        pytest.importorskip("numpy")
+
+        report = self._backtest([{"type": "single_message_confidence_not_in_allowed_languages", "values": {"threshold": 0.8}}])
+
+        assert report["messages"] == 7
+        assert report["users"] == 2
+        assert report["rules"][0]["restrictions"] == 3
+        assert report["rules"][0]["users"] == 2
+        assert report["rules"][0]["recorded"] == 1
+
+    def test_rolling_conditions_match_the_live_windows(self):
+        """Test that rolling share and EWMA agree with the live window functions."""
+        pytest.importorskip("numpy")
+        from middlewares.database.language_windows import ewma, rolling_share
+
+        # User 1 in time order: 0.0, 0.95, 0.6, 0.9; user 2: 0.0, 0.0, 0.9
+        live_shares = [rolling_share(w, 3, 0.8) for w in ([0.0], [0.0, 0.95], [0.0, 0.95, 0.6], [0.0, 0.95, 0.6, 0.9], [0.0], [0.0, 0.0], [0.0, 0.0, 0.9])]
+        live_ewma = [ewma(w, 0.5) for w in ([0.0], [0.0, 0.95], [0.0, 0.95, 0.6], [0.0, 0.95, 0.6, 0.9], [0.0], [0.0, 0.0], [0.0, 0.0, 0.9])]
+
+        share = self._backtest([{"type": "rolling_share_not_in_allowed_languages", "values": {"messages": 3, "share": 0.6, "threshold": 0.8}}])
+        average = self._backtest([{"type": "ewma_not_in_allowed_languages", "values": {"alpha": 0.5, "threshold": 0.5}}])
+
+        assert share["rules"][0]["restrictions"] == sum(value >= 0.6 for value in live_shares)
+        assert average["rules"][0]["restrictions"] == sum(value >= 0.5 for value in live_ewma)
+
+    def test_rate_and_history_conditions(self):
+        """Test message rate windows and restriction counts that only see earlier restrictions."""
+        pytest.importorskip("numpy")
+
+        rate = self._backtest([{"type": "message_rate", "values": {"messages": 2, "seconds": 30}}])
+        history = self._backtest([{"type": "previous_restriction_type_count", "values": {"restriction_type": ["warning"], "count": 1}}])
+
+        # Only user 2 sent three messages within 30 seconds
+        assert rate["rules"][0]["restrictions"] == 1
+        # User 1's messages after the warning at minute 1.5
+        assert history["rules"][0]["restrictions"] == 2
+
+    @pytest.mark.asyncio
+    async def test_command_backtests_candidate_rules_in_a_process(self):
+        """Test that candidate rules sent with the command are backtested in the process pool."""
+        pytest.importorskip("numpy")
+        from backend.queue_handlers.general_queue import backtest_rules_command as command
+
+        chat = make_chat([], ["uk", "en"])
+        chat.users = [1, 2, 3]
+        candidate = {"name": "<b>flood</b>", "message": "Slow down", "conditions": [{"type": "message_rate", "values": {"messages": 2, "seconds": 30}}]}
+        with patch.object(command.database, "get_effective_chat", AsyncMock(return_value=chat)), \
+             patch.object(command.database, "get_backtest_documents", AsyncMock(return_value=self._docs())), \
+             patch.object(command.rabbitmq_manager, "store_result", AsyncMock()) as store_result:
+            try:
+                await command.handle_backtest_rules_command({"chat_id": -100, "user_id": 1, "message_id": 5, "rules": [candidate]})
+            finally:
+                command.shutdown_backtest_executor()
+
+        report = store_result.await_args.args[2]["report"]
+        assert "Would restrict: <b>1</b> times" in report
+        assert "&lt;b&gt;flood&lt;/b&gt;" in report
+
+    @pytest.mark.asyncio
+    async def test_command_reports_invalid_candidate_rules(self):
+        """Test that candidate rules failing validation are reported instead of raising."""
+        from backend.queue_handlers.general_queue import backtest_rules_command as command
+
+        chat = make_chat([], ["uk", "en"])
+        chat.users = [1]
+        with patch.object(command, "numpy_available", return_value=True), \
+             patch.object(command.database, "get_effective_chat", AsyncMock(return_value=chat)), \
+             patch.object(command.database, "get_backtest_documents", AsyncMock()) as get_documents, \
+             patch.object(command.rabbitmq_manager, "store_result", AsyncMock()) as store_result:
+            await command.handle_backtest_rules_command({"chat_id": -100, "user_id": 1, "message_id": 5, "rules": [{"name": "no conditions"}]})
+
+        report = store_result.await_args.args[2]["report"]
+        assert report.startswith("The candidate rules are not valid moderation rules")
+        assert "conditions" in report
+        get_documents.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_command_reports_a_failed_backtest(self):
+        """Test that a backtest failing in the process pool is reported instead of leaving the admin unanswered."""
+        from concurrent.futures.process import BrokenProcessPool
+        from backend.queue_handlers.general_queue import backtest_rules_command as command
+
+        chat = make_chat([make_rule([{"type": "message_rate", "values": {"messages": 2, "seconds": 30}}])])
+        chat.users = [1]
+        with patch.object(command, "numpy_available", return_value=True), \
+             patch.object(command, "backtest_chat", side_effect=BrokenProcessPool("pool died")), \
+             patch.object(command, "_get_executor", return_value=None), \
+             patch.object(command.database, "get_effective_chat", AsyncMock(return_value=chat)), \
+             patch.object(command.database, "get_backtest_documents", AsyncMock(return_value=[])), \
+             patch.object(command.rabbitmq_manager, "store_result", AsyncMock()) as store_result:
+            await command.handle_backtest_rules_command({"chat_id": -100, "user_id": 1, "message_id": 5})
+
+        report = store_result.await_args.args[2]["report"]
+        assert report.startswith("The backtest failed")
+        assert "pool died" in report
@@ -0,0 +1,103 @@
+import pytest
+
+from middlewares.monitoring.metrics import MetricsRegistry
+
+
+class TestMetricsRegistry:
+    """Test suite for the Prometheus text rendering of metrics."""
+
+    def test_render_counter_and_gauge(self):
+        """Test counter and gauge samples with labels."""
+        registry = MetricsRegistry()
+        counter = registry.counter("decisions_total", "Decisions", ["direction"])
+        gauge = registry.gauge("depth", "Depth")
+
+        counter.inc(direction="up")
+        counter.inc(2, direction="up")
+        gauge.set(7)
+
+        output = registry.render()
+        assert "# TYPE decisions_total counter" in output
+        assert 'decisions_total{direction="up"} 3.0' in output
+        assert "depth 7.0" in output
+
+    def test_render_histogram_buckets_are_cumulative(self):
+        """Test histogram bucket, sum and count samples."""
+        registry = MetricsRegistry()
+        histogram = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        output = registry.render()
+        assert 'latency_seconds_bucket{le="0.1"} 1.0' in output
+        assert 'latency_seconds_bucket{le="1.0"} 2.0' in output
+        assert 'latency_seconds_bucket{le="+Inf"} 3.0' in output
+        assert "latency_seconds_count 3.0" in output
+
+    def test_registry_rejects_conflicting_definitions(self):
+        """Test that re-registering a name with other labels fails."""
+        registry = MetricsRegistry()
+        registry.counter("events_total", "Events", ["type"])
+
+        assert registry.counter("events_total", "Events", ["type"]) is not None
+        with pytest.raises(ValueError):
+            registry.gauge("events_total", "Events", ["type"])
+
+
+class TestLoopMonitor:
+    """Test suite for the event loop lag and slow callback monitor."""
+
+    @pytest.mark.asyncio
+    async def test_blocking_callback_is_reported_by_name(self):
+        """Test that a coroutine blocking the loop is counted under its name."""
+        import asyncio
+        import time
+        from middlewares.monitoring.loop_monitor import LoopMonitor, slow_callbacks_counter
+
+        async def blocking_handler():
+            time.sleep(0.06)
+
+        monitor = LoopMonitor(probe_interval=0.01, slow_callback_threshold=0.05)
+        monitor.start()
+        try:
+            await asyncio.create_task(blocking_handler())
+        finally:
+            monitor.stop()
+
+        name = "TestLoopMonitor.test_blocking_callback_is_reported_by_name.<locals>.blocking_handler"
+        assert slow_callbacks_counter.get(callback=name) == 1
+
+    @pytest.mark.asyncio
+    async def test_lag_probe_measures_delay(self):
+        """Test that the probe observes the lag caused by blocking the loop."""
+        import asyncio
+        import time
+        from middlewares.monitoring.loop_monitor import LoopMonitor, loop_lag_histogram
+
+        monitor = LoopMonitor(probe_interval=0.01, slow_callback_threshold=10.0)
+        before = loop_lag_histogram.get_count()
+        monitor.start()
+        try:
+            await asyncio.sleep(0)
+            time.sleep(0.05)
+            await asyncio.sleep(0.03)
+        finally:
+            monitor.stop()
+
+        assert loop_lag_histogram.get_count() > before
+        assert loop_lag_histogram.get_sum() >= 0.03
+
+    def test_stop_restores_handle_run(self):
+        """Test that stopping the monitor uninstalls the callback timer."""
+        import asyncio
+        from middlewares.monitoring.loop_monitor import LoopMonitor
+
+        original_run = asyncio.Handle._run
+        monitor = LoopMonitor(probe_interval=1.0, slow_callback_threshold=1.0)
+        monitor._install_callback_timer()
+        assert asyncio.Handle._run is not original_run
+
+        monitor.stop()
+        assert asyncio.Handle._run is original_run
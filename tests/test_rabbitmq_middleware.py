@@ -0,0 +1,559 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, Mock
+
+from middlewares.rabbitmq.queue_manager import ChannelPool
+
+
+class FakeChannel:
+    def __init__(self):
+        self.is_closed = False
+
+
+class TestChannelPool:
+    """Test suite for the pooled publishing channels."""
+
+    @pytest.fixture
+    def connection(self):
+        connection = Mock()
+        connection.channel = AsyncMock(side_effect=lambda: FakeChannel())
+        return connection
+
+    @pytest.mark.asyncio
+    async def test_channels_are_reused(self, connection):
+        """Test that sequential publishes reuse one channel."""
+        pool = ChannelPool(connection, max_size=2)
+
+        async with pool.acquire() as first:
+            pass
+        async with pool.acquire() as second:
+            pass
+
+        assert first is second
+        assert connection.channel.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_concurrent_checkout_is_bounded(self, connection):
+        """Test that concurrent publishers never get the same channel and never exceed the pool size."""
+        pool = ChannelPool(connection, max_size=2)
+        in_use = set()
+        max_in_use = 0
+
+        async def publish():
+            nonlocal max_in_use
+            async with pool.acquire() as channel:
+                assert channel not in in_use
+                in_use.add(channel)
+                max_in_use = max(max_in_use, len(in_use))
+                await asyncio.sleep(0.01)
+                in_use.discard(channel)
+
+        await asyncio.gather(*(publish() for _ in range(6)))
+
+        assert max_in_use == 2
+        assert connection.channel.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_closed_channel_is_replaced(self, connection):
+        """Test that a channel closed while idle is replaced at checkout."""
+        pool = ChannelPool(connection, max_size=1)
+
+        async with pool.acquire() as channel:
+            pass
+        channel.is_closed = True
+
+        async with pool.acquire() as replacement:
+            assert replacement is not channel
+            assert not replacement.is_closed
+
+    @pytest.mark.asyncio
+    async def test_closed_checkin_wakes_a_waiting_checkout(self, connection):
+        """Test that a channel closed while in use frees its slot for a task waiting on a full pool."""
+        pool = ChannelPool(connection, max_size=1)
+
+        async def wait_for_channel():
+            async with pool.acquire() as channel:
+                return channel
+
+        async with pool.acquire() as channel:
+            waiter = asyncio.create_task(wait_for_channel())
+            await asyncio.sleep(0)
+            channel.is_closed = True
+
+        replacement = await asyncio.wait_for(waiter, timeout=1)
+        assert replacement is not channel
+        assert connection.channel.await_count == 2
+
+
+class TestPublishMany:
+    """Test suite for batched publishing with per-message outcomes."""
+
+    @pytest.mark.asyncio
+    async def test_outcomes_follow_input_order(self):
+        """Test that a failed confirm is reported for its own message only."""
+        from middlewares.rabbitmq.queue_manager import RabbitMQMiddleware
+
+        channel = FakeChannel()
+        published = []
+
+        async def publish(message, routing_key):
+            published.append(routing_key)
+            if routing_key == "bad_queue":
+                raise RuntimeError("nacked")
+
+        channel.default_exchange = Mock()
+        channel.default_exchange.publish = publish
+        connection = Mock()
+        connection.channel = AsyncMock(return_value=channel)
+
+        manager = RabbitMQMiddleware()
+        manager._ensure_connected = AsyncMock()
+        manager.channel_pool = ChannelPool(connection, max_size=1)
+
+        outcomes = await manager.publish_many([
+            ("telegram_queue", "job-1", {"message_type": "admin_notification"}),
+            ("bad_queue", "job-2", {}),
+            ("telegram_queue", "job-3", {"message_type": "moderation_action"}),
+        ])
+
+        assert published == ["telegram_queue", "bad_queue", "telegram_queue"]
+        assert [outcome.job_id for outcome in outcomes] == ["job-1", "job-2", "job-3"]
+        assert [outcome.ok for outcome in outcomes] == [True, False, True]
+        assert isinstance(outcomes[1].error, RuntimeError)
+        assert connection.channel.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_empty_batch_does_not_connect(self):
+        """Test that an empty batch is a no-op."""
+        from middlewares.rabbitmq.queue_manager import RabbitMQMiddleware
+
+        manager = RabbitMQMiddleware()
+        manager._ensure_connected = AsyncMock()
+
+        assert await manager.publish_many([]) == []
+        manager._ensure_connected.assert_not_awaited()
+
+
+class TestMessageCodec:
+    """Test suite for the queue message wire codecs."""
+
+    @pytest.fixture
+    def analysis_result(self):
+        from middlewares.rabbitmq.mq_enums import WorkerResQueueMessageType
+        return {
+            "message_type": WorkerResQueueMessageType.TEXT_ANALYSIS_COMPLETED,
+            "text": "Привіт світ",
+            "chat_id": "-1001234567890",
+            "message_id": "42",
+            "user_id": 123456789,
+            "analysis_result": [{"lang": "uk", "prob": 0.99}],
+        }
+
+    def test_json_round_trip(self, analysis_result):
+        """Test that the JSON codec keeps the legacy envelope."""
+        from middlewares.rabbitmq.codec import encode_message, decode_message, JSON_CONTENT_TYPE
+        import json
+
+        body = encode_message("job-1", analysis_result, JSON_CONTENT_TYPE)
+
+        assert json.loads(body)["job_id"] == "job-1"
+        decoded = decode_message(body, JSON_CONTENT_TYPE)
+        assert decoded["result"]["message_type"] == "text_analysis_completed"
+
+    def test_missing_content_type_is_json(self, analysis_result):
+        """Test that messages from producers without a content type still decode."""
+        from middlewares.rabbitmq.codec import encode_message, decode_message
+
+        body = encode_message("job-1", analysis_result)
+
+        assert decode_message(body, None)["result"]["text"] == "Привіт світ"
+
+    def test_msgpack_round_trip_with_type_tags(self, analysis_result):
+        """Test the compact codec: smaller body, integer type tag on the wire, same decoded payload."""
+        msgpack = pytest.importorskip("msgpack")
+        from middlewares.rabbitmq.codec import encode_message, decode_message, MSGPACK_CONTENT_TYPE, MESSAGE_TYPE_TAGS
+
+        body = encode_message("job-1", analysis_result, MSGPACK_CONTENT_TYPE)
+        job_id, raw_result = msgpack.unpackb(body, raw=False)
+
+        assert job_id == "job-1"
+        assert raw_result["message_type"] == MESSAGE_TYPE_TAGS["text_analysis_completed"]
+        assert len(body) < len(encode_message("job-1", analysis_result))
+
+        decoded = decode_message(body, MSGPACK_CONTENT_TYPE)
+        assert decoded["job_id"] == "job-1"
+        assert decoded["result"]["message_type"] == "text_analysis_completed"
+        assert decoded["result"]["analysis_result"] == [{"lang": "uk", "prob": 0.99}]
+
+    def test_type_tags_are_stable(self):
+        """Test that new message types are appended without renumbering the existing tags."""
+        from middlewares.rabbitmq.codec import MESSAGE_TYPE_TAGS
+        from middlewares.rabbitmq.mq_enums import GeneralBackendQueueMessageType, TelegramQueueMessageType, WorkerResQueueMessageType
+
+        assert MESSAGE_TYPE_TAGS["text_to_analyze"] == 0
+        assert MESSAGE_TYPE_TAGS["chat_stats_command_answer"] == 17
+        assert MESSAGE_TYPE_TAGS["text_analysis_completed"] == 24
+        for enum in (GeneralBackendQueueMessageType, TelegramQueueMessageType, WorkerResQueueMessageType):
+            assert all(message_type.value in MESSAGE_TYPE_TAGS for message_type in enum)
+
+    def test_unknown_content_type_is_rejected(self):
+        """Test that an unsupported content type raises."""
+        from middlewares.rabbitmq.codec import decode_message
+
+        with pytest.raises(ValueError):
+            decode_message(b"...", "application/xml")
+
+    def test_unknown_codec_falls_back_to_json(self):
+        """Test producer-side codec resolution."""
+        from middlewares.rabbitmq.codec import resolve_content_type, JSON_CONTENT_TYPE
+
+        assert resolve_content_type("json") == JSON_CONTENT_TYPE
+        assert resolve_content_type("protobuf") == JSON_CONTENT_TYPE
+
+
+class TestRequestReply:
+    """Test suite for correlation-id request/reply."""
+
+    @pytest.fixture
+    def manager(self):
+        from middlewares.rabbitmq.queue_manager import RabbitMQMiddleware
+
+        manager = RabbitMQMiddleware()
+        manager.published = []
+
+        channel = FakeChannel()
+        channel.default_exchange = Mock()
+
+        async def publish(message, routing_key):
+            manager.published.append((message, routing_key))
+
+        channel.default_exchange.publish = publish
+        connection = Mock()
+        connection.channel = AsyncMock(return_value=channel)
+
+        manager._ensure_connected = AsyncMock()
+        manager._ensure_reply_queue = AsyncMock()
+        manager._reply_queue = Mock()
+        manager._reply_queue.name = "amq.gen-reply"
+        manager.channel_pool = ChannelPool(connection, max_size=1)
+        return manager
+
+    @staticmethod
+    def make_reply(correlation_id, result):
+        from middlewares.rabbitmq.codec import encode_message
+
+        reply = Mock()
+        reply.correlation_id = correlation_id
+        reply.content_type = "application/json"
+        reply.body = encode_message(correlation_id, result)
+        return reply
+
+    @pytest.mark.asyncio
+    async def test_call_resolves_on_matching_reply(self, manager):
+        """Test that the reply with the request's correlation_id resolves the call."""
+        call = asyncio.ensure_future(manager.call("general_queue", {"message_type": "chat_stats_command_tg"}, timeout=1))
+        await asyncio.sleep(0)
+
+        request, routing_key = manager.published[0]
+        assert routing_key == "general_queue"
+        assert request.reply_to == "amq.gen-reply"
+
+        # Unrelated replies are ignored, not consumed as ours
+        await manager._on_reply(self.make_reply("someone-else", {"status": "ok"}))
+        assert not call.done()
+
+        await manager._on_reply(self.make_reply(request.correlation_id, {"status": "ok"}))
+        assert await call == {"status": "ok"}
+        assert manager._pending_replies == {}
+
+    @pytest.mark.asyncio
+    async def test_call_times_out_and_forgets_request(self, manager):
+        """Test that a missing reply raises TimeoutError and clears the pending future."""
+        with pytest.raises(asyncio.TimeoutError):
+            await manager.call("general_queue", {"message_type": "global_stats_command_tg"}, timeout=0.01)
+
+        assert manager._pending_replies == {}
+
+    @pytest.mark.asyncio
+    async def test_reply_skips_messages_without_reply_to(self, manager):
+        """Test that fire-and-forget messages get no reply."""
+        request = Mock()
+        request.reply_to = None
+
+        assert await manager.reply(request, {"status": "ok"}) is False
+        assert manager.published == []
+
+
+class TestBackendQueueRouting:
+    """Test suite for routing backend messages to per-workload queues."""
+
+    def test_ingestion_stays_on_general_queue(self):
+        """Test that TEXT_TO_ANALYZE keeps using general_queue."""
+        from middlewares.rabbitmq.routing import get_backend_queue
+        from middlewares.rabbitmq.mq_enums import GeneralBackendQueueMessageType
+
+        assert get_backend_queue(GeneralBackendQueueMessageType.TEXT_TO_ANALYZE) == "general_queue"
+
+    def test_global_reports_are_isolated(self):
+        """Test that global reports and interactive commands get separate queues."""
+        from middlewares.rabbitmq.routing import get_backend_queue
+        from middlewares.rabbitmq.mq_enums import GeneralBackendQueueMessageType
+
+        assert get_backend_queue(GeneralBackendQueueMessageType.GLOBAL_STATS_COMMAND_TG) == "reports_queue"
+        assert get_backend_queue(GeneralBackendQueueMessageType.GLOBAL_TOP_COMMAND_TG) == "reports_queue"
+        assert get_backend_queue(GeneralBackendQueueMessageType.GLOBAL_CHAT_RANKING_COMMAND_TG) == "reports_queue"
+        assert get_backend_queue(GeneralBackendQueueMessageType.MY_CHAT_STATS_COMMAND_TG) == "commands_queue"
+
+    def test_every_message_type_is_routed(self):
+        """Test that no message type silently falls back to the default workload."""
+        from middlewares.rabbitmq.routing import MESSAGE_TYPE_WORKLOADS
+        from middlewares.rabbitmq.mq_enums import GeneralBackendQueueMessageType
+
+        assert set(MESSAGE_TYPE_WORKLOADS) == set(GeneralBackendQueueMessageType)
+
+    def test_unknown_message_type_goes_to_commands(self):
+        """Test the fallback for unknown message types."""
+        from middlewares.rabbitmq.routing import get_backend_queue
+
+        assert get_backend_queue("something_new") == "commands_queue"
+        assert get_backend_queue(None) == "commands_queue"
+
+
+class TestMessageDispatcher:
+    """Test suite for the message-type dispatch registry."""
+
+    @pytest.mark.asyncio
+    async def test_dispatch_calls_registered_handler(self):
+        """Test that messages reach the handler registered for their type."""
+        from middlewares.rabbitmq.dispatcher import MessageDispatcher
+        from middlewares.rabbitmq.mq_enums import TelegramQueueMessageType
+
+        dispatcher = MessageDispatcher("test_dispatch")
+        handler = AsyncMock(return_value="done")
+        dispatcher.register(TelegramQueueMessageType.ADMIN_NOTIFICATION)(handler)
+
+        # Enum members and their raw string values select the same handler
+        result = await dispatcher.dispatch("admin_notification", "bot", {"text": "hi"})
+
+        assert result == "done"
+        handler.assert_awaited_once_with("bot", {"text": "hi"})
+
+    @pytest.mark.asyncio
+    async def test_dispatch_records_count_latency_and_errors(self):
+        """Test per-type metrics, including failed handlers."""
+        from middlewares.rabbitmq.dispatcher import (
+            MessageDispatcher, messages_counter, errors_counter, duration_histogram, in_flight_gauge
+        )
+
+        dispatcher = MessageDispatcher("test_metrics")
+        dispatcher.add_handler("ok_type", AsyncMock())
+        dispatcher.add_handler("bad_type", AsyncMock(side_effect=RuntimeError("boom")))
+
+        await dispatcher.dispatch("ok_type")
+        await dispatcher.dispatch("ok_type")
+        with pytest.raises(RuntimeError):
+            await dispatcher.dispatch("bad_type")
+
+        labels = {"dispatcher": "test_metrics"}
+        assert messages_counter.get(message_type="ok_type", **labels) == 2
+        assert messages_counter.get(message_type="bad_type", **labels) == 1
+        assert errors_counter.get(message_type="bad_type", **labels) == 1
+        assert errors_counter.get(message_type="ok_type", **labels) == 0
+        assert duration_histogram.get_count(message_type="ok_type", **labels) == 2
+        assert in_flight_gauge.get(message_type="bad_type", **labels) == 0
+
+    @pytest.mark.asyncio
+    async def test_unhandled_message_type(self):
+        """Test that unknown types are counted instead of raising."""
+        from middlewares.rabbitmq.dispatcher import MessageDispatcher, unhandled_counter
+
+        dispatcher = MessageDispatcher("test_unhandled")
+
+        assert await dispatcher.dispatch("nobody_handles_this") is None
+        assert unhandled_counter.get(dispatcher="test_unhandled") == 1
+
+    def test_duplicate_registration_is_rejected(self):
+        """Test that a message type cannot silently get two handlers."""
+        from middlewares.rabbitmq.dispatcher import MessageDispatcher
+
+        dispatcher = MessageDispatcher("test_duplicate")
+        dispatcher.add_handler("some_type", AsyncMock())
+
+        with pytest.raises(ValueError):
+            dispatcher.add_handler("some_type", AsyncMock())
+
+    def test_every_backend_message_type_has_a_handler(self):
+        """Test that the general queue dispatcher covers all backend message types."""
+        from backend.queue_handlers.general_queue.main_handler import general_queue_dispatcher
+        from middlewares.rabbitmq.mq_enums import GeneralBackendQueueMessageType
+
+        for message_type in GeneralBackendQueueMessageType:
+            assert general_queue_dispatcher.get_handler(message_type) is not None
+
+
+class TestQueueMetrics:
+    """Test suite for consumer throughput and queue lag metrics."""
+
+    def test_record_consumed_observes_lag(self):
+        """Test that lag is measured from the published_at header."""
+        import time
+        from middlewares.rabbitmq.queue_manager import RabbitMQMiddleware, consumed_counter, lag_histogram
+
+        manager = RabbitMQMiddleware()
+        message = Mock(routing_key="lag_test_queue", headers={"published_at": time.time() - 2.0})
+
+        manager.record_consumed(message)
+        manager.record_consumed(Mock(routing_key="lag_test_queue", headers=None))
+
+        assert consumed_counter.get(queue="lag_test_queue") == 2
+        assert lag_histogram.get_count(queue="lag_test_queue") == 1
+        assert lag_histogram.get_sum(queue="lag_test_queue") >= 2.0
+
+    def test_published_messages_carry_timestamp(self):
+        """Test that produced messages carry the header the lag metric relies on."""
+        from middlewares.rabbitmq.queue_manager import RabbitMQMiddleware
+
+        message = RabbitMQMiddleware()._build_message("job", {"message_type": "x"})
+
+        assert isinstance(message.headers["published_at"], float)
+
+
+class TestTraceContext:
+    """Test suite for per-message trace propagation across queue hops."""
+
+    @pytest.fixture
+    def exported(self, monkeypatch):
+        """Capture exported spans instead of writing them."""
+        from middlewares.monitoring import tracing
+
+        spans = []
+        monkeypatch.setattr(tracing.exporter, "export", spans.append)
+        monkeypatch.setattr(tracing.settings, "TRACING_ENABLED", True)
+        monkeypatch.setattr(tracing.settings, "TRACING_SAMPLE_RATE", 1.0)
+        return spans
+
+    def test_untraced_messages_carry_nothing(self, exported, monkeypatch):
+        """Test that unsampled messages get no trace key and record no spans."""
+        from middlewares.monitoring import tracing
+
+        monkeypatch.setattr(tracing.settings, "TRACING_SAMPLE_RATE", 0.0)
+        payload = {"message_type": "text_to_analyze"}
+
+        with tracing.start_span("bot.publish", tracing.new_trace()):
+            tracing.inject(payload)
+
+        assert "trace" not in payload
+        assert exported == []
+
+    def test_context_links_spans_across_hops(self, exported):
+        """Test that the next stage's spans are children of the publishing span."""
+        from middlewares.monitoring import tracing
+
+        payload = {"message_type": "text_to_analyze"}
+        with tracing.start_span("bot.publish", tracing.new_trace()) as publish_span:
+            tracing.inject(payload)
+
+        trace = tracing.extract(payload)
+        tracing.record_queue_wait("general_queue", trace)
+        with tracing.start_span("backend.text_to_analyze", trace):
+            with tracing.start_span("backend.sampling") as sampling_span:
+                pass
+
+        by_name = {span["name"]: span for span in exported}
+        assert {span["trace_id"] for span in exported} == {trace["trace_id"]}
+        assert by_name["queue_wait"]["parent_span_id"] == publish_span.span_id
+        assert by_name["queue_wait"]["attributes"] == {"queue": "general_queue"}
+        assert by_name["backend.text_to_analyze"]["parent_span_id"] == publish_span.span_id
+        assert by_name["backend.sampling"]["parent_span_id"] == by_name["backend.text_to_analyze"]["span_id"]
+        assert sampling_span.span_id == by_name["backend.sampling"]["span_id"]
+
+    def test_failed_span_records_error(self, exported):
+        """Test that exceptions are recorded on the span and re-raised."""
+        from middlewares.monitoring import tracing
+
+        with pytest.raises(ValueError):
+            with tracing.start_span("backend.moderation", tracing.new_trace()):
+                raise ValueError("bad rule")
+
+        assert "bad rule" in exported[0]["error"]
+
+    def test_context_survives_codec_round_trip(self, exported):
+        """Test that the trace context is preserved by both wire formats."""
+        from middlewares.monitoring import tracing
+        from middlewares.rabbitmq.codec import encode_message, decode_message, JSON_CONTENT_TYPE, MSGPACK_CONTENT_TYPE
+
+        with tracing.start_span("bot.publish", tracing.new_trace()):
+            payload = tracing.inject({"message_type": "text_to_analyze"})
+
+        for content_type in (JSON_CONTENT_TYPE, MSGPACK_CONTENT_TYPE):
+            decoded = decode_message(encode_message("job", payload, content_type), content_type)
+            assert tracing.extract(decoded["result"]) == payload["trace"]
+
+
+class TestQueuePayloadLogging:
+    """Test suite for redacted, sampled logging of queue payloads."""
+
+    def _record(self, level, message, *args):
+        import logging
+
+        return logging.LogRecord("backend.test", level, __file__, 1, message, args, None)
+
+    def test_payload_is_redacted_when_formatted(self):
+        """Test that user content is replaced by its length and ids are kept."""
+        from middlewares.monitoring.structured_logging import redacted
+
+        payload = {
+            "message_type": "text_to_analyze",
+            "user_id": 42,
+            "username": "alice",
+            "chat_message": {"chat_id": "-100", "content": "secret text"}
+        }
+
+        logged = str(redacted(payload))
+
+        assert "secret text" not in logged and "alice" not in logged
+        assert '"user_id": 42' in logged
+        assert "<redacted 11 chars>" in logged
+
+    def test_command_answers_are_redacted(self):
+        """Test that the rendered answers of stats, ranking and backtest commands are not logged."""
+        from middlewares.monitoring.structured_logging import redacted
+
+        for key in ("stats", "top_stats", "ranking_stats", "report"):
+            logged = str(redacted({"message_type": "answer", "chat_id": -100, key: "<b>alice</b>: 12"}))
+
+            assert "alice" not in logged
+            assert "<redacted 16 chars>" in logged
+
+    def test_sampling_by_payload_message_type(self, monkeypatch):
+        """Test per-type sampling; warnings and untyped records always pass."""
+        import logging
+        from middlewares.monitoring import structured_logging
+        from middlewares.monitoring.structured_logging import SamplingFilter, redacted
+
+        sampling_filter = SamplingFilter({"text_to_analyze": 0.1})
+        monkeypatch.setattr(structured_logging.random, "random", lambda: 0.5)
+
+        hot = redacted({"message_type": "text_to_analyze"})
+        assert not sampling_filter.filter(self._record(logging.INFO, "Received message: %s", hot))
+        assert sampling_filter.filter(self._record(logging.WARNING, "Received message: %s", hot))
+        assert sampling_filter.filter(self._record(logging.INFO, "Received message: %s", redacted({"message_type": "chat_stats"})))
+        assert sampling_filter.filter(self._record(logging.INFO, "Started consuming"))
+
+    def test_json_formatter_adds_message_type_and_trace(self, monkeypatch):
+        """Test the structured output of a payload record inside a traced span."""
+        import json
+        import logging
+        from middlewares.monitoring import tracing
+        from middlewares.monitoring.structured_logging import JsonFormatter, redacted
+
+        monkeypatch.setattr(tracing.exporter, "export", lambda span: None)
+        record = self._record(logging.INFO, "Received message: %s", redacted({"message_type": "chat_stats"}))
+        trace = {"trace_id": "abc123", "parent_span_id": None}
+
+        with tracing.start_span("backend.chat_stats", trace):
+            entry = json.loads(JsonFormatter().format(record))
+
+        assert entry["message_type"] == "chat_stats"
+        assert entry["trace_id"] == "abc123"
+        assert entry["level"] == "INFO"
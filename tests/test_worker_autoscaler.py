@@ -0,0 +1,86 @@
+import time
+import pytest
+from unittest.mock import Mock, patch
+
+from backend.worker_handlers.autoscaler import estimate_wait, compute_target_processes, QueueDepthAutoscaler
+
+
+class TestWorkerAutoscaler:
+    """Test suite for the queue-depth autoscaler decisions."""
+
+    def test_estimate_wait_uses_worse_of_age_and_throughput(self):
+        """Test the wait estimate from queue depth, head age and drain rate."""
+        assert estimate_wait(0, 30.0, 1.0) == 0.0
+        assert estimate_wait(100, 2.0, 10.0) == 10.0
+        assert estimate_wait(10, 8.0, 10.0) == 8.0
+        # No throughput measured yet: only the head age is known
+        assert estimate_wait(10, 3.0, 0.0) == 3.0
+
+    def test_scale_up_when_over_slo(self):
+        """Test growing the pool proportionally to the SLO overshoot."""
+        target = compute_target_processes(
+            current=2, depth=100, estimated_wait=20.0, slo=5.0,
+            min_processes=2, max_processes=8, scale_down_ratio=0.5
+        )
+        assert target == 8
+
+        target = compute_target_processes(
+            current=4, depth=10, estimated_wait=6.0, slo=5.0,
+            min_processes=2, max_processes=8, scale_down_ratio=0.5
+        )
+        assert target == 5
+
+    def test_scale_down_when_idle(self):
+        """Test shrinking one process at a time down to the minimum."""
+        assert compute_target_processes(4, 0, 0.0, 5.0, 2, 8, 0.5) == 3
+        assert compute_target_processes(2, 0, 0.0, 5.0, 2, 8, 0.5) == 2
+
+    def test_hold_within_band(self):
+        """Test that the pool size is kept between the scale-down and SLO thresholds."""
+        assert compute_target_processes(4, 10, 4.0, 5.0, 2, 8, 0.5) == 4
+
+    def _autoscaler(self, max_concurrency=6, min_concurrency=3):
+        with patch("backend.worker_handlers.autoscaler.start_metrics_server"):
+            autoscaler = QueueDepthAutoscaler(Mock(), max_concurrency, min_concurrency, worker=Mock())
+        return autoscaler
+
+    def test_bounds_come_from_the_autoscale_option(self):
+        """Test that the --autoscale max and min passed by Celery are kept."""
+        from celery.signals import task_received
+
+        autoscaler = self._autoscaler(6, 3)
+        task_received.disconnect(autoscaler._on_task_received)
+
+        assert (autoscaler.max_concurrency, autoscaler.min_concurrency) == (6, 3)
+
+    def test_probe_only_declares_the_queue(self):
+        """Test that the depth probe is a passive declare and never takes a message off the queue."""
+        from celery.signals import task_received
+
+        autoscaler = self._autoscaler()
+        task_received.disconnect(autoscaler._on_task_received)
+        channel = autoscaler.worker.app.connection_for_read.return_value.default_channel
+        channel.queue_declare.return_value = ("worker_queue", 12, 1)
+
+        assert autoscaler.probe_queue() == 12
+        assert channel.queue_declare.call_args.kwargs["passive"] is True
+        channel.basic_get.assert_not_called()
+        channel.basic_reject.assert_not_called()
+
+    def test_head_age_is_measured_from_received_messages(self):
+        """Test the head age from the enqueued_at header of received tasks."""
+        from celery.signals import task_received
+
+        autoscaler = self._autoscaler()
+        try:
+            now = time.time()
+            for waited in (2.0, 9.0, 4.0):
+                task_received.send(sender=None, request=Mock(request_dict={"enqueued_at": now - waited}))
+            task_received.send(sender=None, request=Mock(request_dict={}))
+        finally:
+            task_received.disconnect(autoscaler._on_task_received)
+
+        assert autoscaler._measure_head_age(depth=5, elapsed=5.0) == pytest.approx(9.0, abs=0.5)
+        # Nothing received since: the waiting head only got older
+        assert autoscaler._measure_head_age(depth=5, elapsed=5.0) == pytest.approx(14.0, abs=0.5)
+        assert autoscaler._measure_head_age(depth=0, elapsed=5.0) == 0.0